@@ -0,0 +1,363 @@
+#!/usr/bin/env python3
+
+import os, sys, json, time, random, argparse, platform, resource, tempfile, subprocess, contextlib
+from concurrent.futures import ProcessPoolExecutor
+
+from certman import *
+from certman.issue import issue_certificate_with_key
+
+import main as cli
+
+SCENARIOS = (
+    'tree_cold',
+    'tree_warm',
+    'tree_noindex',
+    'tree_openssl',
+    'get_cert',
+    'issue_single',
+    'issue_batch',
+)
+
+DEFAULT_THRESHOLD = 0.2
+
+SPAWN_COUNTER_ENV = 'CERTMAN_BENCH_SPAWNS'
+DEFAULT_MIN_SECONDS = 0.05
+
+
+class CountingOpenSSL(OpenSSL):
+    # batch workers run in other processes, so every spawn appends a byte to a shared file
+    def run(self, args, input=None, pass_fds=()):
+        counter_path = os.environ.get(SPAWN_COUNTER_ENV)
+        if counter_path:
+            with open(counter_path, 'ab') as fd:
+                fd.write(b'.')
+        return super().run(args, input=input, pass_fds=pass_fds)
+
+
+def command_line_parser():
+    parser = argparse.ArgumentParser(description="certman benchmarks")
+    subparsers = parser.add_subparsers(dest="command")
+
+    generate_parser = subparsers.add_parser("generate", help="build a synthetic store")
+    generate_parser.add_argument("store", metavar="STORE", help="directory to create the store in")
+    generate_parser.add_argument("--cas", type=int, default=10, help="number of CAs, default is 10")
+    generate_parser.add_argument("--leaves", type=int, default=1000,
+                                 help="number of leaves per CA, default is 1000")
+    generate_parser.add_argument("--bits", type=int, default=1024,
+                                 help="key size, small keys keep generation fast, default is 1024")
+    generate_parser.add_argument("-j", "--jobs", type=int, help="number of worker processes")
+
+    run_parser = subparsers.add_parser("run", help="run the benchmarks against a store")
+    run_parser.add_argument("store", metavar="STORE", help="store made by the generate command")
+    run_parser.add_argument("-o", "--output", metavar="FILE", help="write JSON results to FILE")
+    run_parser.add_argument("--only", metavar="NAME", action="append", choices=SCENARIOS,
+                            help="run only the named scenario, can be specified several times")
+    run_parser.add_argument("--lookups", type=int, default=100,
+                            help="number of get-cert lookups, default is 100")
+    run_parser.add_argument("--batch", type=int, default=50,
+                            help="number of certificates issued by issue_batch, default is 50")
+    run_parser.add_argument("--bits", type=int, default=2048,
+                            help="key size used by the issuance scenarios, default is 2048")
+    run_parser.add_argument("-j", "--jobs", type=int, help="worker processes for issue_batch")
+    run_parser.add_argument("-r", "--repeat", type=int, default=3,
+                            help="run every scenario this many times and keep the fastest, default is 3")
+
+    scenario_parser = subparsers.add_parser("scenario", help=argparse.SUPPRESS)
+    scenario_parser.add_argument("name", choices=SCENARIOS)
+    scenario_parser.add_argument("store")
+    scenario_parser.add_argument("--lookups", type=int, default=100)
+    scenario_parser.add_argument("--batch", type=int, default=50)
+    scenario_parser.add_argument("--bits", type=int, default=2048)
+    scenario_parser.add_argument("-j", "--jobs", type=int)
+
+    compare_parser = subparsers.add_parser("compare", help="compare results against a baseline")
+    compare_parser.add_argument("baseline", metavar="BASELINE", help="saved JSON results")
+    compare_parser.add_argument("current", metavar="CURRENT", help="new JSON results")
+    compare_parser.add_argument("-t", "--threshold", type=float, default=DEFAULT_THRESHOLD,
+                                help="allowed relative slowdown or memory growth, default is 0.2")
+    compare_parser.add_argument("-m", "--min-seconds", type=float, default=DEFAULT_MIN_SECONDS,
+                                help="ignore slowdowns smaller than this, default is 0.05")
+
+    return parser
+
+
+def generate_ca(store, openssl, name, bits, key_path):
+    context = Context(name, is_ca=True, ca_context=Store.self_signed_context())
+    request = Request(DNSection(common_name=name), is_ca=True, bits=bits)
+    issue_certificate_with_key(store, openssl, context, request, key_path)
+
+
+def generate_leaves(store, ca_name, names, bits, key_path):
+    openssl = OpenSSL()
+    ca_context = Context(ca_name, is_ca=True)
+    serials = SerialAllocator(store).reserve(ca_context, len(names))
+    with store.group_commit():
+        for name, serial in zip(names, serials):
+            context = Context(name, ca_context=ca_context)
+            request = Request(DNSection(common_name=name), domain_names=[ name ], bits=bits)
+            issue_certificate_with_key(store, openssl, context, request, key_path, serial=serial)
+            clean_temp_files()
+    return len(names)
+
+
+def handle_generate(args):
+    os.makedirs(args.store, exist_ok=True)
+    store = Store(root_dir=args.store)
+    openssl = OpenSSL()
+
+    # one shared key: signing is what matters here, key generation is not measured
+    key_path = os.path.join(store.key_dir, 'bench-shared.key')
+    os.makedirs(store.key_dir, mode=Store.PRIVATE_KEY_SUBDIR_PERMS, exist_ok=True)
+    with open(key_path, 'wt', opener=Store.restricted_opener) as fd:
+        fd.write(openssl.generate_rsa_key(args.bits))
+
+    ca_names = [ 'bench-ca-{:03d}'.format(num) for num in range(args.cas) ]
+    for ca_name in ca_names:
+        generate_ca(store, openssl, ca_name, args.bits, key_path)
+
+    leaf_names = [ 'leaf-{:06d}'.format(num) for num in range(args.leaves) ]
+
+    # one task per CA: each reserves its serials at once and commits its own directory
+    started = time.monotonic()
+    with ProcessPoolExecutor(max_workers=args.jobs) as executor:
+        futures = [ executor.submit(generate_leaves, store, ca_name, leaf_names, args.bits, key_path)
+                    for ca_name in ca_names ]
+        total = sum(future.result() for future in futures)
+
+    print('{} CAs, {} leaves generated in {:.1f}s'.format(
+        len(ca_names), total, time.monotonic() - started))
+
+
+@contextlib.contextmanager
+def quiet_stdout():
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        yield
+
+
+def scenario_tree(store, parser=PARSER_NATIVE, use_index=True, drop_index=False):
+    openssl = CountingOpenSSL(parser=parser)
+    index = None
+    if use_index:
+        index = StoreIndex(store, openssl)
+        if drop_index and os.path.exists(index.path):
+            os.unlink(index.path)
+
+    with quiet_stdout():
+        cli.list_tree(index or openssl, store, load_cert=not index)
+
+
+def scenario_get_cert(store, lookups):
+    openssl = CountingOpenSSL()
+    paths = [ (ca.basename, ctx.basename)
+              for ca in store.get_ca_certs(load_cert=False)
+              for ctx in store.get_certs(ca, load_cert=False) ]
+    rng = random.Random(0)
+    for ca_name, name in rng.sample(paths, min(lookups, len(paths))):
+        context = Context(name, ca_context=Context(ca_name, is_ca=True))
+        store.load_context(context, load_cert=True, load_key=True)
+        openssl.get_info(context)
+
+
+def bench_ca_name(store):
+    for ca_context in store.get_ca_certs(load_cert=False):
+        return ca_context.basename
+    raise Exception("The store has no CA certificates")
+
+
+def scenario_issue(store, count, bits, jobs):
+    openssl = CountingOpenSSL()
+    ca_name = bench_ca_name(store)
+    prefix = 'bench-issue-{}-{}'.format(os.getpid(), int(time.time()))
+    entries = [ BatchEntry('{}-{}'.format(prefix, num), ca_basename=ca_name,
+                           request=Request(DNSection(common_name='{}-{}'.format(prefix, num)),
+                                           domain_names=[ 'bench.invalid' ], bits=bits))
+                for num in range(count) ]
+
+    errors = validate_batch(store, entries)
+    if errors:
+        raise Exception(errors[0].error)
+
+    results = issue_batch(store, entries, openssl=openssl, jobs=jobs)
+    failed = [ r for r in results if r.error ]
+    if failed:
+        raise Exception(failed[0].error)
+
+    return [ entry.make_context() for entry in entries ]
+
+
+def remove_issued(store, contexts):
+    # keep the store identical between runs so repeated measurements stay comparable
+    for context in contexts:
+        for path in store.get_context_paths(context):
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+
+
+def handle_scenario(args):
+    store = Store(root_dir=args.store)
+    issued = []
+    started = time.perf_counter()
+    cpu_started = time.process_time()
+
+    if args.name == 'tree_cold':
+        scenario_tree(store, drop_index=True)
+    elif args.name == 'tree_warm':
+        scenario_tree(store)
+    elif args.name == 'tree_noindex':
+        scenario_tree(store, use_index=False)
+    elif args.name == 'tree_openssl':
+        scenario_tree(store, parser=PARSER_OPENSSL, use_index=False)
+    elif args.name == 'get_cert':
+        scenario_get_cert(store, args.lookups)
+    elif args.name == 'issue_single':
+        issued = scenario_issue(store, 1, args.bits, 1)
+    elif args.name == 'issue_batch':
+        issued = scenario_issue(store, args.batch, args.bits, args.jobs)
+
+    clean_temp_files()
+    elapsed = time.perf_counter() - started
+    cpu_seconds = time.process_time() - cpu_started
+    self_usage = resource.getrusage(resource.RUSAGE_SELF)
+    children_usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    remove_issued(store, issued)
+
+    # ru_maxrss is in kilobytes on Linux
+    json.dump({
+        'seconds': elapsed,
+        'cpu_seconds': cpu_seconds,
+        'children_cpu_seconds': children_usage.ru_utime + children_usage.ru_stime,
+        'openssl_spawns': os.path.getsize(os.environ[SPAWN_COUNTER_ENV]),
+        'peak_rss_kb': self_usage.ru_maxrss,
+    }, sys.stdout)
+
+
+def count_store(store):
+    cas = leaves = 0
+    for ca_context in store.get_ca_certs(load_cert=False):
+        cas += 1
+        leaves += sum(1 for _ in store.get_certs(ca_context, load_cert=False))
+    return cas, leaves
+
+
+def run_scenario(name, args):
+    cmd = [ sys.executable, os.path.abspath(__file__), 'scenario', name, args.store,
+            '--lookups', str(args.lookups), '--batch', str(args.batch), '--bits', str(args.bits) ]
+    if args.jobs:
+        cmd += [ '--jobs', str(args.jobs) ]
+
+    with tempfile.NamedTemporaryFile(prefix='certman-bench-') as counter:
+        env = dict(os.environ, **{ SPAWN_COUNTER_ENV: counter.name })
+        # a fresh interpreter per scenario gives cold-start numbers and a per-scenario peak RSS
+        proc = subprocess.run(cmd, capture_output=True, text=True, env=env)
+
+    if proc.returncode:
+        raise Exception('Scenario {} failed:\n{}'.format(name, proc.stderr))
+
+    return json.loads(proc.stdout)
+
+
+# what --engine persistent runs on: "spawn" when the binary has no interactive mode
+def persistent_engine():
+    pool = OpenSSLPool()
+    try:
+        return pool.engine
+    finally:
+        pool.close()
+
+
+def handle_run(args):
+    store = Store(root_dir=args.store)
+    cas, leaves = count_store(store)
+    results = {}
+
+    for name in args.only or SCENARIOS:
+        runs = [ run_scenario(name, args) for _ in range(max(args.repeat, 1)) ]
+        results[name] = min(runs, key=lambda run: run['seconds'])
+        print('{:14} {:9.3f}s {:7d} spawns {:9d} KB'.format(
+            name, results[name]['seconds'], results[name]['openssl_spawns'],
+            results[name]['peak_rss_kb']), file=sys.stderr)
+
+    report = {
+        'meta': {
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpus': os.cpu_count(),
+            'openssl': OpenSSL().run(['version']).strip(),
+            'engine': CountingOpenSSL.engine,
+            'persistent_engine': persistent_engine(),
+            'store_cas': cas,
+            'store_leaves': leaves,
+            'repeat': args.repeat,
+        },
+        'results': results,
+    }
+
+    text = json.dumps(report, indent=2) + '\n'
+    if args.output:
+        with open(args.output, 'wt') as fd:
+            fd.write(text)
+    else:
+        sys.stdout.write(text)
+
+
+def handle_compare(args):
+    with open(args.baseline) as fd:
+        baseline = json.load(fd)['results']
+    with open(args.current) as fd:
+        current = json.load(fd)['results']
+
+    regressions = 0
+    for name in SCENARIOS:
+        if name not in baseline or name not in current:
+            continue
+
+        old, new = baseline[name], current[name]
+        problems = []
+        for key in ('seconds', 'peak_rss_kb'):
+            if key == 'seconds' and new[key] - old[key] < args.min_seconds:
+                continue
+            if old[key] and new[key] > old[key] * (1 + args.threshold):
+                problems.append('{} {:.3g} -> {:.3g} (+{:.0%})'.format(
+                    key, old[key], new[key], new[key] / old[key] - 1))
+        if new['openssl_spawns'] > old['openssl_spawns']:
+            problems.append('openssl_spawns {} -> {}'.format(old['openssl_spawns'], new['openssl_spawns']))
+
+        if problems:
+            regressions += 1
+            print('REGRESSION {}: {}'.format(name, '; '.join(problems)))
+        else:
+            print('ok         {}: {:.3f}s -> {:.3f}s'.format(name, old['seconds'], new['seconds']))
+
+    if regressions:
+        sys.exit(1)
+
+
+def main():
+    parser = command_line_parser()
+    args = parser.parse_args()
+
+    try:
+        if args.command == 'generate':
+            handle_generate(args)
+        elif args.command == 'run':
+            handle_run(args)
+        elif args.command == 'scenario':
+            handle_scenario(args)
+        elif args.command == 'compare':
+            handle_compare(args)
+        else:
+            parser.print_usage()
+            sys.exit(127)
+
+        clean_temp_files()
+
+    except Exception as e:
+        clean_temp_files()
+        print(str(e), file=sys.stderr)
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
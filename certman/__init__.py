@@ -1,8 +1,43 @@
-__all__ = [ 'Context', 'DNSection', 'Request', 'OpenSSL', 'Store', 'clean_temp_files' ]
+__all__ = [
+        'Context', 'DNSection', 'Request', 'OpenSSL', 'OpenSSLPool',
+        'Store', 'StoreIndex', 'clean_temp_files',
+        'verify_can_issue', 'issue_certificate', 'KeyPool', 'SerialAllocator',
+        'RevocationList', 'RevokedEntry', 'REASONS',
+        'PARSER_NATIVE', 'PARSER_OPENSSL', 'DecodeError', 'parse_pem', 'parse_der',
+        'BatchEntry', 'BatchResult', 'load_manifest', 'validate_batch', 'issue_batch',
+        'AsyncOpenSSL', 'AsyncStore', 'issue_certificate_async',
+        'CertificateService', 'ServiceBusy', 'make_server',
+        'OCSPResponder', 'make_ocsp_server',
+        'ArtifactCache', 'ARTIFACTS', 'NotApplicable',
+        'ExpiringCert', 'find_expiring', 'parse_duration',
+        'RenewResult', 'renew_certificate', 'renew_many',
+        'TreeNode', 'walk_tree', 'NODE_CA', 'NODE_MISSING_CA', 'NODE_CERT',
+        'EXPORT_PEM', 'EXPORT_TAR', 'EXPORT_PKCS7', 'EXPORT_FORMATS', 'select_certs', 'export_certs',
+        'PEMBlock', 'read_pem_blocks', 'ImportResult', 'PEMImporter', 'IMPORTED', 'EXISTS', 'FAILED',
+        'add_trace_hook', 'remove_trace_hook', 'trace_span', 'open_trace', 'TRACE_JSONL', 'TRACE_CHROME',
+        ]
 
+from .trace import add_trace_hook, remove_trace_hook, trace_span, open_trace, TRACE_JSONL, TRACE_CHROME
 from .context import Context
 from .dn import DNSection
 from .req import Request
-from .openssl import OpenSSL
+from .openssl import OpenSSL, PARSER_NATIVE, PARSER_OPENSSL
+from .x509 import DecodeError, parse_pem, parse_der
+from .pool import OpenSSLPool
 from .store import Store
+from .index import StoreIndex
 from .temporary import clean_temp_files
+from .issue import verify_can_issue, issue_certificate
+from .keypool import KeyPool
+from .serial import SerialAllocator
+from .revocation import RevocationList, RevokedEntry, REASONS
+from .batch import BatchEntry, BatchResult, load_manifest, validate_batch, issue_batch
+from .aio import AsyncOpenSSL, AsyncStore, issue_certificate_async
+from .server import CertificateService, ServiceBusy, make_server
+from .ocsp import OCSPResponder, make_ocsp_server
+from .artifacts import ArtifactCache, ARTIFACTS, NotApplicable
+from .expiry import ExpiringCert, find_expiring, parse_duration
+from .renew import RenewResult, renew_certificate, renew_many
+from .tree import TreeNode, walk_tree, NODE_CA, NODE_MISSING_CA, NODE_CERT
+from .export import EXPORT_PEM, EXPORT_TAR, EXPORT_PKCS7, EXPORT_FORMATS, select_certs, export_certs
+from .importer import PEMBlock, read_pem_blocks, ImportResult, PEMImporter, IMPORTED, EXISTS, FAILED
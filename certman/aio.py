@@ -0,0 +1,280 @@
+__all__ = [ 'AsyncOpenSSL', 'AsyncStore', 'issue_certificate_async' ]
+
+import asyncio
+import subprocess
+import functools
+
+from .openssl import OpenSSL, der_to_pem, TIMEOUT, GET_INFO_JOBS, PARSER_NATIVE
+from .temporary import inherited_file, make_temp_file, remove_temp_file
+from .x509 import DecodeError, pem_to_der, parse_pem, certificate_names
+from .issue import is_signed_by_ca
+from .serial import SerialAllocator
+from .trace import trace_span, argv_summary, NULL_SPAN
+
+# certificates parsed on the event loop by get_info_many(), more go to the executor
+INLINE_PARSE_LIMIT = 8
+
+# built-in decoder results, None where openssl has to be asked
+def parse_native_many(contexts):
+    infos = []
+    for context in contexts:
+        try:
+            infos.append(parse_pem(context.require_certificate))
+        except DecodeError:
+            infos.append(None)
+    return infos
+
+def read_bytes(path):
+    with open(path, 'rb') as fd:
+        return fd.read()
+
+# every OpenSSL method that runs openssl is overridden by a coroutine here,
+# the rest are argument builders and parsers shared with it
+class AsyncOpenSSL(OpenSSL):
+    concurrency = 16
+    timeout = TIMEOUT
+
+    def __init__(self, binary=None, parser=None, concurrency=None, timeout=None, executor=None):
+        super().__init__(binary, parser=parser)
+        if concurrency:
+            self.concurrency = concurrency
+        if timeout:
+            self.timeout = timeout
+        self.executor = executor
+        self._semaphore = None
+
+    @property
+    def semaphore(self):
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+        return self._semaphore
+
+    async def in_executor(self, func, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, functools.partial(func, *args, **kwargs))
+
+    async def run(self, args, input=None, timeout=None, pass_fds=()):
+        timeout = timeout or self.timeout
+
+        async with self.semaphore:
+            # cpu and child_cpu of async spans include whatever else the loop ran meanwhile
+            with trace_span('openssl', args[0], engine='async',
+                            input_bytes=len(input) if input else 0) as span:
+                if span is not NULL_SPAN:
+                    span.set(argv=argv_summary(args))
+                proc = await asyncio.create_subprocess_exec(self.binary, *args,
+                        stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                        pass_fds=pass_fds)
+                try:
+                    stdout, stderr = await asyncio.wait_for(
+                            proc.communicate(input.encode() if input is not None else None), timeout)
+
+                except asyncio.TimeoutError:
+                    await self._kill(proc)
+                    raise subprocess.TimeoutExpired([self.binary, *args], timeout)
+
+                except asyncio.CancelledError:
+                    await self._kill(proc)
+                    raise
+
+                span.set(status=proc.returncode, output_bytes=len(stdout), error_bytes=len(stderr))
+
+        if proc.returncode:
+            e = subprocess.CalledProcessError(proc.returncode, [self.binary, *args])
+            raise Exception('{}\nOutput:\n{}'.format(e, stderr.decode(errors='replace')))
+
+        return stdout.decode()
+
+    @staticmethod
+    async def _kill(proc):
+        if proc.returncode is None:
+            try:
+                proc.kill()
+            except ProcessLookupError:
+                pass
+            await proc.wait()
+
+    async def add_rsa_key(self, context):
+        args = await self.in_executor(lambda: self.rsa_key_args)
+        output = await self.run(args, input=context.require_private_key)
+        context.add(output)
+        return context
+
+    async def generate_rsa_key(self, bits):
+        return await self.run(['genpkey', '-algorithm', 'RSA',
+                               '-pkeyopt', 'rsa_keygen_bits:{}'.format(bits)])
+
+    async def generate_key(self, request):
+        return await self.run(['genpkey', *request.genpkey_args])
+
+    async def request(self, context, request, key_path=None):
+        key_args = await self.in_executor(self.new_key_args, context, request, key_path)
+        output = await self.run(['req', '-new', '-config', '-', *key_args],
+                                input=request.config.generate)
+        context.add(output)
+        return context
+
+    async def self_signed(self, context, request, key_path=None):
+        args = await self.in_executor(self.self_signed_args, context, request, key_path)
+        output = await self.run(args, input=request.config.generate)
+        context.add(output)
+        return context
+
+    async def signed(self, context, request, ca_paths, key_path=None, serial=None):
+        cfg_text = request.config.generate
+
+        if await self.in_executor(lambda: self.req_ca_signing):
+            args = await self.in_executor(self.req_sign_args, context, request, ca_paths,
+                                          key_path, serial)
+            output = await self.run(args, input=cfg_text)
+            context.add(output)
+            return context
+
+        await self.request(context, request, key_path=key_path)
+        with inherited_file(cfg_text) as (extfile_path, pass_fds):
+            output = await self.run(self.sign_args(request, ca_paths, extfile_path, serial),
+                                    input=context.require_request, pass_fds=pass_fds)
+
+        context.add(output)
+        return context
+
+    async def get_info(self, context):
+        if self.parser == PARSER_NATIVE:
+            try:
+                return parse_pem(context.require_certificate)
+            except DecodeError:
+                pass
+
+        return await self.get_info_openssl(context)
+
+    async def crl(self, ca_paths, database, number, days, base_number=None):
+        with inherited_file(database) as (database_path, database_fds):
+            cfg_text = self.crl_config(database_path, number, days, base_number).generate
+            with inherited_file(cfg_text) as (config_path, config_fds):
+                return await self.run(self.crl_args(ca_paths, config_path),
+                                      pass_fds=(*database_fds, *config_fds))
+
+    async def ocsp_response(self, ca_paths, database_path, serial, minutes):
+        response_path = make_temp_file('')
+        try:
+            await self.run(self.ocsp_args(ca_paths, database_path, serial, minutes, response_path))
+            return await self.in_executor(read_bytes, response_path)
+        finally:
+            remove_temp_file(response_path)
+
+    async def public_key(self, private_key):
+        return await self.run(['pkey', '-pubout'], input=private_key)
+
+    async def pkcs7(self, certs_path, output_path, der=False):
+        await self.run(self.pkcs7_args(certs_path, output_path, der))
+
+    async def get_info_many(self, contexts, jobs=None):
+        contexts = list(contexts)
+        if self.parser != PARSER_NATIVE:
+            infos = [ None ] * len(contexts)
+        elif len(contexts) > INLINE_PARSE_LIMIT:
+            infos = await self.in_executor(parse_native_many, contexts)
+        else:
+            infos = parse_native_many(contexts)
+
+        pending = [ num for num, certinfo in enumerate(infos) if certinfo is None ]
+        if pending:
+            results = await self.get_info_openssl_many([ contexts[num] for num in pending ], jobs=jobs)
+            for num, certinfo in zip(pending, results):
+                infos[num] = certinfo
+
+        return infos
+
+    # one batch as in OpenSSL.get_info_openssl_many(), at most jobs openssl
+    # processes at once for what the decoder cannot name
+    async def get_info_openssl_many(self, contexts, jobs=None):
+        contexts = list(contexts)
+        infos = [ None ] * len(contexts)
+        batch = []
+        single = []
+
+        for num, context in enumerate(contexts):
+            try:
+                der = pem_to_der(context.require_certificate)
+                batch.append((num, der, certificate_names(der)))
+            except DecodeError:
+                single.append(num)
+
+        if batch:
+            sections = await self.print_certs([ der for _, der, _ in batch ])
+            for (num, der, names), section in zip(batch, sections):
+                infos[num] = self.parse_info(contexts[num], self.info_from_text(section, der, *names))
+
+        pending = iter(single)
+
+        async def worker():
+            for num in pending:
+                infos[num] = await self.get_info_openssl(contexts[num])
+
+        await asyncio.gather(*(worker() for _ in range(jobs or GET_INFO_JOBS)))
+        return infos
+
+    async def print_certs(self, ders):
+        bundle = ''.join(der_to_pem(der) for der in ders)
+        with inherited_file(bundle) as (bundle_path, pass_fds):
+            pkcs7 = await self.run([ 'crl2pkcs7', '-nocrl', '-certfile', bundle_path ], pass_fds=pass_fds)
+
+        sections = self.RE_TEXT_SECTION.split(await self.run(self.PRINT_CERTS_ARGS, input=pkcs7))[1:]
+        if len(sections) != len(ders):
+            raise ValueError('openssl printed {} of {} certificates'.format(len(sections), len(ders)))
+        return sections
+
+    async def get_info_openssl(self, context):
+        output = await self.run(self.INFO_ARGS, input=context.require_certificate)
+        return self.parse_info(context, output)
+
+class AsyncStore:
+    def __init__(self, store, executor=None):
+        self.store = store
+        self.executor = executor
+
+    async def in_executor(self, func, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, functools.partial(func, *args, **kwargs))
+
+    def get_context_paths(self, context):
+        return self.in_executor(self.store.get_context_paths, context)
+
+    def load_context(self, context, **kwargs):
+        return self.in_executor(self.store.load_context, context, **kwargs)
+
+    def verify_exists(self, context, **kwargs):
+        return self.in_executor(self.store.verify_exists, context, **kwargs)
+
+    def get_ca_certs(self, load_cert=True):
+        return self.in_executor(lambda: list(self.store.get_ca_certs(load_cert=load_cert)))
+
+    def get_certs(self, context, load_cert=True):
+        return self.in_executor(lambda: list(self.store.get_certs(context, load_cert=load_cert)))
+
+    def store_context(self, context, **kwargs):
+        return self.in_executor(self.store.store, context, **kwargs)
+
+async def issue_certificate_async(store, openssl, context, request, key_pool=None, serials=None):
+    key_path = None
+    if key_pool and request.is_rsa:
+        key_path = await store.in_executor(key_pool.claim, request.bits)
+
+    try:
+        if is_signed_by_ca(context):
+            serials = serials or SerialAllocator(store.store)
+            serial = await store.in_executor(serials.allocate, context.ca_context)
+            ca_paths = await store.get_context_paths(context.ca_context)
+            await openssl.signed(context, request, ca_paths, key_path=key_path, serial=serial)
+            with_request = context.request is not None
+        else:
+            await openssl.self_signed(context, request, key_path=key_path)
+            with_request = False
+
+        await store.store_context(context, with_request=with_request)
+
+    finally:
+        if key_path:
+            await store.in_executor(key_pool.release, key_path)
+
+    return context
@@ -0,0 +1,315 @@
+__all__ = [ 'ArtifactCache', 'ARTIFACTS', 'NotApplicable' ]
+
+import os
+import re
+import errno
+import uuid
+import base64
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from .context import Context
+from .issue import is_signed_by_ca
+from .x509 import pem_to_der
+from .trace import trace_span
+from .temporary import make_temp_file, remove_temp_file
+
+ARTIFACT_RSA = 'rsa'
+ARTIFACT_DER = 'der'
+ARTIFACT_P12 = 'p12'
+ARTIFACT_CHAIN = 'chain'
+ARTIFACT_FULLCHAIN = 'fullchain'
+
+ARTIFACTS = (ARTIFACT_RSA, ARTIFACT_DER, ARTIFACT_P12, ARTIFACT_CHAIN, ARTIFACT_FULLCHAIN)
+
+BINARY_ARTIFACTS = (ARTIFACT_DER, ARTIFACT_P12)
+
+# suffixes must not end in Store.CERT_SUFFIX, or listings would take them for certificates
+ARTIFACT_SUFFIXES = {
+    ARTIFACT_DER: '.der',
+    ARTIFACT_P12: '.p12',
+    ARTIFACT_CHAIN: '.chain',
+    ARTIFACT_FULLCHAIN: '.fullchain',
+}
+
+PRIVATE_ARTIFACTS = (ARTIFACT_RSA, ARTIFACT_P12)
+
+# the issuers of a CA, beside its certificate: each certificate preceded by
+# a "# <basename>" line, so the file can be checked without walking again
+ISSUERS_SUFFIX = '.issuers'
+RE_ISSUER = re.compile(r'^# ([^\n]+)\n(-----BEGIN CERTIFICATE-----\n.*?-----END CERTIFICATE-----\n)',
+                       re.M | re.S)
+
+# DER of the rsaEncryption OID inside a PKCS#8 AlgorithmIdentifier
+RSA_ENCRYPTION_OID = bytes.fromhex('06092a864886f70d010101')
+RE_PEM_PRIVATE_KEY = re.compile('-----BEGIN (RSA )?PRIVATE KEY-----(.*?)-----END', re.S)
+
+# errors of a store that cannot be written, whose artifacts are built but not kept
+READ_ONLY_ERRORS = (errno.EACCES, errno.EPERM, errno.EROFS)
+
+PRECOMPUTE_JOBS = 8
+MAX_CHAIN_LENGTH = 16
+STAGING_PREFIX = '.staging-'
+
+class NotApplicable(ValueError):
+    pass
+
+def is_rsa_private_key(text):
+    m = RE_PEM_PRIVATE_KEY.search(text)
+    if not m:
+        return False
+    if m.group(1):
+        return True
+    return RSA_ENCRYPTION_OID in base64.b64decode(m.group(2))[:32]
+
+class ArtifactCache:
+    def __init__(self, store, openssl):
+        self.store = store
+        self.openssl = openssl
+        self._ca_by_subject = None
+        self._issuers = {}
+        self._lock = threading.Lock()
+
+    def get_path(self, context, name):
+        if name == ARTIFACT_RSA:
+            return self.store.get_context_paths(context).rsa_key
+        return self.store.get_artifact_path(context, ARTIFACT_SUFFIXES[name],
+                                            private=name in PRIVATE_ARTIFACTS)
+
+    def get(self, context, name):
+        if name not in ARTIFACTS:
+            raise ValueError('Unknown artifact: {}'.format(name))
+
+        self.store.load_context(context, load_cert=True, load_key=name in PRIVATE_ARTIFACTS)
+        chain = self.chain(context) if name in (ARTIFACT_P12, ARTIFACT_CHAIN, ARTIFACT_FULLCHAIN) else []
+        path = self.get_path(context, name)
+
+        # an artifact at least as new as all of its sources is current, whether
+        # built here with their newest mtime or written by an earlier version
+        version = max(self.store.stat(source).st_mtime_ns
+                      for source in self.sources(context, name, chain))
+        try:
+            if self.store.stat(path).st_mtime_ns >= version:
+                with open(path, 'rb') as fd:
+                    return fd.read()
+        except FileNotFoundError:
+            pass
+
+        with trace_span('artifact', name, path=path):
+            return self.build(context, name, chain, path, version)
+
+    def get_text(self, context, name):
+        if name in BINARY_ARTIFACTS:
+            raise ValueError('Artifact {} is binary'.format(name))
+        return self.get(context, name).decode()
+
+    def sources(self, context, name, chain):
+        paths = self.store.get_context_paths(context)
+        if name == ARTIFACT_RSA:
+            return [ paths.key ]
+
+        sources = [ paths.cert ]
+        if name == ARTIFACT_P12:
+            sources.append(paths.key)
+        sources.extend(self.store.get_context_paths(ca_context).cert for ca_context in chain)
+        return sources
+
+    def build(self, context, name, chain, path, version):
+        if name == ARTIFACT_RSA:
+            if not is_rsa_private_key(context.require_private_key):
+                raise NotApplicable('{} does not have an RSA key'.format(context.basename))
+            output = Context(context.basename)
+            output.add(self.openssl.run(self.openssl.rsa_key_args, input=context.require_private_key))
+            if not output.rsa_private_key:
+                raise Exception('openssl did not produce a traditional RSA private key')
+            content = output.rsa_private_key.encode()
+        elif name == ARTIFACT_DER:
+            content = pem_to_der(context.require_certificate)
+        elif name == ARTIFACT_CHAIN:
+            content = ''.join(ca_context.certificate for ca_context in chain).encode()
+        elif name == ARTIFACT_FULLCHAIN:
+            content = ''.join([ context.certificate ] +
+                              [ ca_context.certificate for ca_context in chain ]).encode()
+        else:
+            content = None
+
+        private = name in PRIVATE_ARTIFACTS
+        staging_path = os.path.join(os.path.dirname(path), STAGING_PREFIX + uuid.uuid4().hex)
+        opener = self.store.restricted_opener if private else None
+        try:
+            fd = open(staging_path, 'wb', opener=opener)
+        except OSError as e:
+            if e.errno not in READ_ONLY_ERRORS:
+                raise
+            return content if content is not None else self.build_p12(context, chain)
+
+        try:
+            with fd:
+                if content is not None:
+                    fd.write(content)
+
+            if name == ARTIFACT_P12:
+                # openssl writes into the already restricted staging file
+                content = self.build_p12(context, chain, staging_path)
+
+            os.utime(staging_path, ns=(version, version))
+            os.rename(staging_path, path)
+        except BaseException:
+            try:
+                os.unlink(staging_path)
+            except FileNotFoundError:
+                pass
+            raise
+
+        return content
+
+    # without a path, the bundle goes through a private temporary file
+    def build_p12(self, context, chain, path=None):
+        bundle = ''.join([ context.private_key, context.certificate ] +
+                         [ ca_context.certificate for ca_context in chain ])
+        output_path = path or make_temp_file('')
+        try:
+            self.openssl.run([ 'pkcs12', '-export', '-passout', 'pass:', '-out', output_path ],
+                             input=bundle)
+            with open(output_path, 'rb') as fd:
+                return fd.read()
+        finally:
+            if path is None:
+                remove_temp_file(output_path)
+
+    @property
+    def info_source(self):
+        return self.store.index or self.openssl
+
+    def ca_by_subject(self):
+        with self._lock:
+            if self._ca_by_subject is None:
+                contexts = list(self.store.get_ca_certs(load_cert=not self.store.index))
+                infos = self.info_source.get_info_many(contexts)
+                self._ca_by_subject = { info.subject: context
+                                        for context, info in zip(contexts, infos) }
+            return self._ca_by_subject
+
+    # the CA certificate with a subject, from the index when there is one,
+    # so a single lookup does not read every CA of the store
+    def find_ca(self, subject):
+        if self.store.index:
+            for basename in self.store.index.find_ca_basenames(subject):
+                parent = Context(basename, is_ca=True)
+                try:
+                    if self.info_source.get_info(parent).subject == subject:
+                        return parent
+                except FileNotFoundError:
+                    pass
+
+        parent = self.ca_by_subject().get(subject)
+        return Context(parent.basename, is_ca=True) if parent else None
+
+    # CA contexts above a CA, nearest first, walked once per CA and shared by
+    # every certificate it signed; the walk is kept beside the CA certificate
+    def issuers(self, ca_basename, depth=0):
+        with self._lock:
+            issuers = self._issuers.get(ca_basename)
+        if issuers is not None:
+            return issuers
+
+        ca_context = Context(ca_basename, is_ca=True)
+        issuers = self.load_issuers(ca_context)
+        if issuers is None:
+            issuers = []
+            self.store.load_context(ca_context, load_cert=not self.store.index)
+            info = self.info_source.get_info(ca_context)
+            if not info.is_self_signed and depth < MAX_CHAIN_LENGTH:
+                parent = self.find_ca(info.issuer)
+                if parent is not None:
+                    self.store.load_context(parent, load_cert=True)
+                    issuers = [ parent ] + self.issuers(parent.basename, depth + 1)
+            self.save_issuers(ca_context, issuers)
+
+        with self._lock:
+            return self._issuers.setdefault(ca_basename, issuers)
+
+    # the newest mtime of a CA certificate and of its issuers
+    def issuers_version(self, ca_context, issuers):
+        return max(self.store.stat(self.store.get_context_paths(context).cert).st_mtime_ns
+                   for context in [ ca_context ] + issuers)
+
+    # the kept issuers of a CA, None when missing or older than any certificate on it
+    def load_issuers(self, ca_context):
+        path = self.store.get_artifact_path(ca_context, ISSUERS_SUFFIX)
+        try:
+            mtime = self.store.stat(path).st_mtime_ns
+            text = self.store.read_text(path)
+        except FileNotFoundError:
+            return None
+
+        issuers = []
+        for basename, certificate in RE_ISSUER.findall(text):
+            context = Context(basename, is_ca=True)
+            context.certificate = certificate
+            issuers.append(context)
+
+        try:
+            if mtime >= self.issuers_version(ca_context, issuers):
+                return issuers
+        except FileNotFoundError:
+            pass
+        return None
+
+    def save_issuers(self, ca_context, issuers):
+        path = self.store.get_artifact_path(ca_context, ISSUERS_SUFFIX)
+        content = ''.join('# {}\n{}'.format(context.basename, context.certificate)
+                          for context in issuers)
+        try:
+            version = self.issuers_version(ca_context, issuers)
+            staging_path, _ = self.store.stage_file(path, content)
+        except FileNotFoundError:
+            return
+        except OSError as e:
+            if e.errno not in READ_ONLY_ERRORS:
+                raise
+            return
+
+        try:
+            os.utime(staging_path, ns=(version, version))
+            os.rename(staging_path, path)
+        except BaseException:
+            try:
+                os.unlink(staging_path)
+            except FileNotFoundError:
+                pass
+            raise
+
+    # issuing CA contexts with loaded certificates, nearest first, without the
+    # root's issuer loop; also kept in context.ca_certificates
+    def chain(self, context):
+        if context.is_ca:
+            chain = self.issuers(context.basename)
+        elif is_signed_by_ca(context):
+            ca_context = Context(context.ca_context.basename, is_ca=True)
+            self.store.load_context(ca_context, load_cert=True)
+            chain = [ ca_context ] + self.issuers(ca_context.basename)
+        else:
+            chain = []
+
+        context.ca_certificates = [ ca_context.certificate for ca_context in chain ]
+        return chain
+
+    def precompute(self, ca_context, names=ARTIFACTS, jobs=None, include_ca=True):
+        contexts = list(self.store.get_certs(ca_context, load_cert=False))
+        if include_ca:
+            contexts.insert(0, Context(ca_context.basename, is_ca=True))
+
+        tasks = [ (context, name) for context in contexts for name in names ]
+
+        def build(task):
+            context, name = task
+            try:
+                self.get(Context(context.basename, ca_context=context.ca_context,
+                                 is_ca=context.is_ca), name)
+                return context, name, None
+            except Exception as e:
+                return context, name, e
+
+        with ThreadPoolExecutor(max_workers=jobs or PRECOMPUTE_JOBS) as executor:
+            yield from executor.map(build, tasks)
@@ -0,0 +1,211 @@
+__all__ = [ 'BatchEntry', 'BatchResult', 'load_manifest', 'validate_batch', 'issue_batch' ]
+
+import os
+import csv
+import json
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+
+from .context import Context
+from .dn import DNSection
+from .req import Request
+from .store import Store
+from .openssl import OpenSSL
+from .issue import verify_can_issue, make_certificate, store_certificate, is_signed_by_ca
+from .serial import SerialAllocator
+from .temporary import clean_temp_files
+
+MANIFEST_JSON = 'json'
+MANIFEST_CSV = 'csv'
+
+# separator for multi-valued CSV columns (organization_unit, names)
+CSV_LIST_SEPARATOR = ';'
+
+BatchResult = namedtuple('BatchResult', 'entry error'.split())
+
+class BatchEntry:
+    def __init__(self, basename, ca_basename=None, request=None, position=None):
+        self.basename = basename
+        self.ca_basename = ca_basename
+        self.request = request or Request()
+        self.position = position
+
+    @property
+    def description(self):
+        if self.ca_basename:
+            path = '{}/{}'.format(self.ca_basename, self.basename)
+        else:
+            path = '/{}'.format(self.basename)
+
+        if self.position is None:
+            return path
+
+        return 'entry {} ({})'.format(self.position, path)
+
+    def make_context(self):
+        if self.ca_basename:
+            ca_context = Context(self.ca_basename, is_ca=True)
+        else:
+            ca_context = Store.self_signed_context()
+
+        return Context(self.basename, ca_context=ca_context)
+
+    @classmethod
+    def from_record(cls, record, defaults=None, position=None):
+        values = dict(defaults or {})
+        values.update((k, v) for k, v in record.items() if v not in (None, ''))
+
+        basename = values.get('name')
+        if not basename:
+            raise ValueError('Manifest entry {} has no name'.format(position))
+
+        common_name = values.get('common_name') or basename
+        organization_units = values.get('organization_unit') or []
+        if isinstance(organization_units, str):
+            organization_units = [ organization_units ]
+
+        domain_names = values.get('names') or [ common_name ]
+        if isinstance(domain_names, str):
+            domain_names = [ domain_names ]
+
+        dn = DNSection(country=values.get('country'),
+                       state=values.get('state'),
+                       locality=values.get('locality'),
+                       organization=values.get('organization'),
+                       organization_units=organization_units,
+                       common_name=common_name,
+                       email_address=values.get('email'))
+
+        bits = values.get('bits')
+        days = values.get('days')
+        request = Request(dn, domain_names=domain_names,
+                          bits=int(bits) if bits else None,
+                          days=int(days) if days else None,
+                          hash_algo=values.get('hash'),
+                          key_type=values.get('key_type'),
+                          curve=values.get('curve'))
+
+        return cls(basename, ca_basename=values.get('ca'), request=request,
+                   position=position)
+
+
+def read_json_records(fd):
+    records = json.load(fd)
+    if not isinstance(records, list):
+        raise ValueError('JSON manifest must contain a list of entries')
+
+    for record in records:
+        if not isinstance(record, dict):
+            raise ValueError('JSON manifest entries must be objects')
+        yield record
+
+
+def read_csv_records(fd):
+    for record in csv.DictReader(fd):
+        for key in ('organization_unit', 'names'):
+            value = record.get(key)
+            if value:
+                record[key] = [ v.strip() for v in value.split(CSV_LIST_SEPARATOR) if v.strip() ]
+        yield record
+
+
+def load_manifest(path, manifest_format=None, defaults=None):
+    if not manifest_format:
+        _, ext = os.path.splitext(path)
+        manifest_format = MANIFEST_CSV if ext.lower() == '.csv' else MANIFEST_JSON
+
+    if manifest_format == MANIFEST_JSON:
+        reader = read_json_records
+    elif manifest_format == MANIFEST_CSV:
+        reader = read_csv_records
+    else:
+        raise ValueError('Unknown manifest format: {}'.format(manifest_format))
+
+    with open(path, 'rt', newline='') as fd:
+        return [ BatchEntry.from_record(record, defaults=defaults, position=num + 1)
+                 for num, record in enumerate(reader(fd)) ]
+
+
+def validate_batch(store, entries):
+    results = []
+    seen = set()
+
+    for entry in entries:
+        key = (entry.ca_basename or '', entry.basename)
+        if key in seen:
+            results.append(BatchResult(entry, 'duplicate entry in the manifest'))
+            continue
+        seen.add(key)
+
+        try:
+            verify_can_issue(store, entry.make_context())
+        except Exception as e:
+            results.append(BatchResult(entry, str(e)))
+
+    return results
+
+
+# workers only run openssl, the parent writes the files in one group commit
+def _make_entry(store, openssl, key_pool, entry, serial):
+    context = entry.make_context()
+    try:
+        make_certificate(store, openssl, context, entry.request, key_pool=key_pool, serial=serial)
+        return BatchResult(entry, None), context
+
+    except Exception as e:
+        return BatchResult(entry, str(e)), None
+
+    finally:
+        clean_temp_files()
+
+
+# one range of serials is reserved per CA, so workers never touch the counters
+def reserve_serials(store, entries, serials=None):
+    serials = serials or SerialAllocator(store)
+    by_ca = {}
+    for num, entry in enumerate(entries):
+        context = entry.make_context()
+        if is_signed_by_ca(context):
+            by_ca.setdefault(entry.ca_basename, (context.ca_context, []))[1].append(num)
+
+    assigned = [ None ] * len(entries)
+    for ca_context, nums in by_ca.values():
+        for num, serial in zip(nums, serials.reserve(ca_context, len(nums))):
+            assigned[num] = serial
+
+    return assigned
+
+
+def issue_batch(store, entries, openssl=None, key_pool=None, jobs=None, callback=None,
+                serials=None):
+    openssl = openssl or OpenSSL()
+    results = []
+    assigned = reserve_serials(store, entries, serials)
+
+    def collect(result):
+        results.append(result)
+        if callback:
+            callback(result)
+
+    def store_entry(result, context):
+        if result.error:
+            collect(result)
+            return
+
+        try:
+            store_certificate(store, context, on_commit=lambda context: collect(result))
+        except Exception as e:
+            collect(BatchResult(result.entry, str(e)))
+
+    with store.group_commit():
+        if jobs == 1 or len(entries) <= 1:
+            for entry, serial in zip(entries, assigned):
+                store_entry(*_make_entry(store, openssl, key_pool, entry, serial))
+        else:
+            with ProcessPoolExecutor(max_workers=jobs) as executor:
+                futures = [ executor.submit(_make_entry, store, openssl, key_pool, entry, serial)
+                            for entry, serial in zip(entries, assigned) ]
+                for future in futures:
+                    store_entry(*future.result())
+
+    return results
@@ -1,6 +1,8 @@
 __all__ = [ 'CertInfo' ]
 
 import re
+from datetime import datetime, timezone
+
 from .dn import DNSection
 
 # notBefore=Dec 19 13:23:21 2020 GMT
@@ -8,30 +10,60 @@ from .dn import DNSection
 # subject=CN= wildcard.foo.name
 # issuer=CN= dlmtest1-web-ca
 # SHA1 Fingerprint=1D:84:43:24:13:2C:25:C6:EF:BD:AC:95:F4:FF:B1:9E:A9:DD:1D:7D
-# X509v3 Basic Constraints: 
+# serial=4532B22D8C795411BF91D7D1E0264950B2E414EE
+# X509v3 Basic Constraints: critical
 #     CA:FALSE
 # X509v3 Subject Alternative Name: 
 #     DNS:foo.name, DNS:*.foo.name
 
+MONTHS = { name: num + 1 for num, name in enumerate(
+        ('Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec')) }
+
+# "Dec 17 13:23:21 2030 GMT" as printed by openssl and the built-in decoder
+def parse_time(raw):
+    try:
+        month, day, clock, year, zone = raw.split()
+        hour, minute, second = clock.split(':')
+        if zone != 'GMT':
+            raise ValueError
+        return datetime(int(year), MONTHS[month], int(day), int(hour), int(minute), int(second),
+                        tzinfo=timezone.utc)
+    except (ValueError, KeyError):
+        raise ValueError('Unsupported time: {!r}'.format(raw))
+
 class CertInfo:
     issuer = ""
     subject = ""
     fingerprint = ""
+    fingerprint_sha256 = ""
+    serial = ""
     not_before_raw = None
     not_after_raw = None
     _basic_constraints = None
     _extended_usage = None
     _subject_alt_name = None
     _key_usage = None
+    _not_before = None
+    _not_after = None
 
     RE_PARAM_LINE = re.compile(r'^([^\s=][^=]+)=(.*)$')
-    RE_EXTENSION_LINE = re.compile(r'^X509v3 (.+?):\s*$')
+    RE_EXTENSION_LINE = re.compile(r'^X509v3 (.+?):(?: critical)?\s*$')
+    # a DirName has commas of its own, names are split before the next type only
+    RE_NAME_SEPARATOR = re.compile(r',\s*(?=(?:DNS|IP Address|URI|email|DirName|othername|'
+                                   r'Registered ID|EdiPartyName|X400Name):)')
 
     EXTENSION_NAMES = set((
         'Basic Constraints',
         'Subject Alternative Name',
     ))
 
+    # compared by differences()
+    FIELDS = (
+        'subject', 'issuer', 'fingerprint', 'fingerprint_sha256', 'serial',
+        'not_before_raw', 'not_after_raw',
+        'basic_constraints', 'key_usage', 'extended_usage', 'subject_alt_name',
+    )
+
     @property
     def subject_dn(self):
         return DNSection.from_string(self.subject)
@@ -68,10 +100,26 @@ class CertInfo:
 
         return self._key_usage
 
+    @property
+    def not_before(self):
+        if self._not_before is None and self.not_before_raw:
+            self._not_before = parse_time(self.not_before_raw)
+        return self._not_before
+
+    @property
+    def not_after(self):
+        if self._not_after is None and self.not_after_raw:
+            self._not_after = parse_time(self.not_after_raw)
+        return self._not_after
+
     @property
     def is_self_signed(self):
         return self.issuer == self.subject
 
+    def differences(self, other):
+        return [ field for field in self.FIELDS
+                 if getattr(self, field) != getattr(other, field) ]
+
     @staticmethod
     def iterate_values(lines):
         for line in lines:
@@ -85,9 +133,12 @@ class CertInfo:
         if key == 'Basic Constraints':
             self._basic_constraints = value
         elif key == 'Subject Alternative Name':
-            self._subject_alt_name = value
+            self._subject_alt_name = [ name.strip() for line in lines
+                                       for name in self.RE_NAME_SEPARATOR.split(line) if name.strip() ]
         elif key == 'Key Usage':
             self._key_usage = value
+        elif key == 'Extended Key Usage':
+            self._extended_usage = value
         else:
             raise KeyError("Unexpected extension: {}".format(key))
 
@@ -115,6 +166,8 @@ class CertInfo:
                     certinfo.subject = value
                 elif key == 'SHA1 Fingerprint':
                     certinfo.fingerprint = value
+                elif key == 'serial':
+                    certinfo.serial = value
                 else:
                     raise KeyError("Unknown parameter: {}".format(key))
 
@@ -1,7 +1,11 @@
-__all__ = [ 'Config' ]
+__all__ = [ 'Config', 'quote_value' ]
 
 from collections import OrderedDict
 
+# A value read back exactly: no $ expansion, comments or trimmed spaces
+def quote_value(value):
+    return '"{}"'.format(value.replace('\\', '\\\\').replace('"', '\\"'))
+
 class Config:
     def __init__(self):
         self.sections = OrderedDict()
@@ -1,4 +1,4 @@
-__all__ = [ 'DNSection' ]
+__all__ = [ 'DNSection', 'RDNSequence' ]
 
 from collections import OrderedDict
 
@@ -57,7 +57,7 @@ class DNSection:
                 organization = value
             elif key == 'OU':
                 organization_units.append(value)
-            elif key == 'S':
+            elif key in ('ST', 'S'):
                 state = value
             else:
                 raise KeyError("Unexpected DN field: {}".format(key))
@@ -93,3 +93,22 @@ class DNSection:
     def ordered_dict(self):
         return OrderedDict(self.items())
 
+
+# A distinguished name as decoded from a certificate: any attributes, in
+# their order, with multi-valued RDNs. Keys are numbered so that repeated
+# attributes stay apart; openssl skips the number, and a "+" adds the
+# attribute to the RDN before it.
+class RDNSequence:
+    def __init__(self, rdns):
+        self.rdns = [ list(rdn) for rdn in rdns ]
+
+    def items(self):
+        num = 0
+        for rdn in self.rdns:
+            for pos, (key, value) in enumerate(rdn):
+                yield ('{}.{}{}'.format(num, '+' if pos else '', key), value)
+                num += 1
+
+    @property
+    def ordered_dict(self):
+        return OrderedDict(self.items())
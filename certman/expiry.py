@@ -0,0 +1,75 @@
+__all__ = [ 'ExpiringCert', 'find_expiring', 'parse_duration' ]
+
+import re
+from collections import namedtuple
+from datetime import datetime, timedelta, timezone
+from concurrent.futures import ThreadPoolExecutor
+
+EXPIRY_JOBS = 8
+
+DURATION_UNITS = {
+    's': 'seconds',
+    'm': 'minutes',
+    'h': 'hours',
+    'd': 'days',
+    'w': 'weeks',
+}
+
+RE_DURATION = re.compile(r'(\d+)([smhdw]?)')
+
+ExpiringCert = namedtuple('ExpiringCert', 'context certinfo not_after'.split())
+
+# "30d", "12h", "2w" or "1w3d"; a bare number is days
+def parse_duration(text):
+    text = text.strip().lower()
+    if not text:
+        raise ValueError('Empty duration')
+
+    duration = timedelta()
+    pos = 0
+    while pos < len(text):
+        m = RE_DURATION.match(text, pos)
+        if not m:
+            raise ValueError('Invalid duration: {}'.format(text))
+        amount, unit = m.groups()
+        duration += timedelta(**{ DURATION_UNITS[unit or 'd']: int(amount) })
+        pos = m.end()
+
+    return duration
+
+def certificate_groups(store, ca_basenames=None, load_cert=True):
+    ca_contexts = list(store.get_ca_certs(load_cert=load_cert))
+    if ca_basenames:
+        ca_contexts = [ context for context in ca_contexts if context.basename in ca_basenames ]
+        missing = set(ca_basenames) - set(context.basename for context in ca_contexts)
+        if missing:
+            raise FileNotFoundError('CA certificate {} was not found in the store'.format(
+                ', '.join(sorted(missing))))
+
+    yield ca_contexts
+    for ca_context in ca_contexts:
+        yield list(store.get_certs(ca_context, load_cert=load_cert))
+
+    if not ca_basenames:
+        yield list(store.get_certs(store.self_signed_context(), load_cert=load_cert))
+
+# Certificates of the store, or of the given CAs, that are no longer valid
+# at now + within, soonest first. Expired certificates are included. With a
+# StoreIndex as info_source, only certificates changed since they were last
+# indexed are read and parsed, so it goes with load_cert=False.
+def find_expiring(store, info_source, within, ca_basenames=None, load_cert=True,
+                  now=None, jobs=None):
+    deadline = (now or datetime.now(timezone.utc)) + within
+
+    def read_group(contexts):
+        return [ ExpiringCert(context, certinfo, certinfo.not_after)
+                 for context, certinfo in zip(contexts, info_source.get_info_many(contexts))
+                 if certinfo.not_after <= deadline ]
+
+    expiring = []
+    with ThreadPoolExecutor(max_workers=jobs or EXPIRY_JOBS) as executor:
+        for found in executor.map(read_group, certificate_groups(store, ca_basenames, load_cert)):
+            expiring.extend(found)
+
+    expiring.sort(key=lambda cert: (cert.not_after, cert.context.basename))
+    return expiring
@@ -0,0 +1,172 @@
+__all__ = [ 'EXPORT_PEM', 'EXPORT_TAR', 'EXPORT_PKCS7', 'EXPORT_FORMATS',
+            'select_certs', 'export_certs' ]
+
+import os
+import time
+import errno
+import fnmatch
+import tarfile
+
+from .context import Context
+from .store import Store
+from .temporary import make_temp_file, remove_temp_file
+from .trace import trace_span
+
+EXPORT_PEM = 'pem'
+EXPORT_TAR = 'tar'
+EXPORT_PKCS7 = 'pkcs7'
+
+EXPORT_FORMATS = (EXPORT_PEM, EXPORT_TAR, EXPORT_PKCS7)
+
+CERT_FILE_PERMS = 0o644
+
+def write_all(out_fd, data):
+    view = memoryview(data)
+    while view:
+        view = view[os.write(out_fd, view):]
+
+# Copies a whole file to a descriptor in the kernel where sendfile() can
+# write to it, with a buffered copy otherwise (e.g. to a terminal). Returns
+# whether the file ended with a newline.
+def copy_file(path, out_fd):
+    with open(path, 'rb') as src:
+        size = os.fstat(src.fileno()).st_size
+        copied = 0
+        try:
+            while copied < size:
+                sent = os.sendfile(out_fd, src.fileno(), copied, size - copied)
+                if not sent:
+                    break
+                copied += sent
+        except OSError as e:
+            if copied or e.errno not in (errno.EINVAL, errno.ENOSYS, errno.EOPNOTSUPP):
+                raise
+            while True:
+                chunk = src.read(1 << 16)
+                if not chunk:
+                    break
+                write_all(out_fd, chunk)
+
+        return not size or os.pread(src.fileno(), 1, size - 1) == b'\n'
+
+# Leaves of a CA to export, as contexts with nothing loaded: the named ones,
+# or all of them listed lazily, shard by shard; pattern is a shell-style
+# wildcard on certificate names.
+def select_certs(store, ca_context, names=None, pattern=None):
+    if names:
+        contexts = [ Context(name, ca_context=ca_context) for name in names ]
+        for context in contexts:
+            store.verify_exists(context, check_cert=True)
+    else:
+        contexts = store.get_certs(ca_context, load_cert=False)
+
+    for context in contexts:
+        if pattern is None or fnmatch.fnmatchcase(context.basename, pattern):
+            yield context
+
+# PEM files written by hand may lack the final newline the next one needs
+def copy_cert(store, context, out_fd):
+    if not copy_file(store.get_context_paths(context).cert, out_fd):
+        write_all(out_fd, b'\n')
+
+def export_pem(store, contexts, out_fd, with_ca=None):
+    if with_ca:
+        copy_cert(store, with_ca, out_fd)
+
+    count = 0
+    for context in contexts:
+        copy_cert(store, context, out_fd)
+        count += 1
+
+    return count
+
+def add_tar_file(tar, path, arcname, mode):
+    with open(path, 'rb') as fd:
+        st = os.fstat(fd.fileno())
+        info = tarfile.TarInfo(arcname)
+        info.size = st.st_size
+        info.mtime = st.st_mtime
+        info.mode = mode
+        # tarfile copies the file through a fixed-size buffer
+        tar.addfile(info, fd)
+
+def add_tar_dir(tar, arcname, mode):
+    info = tarfile.TarInfo(arcname)
+    info.type = tarfile.DIRTYPE
+    info.mode = mode
+    info.mtime = time.time()
+    tar.addfile(info)
+
+# Entries follow the flat store layout: <CA>.pem, <CA>.d/<name>.pem and, with
+# keys, <CA>.d/private/<name>.key. The CA key is never exported.
+def export_tar(store, contexts, out, ca_context, with_ca=False, with_keys=False, gzip=False):
+    ca_dir = ca_context.basename + Store.CA_DIR_SUFFIX
+    key_dir = os.path.join(ca_dir, Store.PRIVATE_KEY_SUBDIR)
+    count = 0
+
+    with tarfile.open(fileobj=out, mode='w|gz' if gzip else 'w|') as tar:
+        if with_ca:
+            add_tar_file(tar, store.get_context_paths(ca_context).cert,
+                         ca_context.basename + Store.CERT_SUFFIX, CERT_FILE_PERMS)
+        add_tar_dir(tar, ca_dir, 0o755)
+        if with_keys:
+            add_tar_dir(tar, key_dir, Store.PRIVATE_KEY_SUBDIR_PERMS)
+
+        for context in contexts:
+            paths = store.get_context_paths(context)
+            if with_keys:
+                add_tar_file(tar, paths.key, os.path.join(key_dir, context.basename + Store.KEY_SUFFIX),
+                             Store.PRIVATE_KEY_FILE_PERMS)
+            add_tar_file(tar, paths.cert, os.path.join(ca_dir, context.basename + Store.CERT_SUFFIX),
+                         CERT_FILE_PERMS)
+            count += 1
+
+    return count
+
+# the bundle goes to a temporary file for openssl, its output is copied out
+def export_pkcs7(store, openssl, contexts, out_fd, with_ca=None, der=False):
+    certs_path = make_temp_file('')
+    output_path = make_temp_file('')
+    try:
+        with open(certs_path, 'wb') as certs:
+            count = export_pem(store, contexts, certs.fileno(), with_ca=with_ca)
+        if not count and not with_ca:
+            raise Exception('No certificates to export')
+
+        openssl.pkcs7(certs_path, output_path, der=der)
+        copy_file(output_path, out_fd)
+    finally:
+        remove_temp_file(certs_path)
+        remove_temp_file(output_path)
+
+    return count
+
+# Streams the certificates of contexts, all signed by ca_context, to out, a
+# binary file object, as a PEM bundle, a tar archive or a certs-only PKCS#7
+# structure. Certificates are copied from file to file without being decoded.
+# Returns the number of leaves exported.
+def export_certs(store, openssl, ca_context, contexts, out, export_format=EXPORT_PEM,
+                 with_ca=False, with_keys=False, gzip=False, der=False):
+    if export_format not in EXPORT_FORMATS:
+        raise ValueError('Unknown export format: {}'.format(export_format))
+    if with_keys and export_format != EXPORT_TAR:
+        raise ValueError('Private keys can only be exported in a tar archive')
+    if with_ca and ca_context.basename == Store.SELF_SIGNED_SUBDIR:
+        raise ValueError('Self-signed certificates have no CA certificate')
+
+    with trace_span('export', export_format, ca=ca_context.basename) as span:
+        if export_format == EXPORT_TAR:
+            count = export_tar(store, contexts, out, ca_context, with_ca=with_ca,
+                               with_keys=with_keys, gzip=gzip)
+        else:
+            out.flush()
+            if export_format == EXPORT_PEM:
+                count = export_pem(store, contexts, out.fileno(),
+                                   with_ca=ca_context if with_ca else None)
+            else:
+                count = export_pkcs7(store, openssl, contexts, out.fileno(),
+                                     with_ca=ca_context if with_ca else None, der=der)
+        out.flush()
+        span.set(certs=count)
+
+    return count
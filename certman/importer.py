@@ -0,0 +1,330 @@
+__all__ = [ 'PEMBlock', 'read_pem_blocks', 'ImportResult', 'PEMImporter',
+            'IMPORTED', 'EXISTS', 'FAILED' ]
+
+import os
+import re
+import sys
+import uuid
+import base64
+import shutil
+import textwrap
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+from .context import Context
+from .store import Store
+from .serial import SerialAllocator
+from .x509 import (DecodeError, parse_der, pem_to_der, public_key_hash, spki_key_hash,
+                   private_key_hash, private_key_to_pkcs8, PEM_PKCS8_KEY, PEM_RSA_KEY, PEM_EC_KEY)
+from .trace import trace_span
+
+IMPORT_JOBS = 8
+
+RE_BEGIN = re.compile(rb'-----BEGIN ([A-Z0-9 ]+)-----')
+RE_END = re.compile(rb'-----END ([A-Z0-9 ]+)-----')
+RE_COMMON_NAME = re.compile(r'(?:^|, )CN=((?:[^,\\]|\\.)+)')
+RE_NAME_UNSAFE = re.compile(r'[^A-Za-z0-9._-]+')
+RE_DN_ESCAPE = re.compile(r'\\([0-9A-Fa-f]{2}|.)')
+
+KEY_LABELS = (PEM_PKCS8_KEY, PEM_RSA_KEY, PEM_EC_KEY)
+SPOOL_PREFIX = '.import-'
+
+IMPORTED = 'imported'
+EXISTS = 'exists'
+FAILED = 'failed'
+
+# one PEM object: byte offsets of its fences in source, der is None for
+# legacy encrypted keys, which carry headers
+PEMBlock = namedtuple('PEMBlock', 'label source start end der'.split())
+
+ImportResult = namedtuple('ImportResult', 'name ca_name status error'.split())
+
+CertEntry = namedtuple('CertEntry', 'block subject issuer is_ca serial name key_hash'.split())
+
+# Yields the PEM objects of a binary file one at a time, holding only the
+# lines of the current object; text between objects is skipped.
+def read_pem_blocks(fd, source=None):
+    offset = 0
+    label = None
+    for line in fd:
+        line_start = offset
+        offset += len(line)
+        line = line.strip()
+
+        if label is None:
+            m = RE_BEGIN.fullmatch(line)
+            if m:
+                label, start, body, encrypted = m.group(1), line_start, [], False
+            continue
+
+        m = RE_END.fullmatch(line)
+        if not m:
+            if b':' in line:
+                encrypted = True
+            body.append(line)
+            continue
+
+        if m.group(1) != label:
+            raise DecodeError('begin/end mismatch: "{}" != "{}"'.format(
+                label.decode(), m.group(1).decode()))
+
+        der = None
+        if not encrypted:
+            try:
+                der = base64.b64decode(b''.join(body), validate=True)
+            except ValueError as e:
+                raise DecodeError('Invalid PEM {} at byte {}: {}'.format(label.decode(), start, e))
+
+        yield PEMBlock(label.decode(), source, start, offset, der)
+        label = None
+
+def der_to_pem(der, label):
+    return '-----BEGIN {0}-----\n{1}\n-----END {0}-----\n'.format(
+        label, '\n'.join(textwrap.wrap(base64.b64encode(der).decode(), 64)))
+
+def unescape_dn_value(value):
+    return RE_DN_ESCAPE.sub(lambda m: chr(int(m.group(1), 16)) if len(m.group(1)) == 2
+                            else m.group(1), value)
+
+# a file name from the CN, the first DNS name or the serial
+def name_hint(certinfo):
+    m = RE_COMMON_NAME.search(certinfo.subject)
+    candidates = [ unescape_dn_value(m.group(1)) ] if m else []
+    candidates.extend(name[4:] for name in certinfo.subject_alt_name if name.startswith('DNS:'))
+    for candidate in candidates:
+        name = RE_NAME_UNSAFE.sub('_', candidate).lstrip('.')
+        if name:
+            return name
+    return certinfo.serial
+
+# Imports certificates and private keys from PEM bundles in any order. The
+# bundles are read once, object by object, keeping only what placement
+# needs; certificates and keys are read again by offset when written, so
+# memory stays small whatever the bundle size. Keys go with the certificate
+# whose public key they match. CA certificates (basicConstraints CA:TRUE)
+# become CAs of the store, other certificates are filed under the CA whose
+# subject matches their issuer, found in the store or in the bundles, or
+# among the self-signed certificates. Everything is written in one group
+# commit, and certificates already in the store are left alone.
+class PEMImporter:
+    def __init__(self, store, openssl, serials=None, jobs=None, callback=None):
+        self.store = store
+        self.openssl = openssl
+        self.serials = serials or SerialAllocator(store)
+        self.jobs = jobs or IMPORT_JOBS
+        self.callback = callback
+
+        self.sources = []
+        self.spooled = []
+        self.certs = []
+        self.keys = {}
+        self.fingerprints = set()
+        self.strings = {}
+        self.results = []
+        self.skipped = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        for fd in self.sources:
+            fd.close()
+        self.sources = []
+        for path in self.spooled:
+            os.unlink(path)
+        self.spooled = []
+
+    def report(self, result):
+        self.results.append(result)
+        if self.callback:
+            self.callback(result)
+
+    # objects are read again by offset, so standard input is kept in the store
+    # directory first, on disk rather than in a memory-backed temporary directory
+    def open_source(self, path):
+        if path != '-':
+            return open(path, 'rb')
+
+        spool_path = os.path.join(self.store.root_dir, SPOOL_PREFIX + uuid.uuid4().hex)
+        self.spooled.append(spool_path)
+        with open(spool_path, 'wb') as spool:
+            shutil.copyfileobj(sys.stdin.buffer, spool)
+        return open(spool_path, 'rb')
+
+    def read_block(self, block):
+        fd = self.sources[block.source]
+        data = os.pread(fd.fileno(), block.end - block.start, block.start)
+        return next(read_pem_blocks(data.splitlines(keepends=True), block.source))
+
+    def intern(self, text):
+        return self.strings.setdefault(text, text)
+
+    def scan(self, path):
+        fd = self.open_source(path)
+        self.sources.append(fd)
+        unresolved = []
+
+        with trace_span('import', 'scan', path=path) as span:
+            for block in read_pem_blocks(fd, len(self.sources) - 1):
+                if block.label == 'CERTIFICATE':
+                    self.add_cert(block)
+                elif block.label in KEY_LABELS and block.der is not None:
+                    try:
+                        self.keys[private_key_hash(block.der, block.label)] = block._replace(der=None)
+                    except DecodeError:
+                        unresolved.append(block)
+                else:
+                    # requests, CRLs, parameters and encrypted keys
+                    self.skipped += 1
+
+            span.set(certs=len(self.certs), keys=len(self.keys))
+
+        # keys of other algorithms get their public key from openssl
+        def public_key_of(block):
+            try:
+                spki = pem_to_der_block(self.openssl.public_key(der_to_pem(block.der, block.label)))
+                return spki_key_hash(spki), block
+            except Exception:
+                return None, block
+
+        with ThreadPoolExecutor(max_workers=self.jobs) as executor:
+            for key_hash, block in executor.map(public_key_of, unresolved):
+                if key_hash is None:
+                    self.skipped += 1
+                else:
+                    self.keys[key_hash] = block._replace(der=None)
+
+    def add_cert(self, block):
+        try:
+            certinfo = parse_der(block.der)
+            key_hash = public_key_hash(block.der, 'sha256')
+        except DecodeError as e:
+            self.report(ImportResult('<byte {}>'.format(block.start), None, FAILED, str(e)))
+            return
+
+        fingerprint = bytes.fromhex(certinfo.fingerprint_sha256.replace(':', ''))
+        if fingerprint in self.fingerprints:
+            return
+        self.fingerprints.add(fingerprint)
+
+        self.certs.append(CertEntry(block._replace(der=None),
+                                    self.intern(certinfo.subject), self.intern(certinfo.issuer),
+                                    'CA:TRUE' in certinfo.basic_constraints, certinfo.serial,
+                                    name_hint(certinfo), key_hash))
+
+    def same_certificate(self, path, block):
+        try:
+            return pem_to_der(self.store.read_text(path)) == self.read_block(block).der
+        except (FileNotFoundError, DecodeError):
+            return False
+
+    # a free name for a certificate, or None when it is already in the store
+    def place(self, entry, ca_context, taken):
+        context = None
+        for name in (entry.name, '{}-{}'.format(entry.name, entry.serial)):
+            if name in taken:
+                continue
+            context = Context(name, ca_context=ca_context, is_ca=ca_context is None)
+            cert_path = self.store.get_context_paths(context).cert
+            if not self.store.exists(cert_path):
+                taken.add(name)
+                return context
+            if self.same_certificate(cert_path, entry.block):
+                return None
+            context = None
+
+        raise FileExistsError('Certificate name {} is taken'.format(entry.name))
+
+    def plan(self):
+        ca_contexts = list(self.store.get_ca_certs(load_cert=not self.store.index))
+        info_source = self.store.index or self.openssl
+        ca_by_subject = { certinfo.subject: context for context, certinfo
+                          in zip(ca_contexts, info_source.get_info_many(ca_contexts)) }
+        taken = { None: set(context.basename for context in ca_contexts) }
+
+        planned = []
+        for entry in sorted(self.certs, key=lambda entry: not entry.is_ca):
+            ca_context = None
+            if not entry.is_ca:
+                if entry.issuer == entry.subject:
+                    ca_context = Store.self_signed_context()
+                else:
+                    ca_context = ca_by_subject.get(entry.issuer)
+                if ca_context is None:
+                    self.report(ImportResult(entry.name, None, FAILED,
+                                             'Issuing CA "{}" was not found'.format(entry.issuer)))
+                    continue
+            elif entry.subject in ca_by_subject:
+                self.report(ImportResult(ca_by_subject[entry.subject].basename, None, EXISTS, None))
+                continue
+
+            ca_name = ca_context.basename if ca_context else None
+            if entry.key_hash not in self.keys:
+                self.report(ImportResult(entry.name, ca_name, FAILED, 'No matching private key'))
+                continue
+
+            try:
+                if ca_name not in taken:
+                    taken[ca_name] = set()
+                context = self.place(entry, ca_context, taken[ca_name])
+            except FileExistsError as e:
+                self.report(ImportResult(entry.name, ca_name, FAILED, str(e)))
+                continue
+
+            if context is None:
+                self.report(ImportResult(entry.name, ca_name, EXISTS, None))
+                continue
+
+            if entry.is_ca:
+                ca_by_subject[entry.subject] = context
+            planned.append((context, entry))
+
+        return planned
+
+    def write(self, planned):
+        max_serials = {}
+
+        def stored(context):
+            ca_name = context.ca_context.basename if context.ca_context else None
+            self.report(ImportResult(context.basename, ca_name, IMPORTED, None))
+
+        with trace_span('import', 'write', certs=len(planned)):
+            with self.store.group_commit():
+                for context, entry in planned:
+                    key_block = self.read_block(self.keys[entry.key_hash])
+                    context.certificate = der_to_pem(self.read_block(entry.block).der, 'CERTIFICATE')
+                    context.private_key = der_to_pem(private_key_to_pkcs8(key_block.der, key_block.label),
+                                                     PEM_PKCS8_KEY)
+                    self.store.store(context, on_commit=stored)
+                    # the PEM text is on disk once staged
+                    context.certificate = context.private_key = None
+
+                    ca_context = context.ca_context
+                    if ca_context and ca_context.basename != Store.SELF_SIGNED_SUBDIR:
+                        serial = int(entry.serial, 16)
+                        if serial > max_serials.get(ca_context.basename, (None, -1))[1]:
+                            max_serials[ca_context.basename] = (ca_context, serial)
+
+        for ca_context, serial in max_serials.values():
+            self.serials.advance_past(ca_context, serial)
+
+    def run(self, paths, dry_run=False):
+        for path in paths:
+            self.scan(path)
+
+        planned = self.plan()
+        if dry_run:
+            for context, entry in planned:
+                self.report(ImportResult(context.basename,
+                                         context.ca_context.basename if context.ca_context else None,
+                                         IMPORTED, None))
+        else:
+            self.write(planned)
+
+        return self.results
+
+def pem_to_der_block(text):
+    return next(read_pem_blocks(text.encode().splitlines(keepends=True))).der
@@ -0,0 +1,325 @@
+__all__ = [ 'StoreIndex' ]
+
+import os
+import json
+import sqlite3
+import threading
+from urllib.parse import quote
+from datetime import datetime, timezone
+
+from .certinfo import CertInfo
+from .openssl import OpenSSL
+
+SCHEMA_VERSION = 3
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS certs (
+    path TEXT PRIMARY KEY,
+    mtime_ns INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    inode INTEGER NOT NULL,
+    subject TEXT NOT NULL,
+    issuer TEXT NOT NULL,
+    fingerprint TEXT NOT NULL,
+    fingerprint_sha256 TEXT NOT NULL,
+    serial TEXT NOT NULL,
+    not_before TEXT,
+    not_after TEXT,
+    subject_alt_name TEXT NOT NULL,
+    basic_constraints TEXT NOT NULL,
+    key_usage TEXT NOT NULL,
+    extended_usage TEXT NOT NULL,
+    not_before_ts INTEGER,
+    not_after_ts INTEGER
+);
+CREATE INDEX IF NOT EXISTS certs_subject ON certs (subject);
+CREATE INDEX IF NOT EXISTS certs_issuer ON certs (issuer);
+CREATE INDEX IF NOT EXISTS certs_not_after ON certs (not_after_ts);
+'''
+
+COLUMNS = ('path', 'mtime_ns', 'size', 'inode', 'subject', 'issuer', 'fingerprint',
+           'fingerprint_sha256', 'serial', 'not_before', 'not_after',
+           'subject_alt_name', 'basic_constraints', 'key_usage', 'extended_usage',
+           'not_before_ts', 'not_after_ts')
+
+# paths per "WHERE path IN (...)" query, below SQLite's host parameter limit
+LOOKUP_CHUNK = 500
+
+def to_timestamp(value):
+    return int(value.timestamp()) if value else None
+
+def from_timestamp(value):
+    return datetime.fromtimestamp(value, timezone.utc) if value is not None else None
+
+class StoreIndex:
+    INDEX_FILENAME = '.certman-index.sqlite'
+    BUSY_TIMEOUT = 30
+
+    # a read-only index only serves rows that are still current and never
+    # writes, so reading commands work on stores mounted read-only
+    def __init__(self, store, openssl=None, path=None, read_only=False):
+        self.store = store
+        self.openssl = openssl or OpenSSL()
+        self.path = path or os.path.join(store.root_dir, self.INDEX_FILENAME)
+        self.read_only = read_only
+        self._reset()
+
+    def _reset(self):
+        self._db = None
+        self._lock = threading.RLock()
+
+    # the connection is reopened by copies sent to other processes
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['_db']
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._reset()
+
+    @property
+    def db(self):
+        if self._db is None and self.read_only:
+            db = sqlite3.connect('file:{}?mode=ro'.format(quote(os.path.abspath(self.path))),
+                                 uri=True, timeout=self.BUSY_TIMEOUT, check_same_thread=False)
+            version = db.execute('PRAGMA user_version').fetchone()[0]
+            if version != SCHEMA_VERSION:
+                db.close()
+                raise sqlite3.DatabaseError('index schema version {} is not {}'.format(
+                    version, SCHEMA_VERSION))
+            self._db = db
+        elif self._db is None:
+            db = sqlite3.connect(self.path, timeout=self.BUSY_TIMEOUT, check_same_thread=False)
+            db.execute('PRAGMA journal_mode=WAL')
+            version = db.execute('PRAGMA user_version').fetchone()[0]
+            if version != SCHEMA_VERSION:
+                db.executescript('DROP TABLE IF EXISTS certs;')
+                db.executescript(SCHEMA)
+                db.execute('PRAGMA user_version={}'.format(SCHEMA_VERSION))
+                db.commit()
+            self._db = db
+
+        return self._db
+
+    # an idle index goes back to a rollback journal, so read-only connections
+    # need no -wal and -shm files beside it; another open connection keeps WAL
+    def close(self):
+        with self._lock:
+            if self._db is not None:
+                if not self.read_only:
+                    try:
+                        self._db.execute('PRAGMA busy_timeout=0')
+                        self._db.execute('PRAGMA journal_mode=DELETE')
+                    except sqlite3.Error:
+                        pass
+                self._db.close()
+                self._db = None
+
+    def relative_path(self, path):
+        return os.path.relpath(path, self.store.root_dir)
+
+    def stat_key(self, path):
+        st = self.store.stat(path)
+        return (st.st_mtime_ns, st.st_size, st.st_ino)
+
+    @staticmethod
+    def info_from_row(row):
+        certinfo = CertInfo()
+        (certinfo.subject, certinfo.issuer, certinfo.fingerprint,
+         certinfo.fingerprint_sha256, certinfo.serial,
+         certinfo.not_before_raw, certinfo.not_after_raw) = row[4:11]
+        certinfo._subject_alt_name = json.loads(row[11])
+        certinfo._basic_constraints = json.loads(row[12])
+        certinfo._key_usage = json.loads(row[13])
+        certinfo._extended_usage = json.loads(row[14])
+        # validity dates are parsed once, when the row is written
+        certinfo._not_before = from_timestamp(row[15])
+        certinfo._not_after = from_timestamp(row[16])
+        return certinfo
+
+    def lookup(self, path):
+        with self._lock:
+            row = self.db.execute('SELECT {} FROM certs WHERE path = ?'.format(', '.join(COLUMNS)),
+                                  (self.relative_path(path),)).fetchone()
+
+        if row is None:
+            return None
+
+        try:
+            if tuple(row[1:4]) != self.stat_key(path):
+                return None
+        except FileNotFoundError:
+            self.invalidate(path)
+            return None
+
+        return self.info_from_row(row)
+
+    # one query per chunk of paths; returns a CertInfo or None for every path
+    def lookup_many(self, paths):
+        rows = {}
+        relative_paths = [ self.relative_path(path) for path in paths ]
+        for start in range(0, len(relative_paths), LOOKUP_CHUNK):
+            chunk = relative_paths[start:start + LOOKUP_CHUNK]
+            with self._lock:
+                rows.update((row[0], row) for row in self.db.execute(
+                    'SELECT {} FROM certs WHERE path IN ({})'.format(
+                        ', '.join(COLUMNS), ', '.join('?' * len(chunk))), chunk))
+
+        infos = []
+        for path, relative_path in zip(paths, relative_paths):
+            row = rows.get(relative_path)
+            try:
+                if row is None or tuple(row[1:4]) != self.stat_key(path):
+                    row = None
+            except FileNotFoundError:
+                self.invalidate(path)
+                row = None
+            infos.append(self.info_from_row(row) if row else None)
+
+        return infos
+
+    def row(self, path, certinfo, stat_key=None):
+        stat_key = stat_key or self.stat_key(path)
+        return (self.relative_path(path), *stat_key,
+                certinfo.subject, certinfo.issuer, certinfo.fingerprint,
+                certinfo.fingerprint_sha256, certinfo.serial,
+                certinfo.not_before_raw, certinfo.not_after_raw,
+                json.dumps(certinfo.subject_alt_name),
+                json.dumps(certinfo.basic_constraints),
+                json.dumps(certinfo.key_usage),
+                json.dumps(certinfo.extended_usage),
+                to_timestamp(certinfo.not_before),
+                to_timestamp(certinfo.not_after))
+
+    def record(self, path, certinfo, stat_key=None):
+        self.record_many([ (path, certinfo, stat_key) ])
+
+    # one transaction for all entries
+    def record_many(self, entries):
+        if self.read_only:
+            return
+
+        rows = [ self.row(path, certinfo, stat_key) for path, certinfo, stat_key in entries ]
+
+        with self._lock:
+            self.db.executemany('INSERT OR REPLACE INTO certs ({}) VALUES ({})'.format(
+                ', '.join(COLUMNS), ', '.join('?' * len(COLUMNS))), rows)
+            self.db.commit()
+
+    # names of root-level CA certificates indexed with a subject; rows may be
+    # stale, so callers check the certificate itself
+    def find_ca_basenames(self, subject):
+        with self._lock:
+            paths = [ row[0] for row in self.db.execute(
+                'SELECT path FROM certs WHERE subject = ?', (subject,)) ]
+
+        return [ path[:-len(self.store.CERT_SUFFIX)] for path in paths
+                 if os.sep not in path and path.endswith(self.store.CERT_SUFFIX) ]
+
+    def invalidate(self, path):
+        if self.read_only:
+            return
+
+        with self._lock:
+            self.db.execute('DELETE FROM certs WHERE path = ?', (self.relative_path(path),))
+            self.db.commit()
+
+    # rows follow certificates renamed or hard-linked elsewhere, which keeps
+    # their stat keys; a row already at the new path is newer and stays
+    def move_many(self, moves):
+        if self.read_only:
+            return
+
+        moves = [ (self.relative_path(new_path), self.relative_path(old_path))
+                  for old_path, new_path in moves ]
+
+        with self._lock:
+            self.db.executemany('UPDATE OR IGNORE certs SET path = ? WHERE path = ?', moves)
+            self.db.executemany('DELETE FROM certs WHERE path = ?',
+                                [ (old_path,) for _, old_path in moves ])
+            self.db.commit()
+
+    def update(self, context):
+        path = self.store.get_context_paths(context).cert
+        # stat before reading, so a concurrent change is caught by the next lookup
+        stat_key = self.stat_key(path)
+        self.store.load_context(context, load_cert=True)
+        certinfo = self.openssl.get_info(context)
+        self.record(path, certinfo, stat_key)
+        return certinfo
+
+    def update_many(self, contexts):
+        contexts = list(contexts)
+        paths = [ self.store.get_context_paths(context).cert for context in contexts ]
+        stat_keys = [ self.stat_key(path) for path in paths ]
+        for context in contexts:
+            self.store.load_context(context, load_cert=True)
+
+        infos = self.openssl.get_info_many(contexts)
+        self.record_many(zip(paths, infos, stat_keys))
+        return infos
+
+    def get_info(self, context):
+        path = self.store.get_context_paths(context).cert
+        certinfo = self.lookup(path)
+        if certinfo is None:
+            certinfo = self.update(context)
+
+        return certinfo
+
+    def get_info_many(self, contexts, jobs=None):
+        contexts = list(contexts)
+        paths = [ self.store.get_context_paths(context).cert for context in contexts ]
+        infos = self.lookup_many(paths)
+        stale = []
+
+        for num, (context, path, certinfo) in enumerate(zip(contexts, paths, infos)):
+            if certinfo is None:
+                stale.append((num, path, self.stat_key(path)))
+                self.store.load_context(context, load_cert=True)
+
+        if stale:
+            parsed = self.openssl.get_info_many((contexts[num] for num, _, _ in stale), jobs=jobs)
+            self.record_many((path, certinfo, stat_key)
+                             for (_, path, stat_key), certinfo in zip(stale, parsed))
+            for (num, _, _), certinfo in zip(stale, parsed):
+                infos[num] = certinfo
+
+        return infos
+
+    def prune(self):
+        with self._lock:
+            paths = [ row[0] for row in self.db.execute('SELECT path FROM certs') ]
+
+        removed = 0
+        for path in paths:
+            path = os.path.join(self.store.root_dir, path)
+            if not self.store.exists(path):
+                self.invalidate(path)
+                removed += 1
+
+        return removed
+
+    def reindex(self, full=False):
+        if full:
+            with self._lock:
+                self.db.execute('DELETE FROM certs')
+                self.db.commit()
+
+        self.prune()
+
+        count = 0
+        for ca_context in self.store.get_ca_certs(load_cert=False):
+            self.get_info(ca_context)
+            count += 1
+            for context in self.store.get_certs(ca_context, load_cert=False):
+                self.get_info(context)
+                count += 1
+
+        for context in self.store.get_certs(self.store.self_signed_context(), load_cert=False):
+            self.get_info(context)
+            count += 1
+
+        return count
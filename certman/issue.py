@@ -0,0 +1,54 @@
+__all__ = [ 'verify_can_issue', 'issue_certificate', 'make_certificate', 'store_certificate' ]
+
+from .store import Store
+from .serial import SerialAllocator
+
+def is_signed_by_ca(context):
+    ca_context = context.ca_context
+    return bool(ca_context) and ca_context.basename != Store.SELF_SIGNED_SUBDIR
+
+def verify_can_issue(store, context):
+    if is_signed_by_ca(context):
+        store.verify_exists(context.ca_context, check_cert=True, check_key=True)
+
+    store.verify_exists(context, check_cert=True, check_key=True,
+                        check_rsa_key=True, check_req=True, inverted_check=True)
+
+def issue_certificate(store, openssl, context, request, key_pool=None, on_commit=None,
+                      serials=None, serial=None):
+    make_certificate(store, openssl, context, request, key_pool=key_pool,
+                     serials=serials, serial=serial)
+    store_certificate(store, context, on_commit=on_commit)
+    return context
+
+def issue_certificate_with_key(store, openssl, context, request, key_path, serial=None):
+    make_certificate_with_key(store, openssl, context, request, key_path, serial=serial)
+    store_certificate(store, context)
+    return context
+
+def make_certificate(store, openssl, context, request, key_pool=None, serials=None, serial=None):
+    if serial is None and is_signed_by_ca(context):
+        serial = (serials or SerialAllocator(store)).allocate(context.ca_context)
+
+    # EC and Ed25519 keys are generated faster than a pooled key is claimed
+    if key_pool and request.is_rsa:
+        with key_pool.take(request.bits) as key_path:
+            return make_certificate_with_key(store, openssl, context, request, key_path,
+                                             serial=serial)
+
+    return make_certificate_with_key(store, openssl, context, request, None, serial=serial)
+
+def make_certificate_with_key(store, openssl, context, request, key_path, serial=None):
+    if is_signed_by_ca(context):
+        if serial is None:
+            serial = SerialAllocator(store).allocate(context.ca_context)
+        ca_paths = store.get_context_paths(context.ca_context)
+        openssl.signed(context, request, ca_paths, key_path=key_path, serial=serial)
+    else:
+        openssl.self_signed(context, request, key_path=key_path)
+
+    return context
+
+def store_certificate(store, context, on_commit=None):
+    # single-process signing and self-signing leave no CSR behind
+    store.store(context, with_request=context.request is not None, on_commit=on_commit)
@@ -0,0 +1,166 @@
+__all__ = [ 'KeyPool' ]
+
+import os
+import uuid
+import threading
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor
+
+from .openssl import OpenSSL
+from .trace import trace_span
+
+def is_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+class KeyPool:
+    POOL_SUBDIR = '+KEYPOOL'
+    KEY_SUFFIX = '.key'
+    CLAIMED_SUFFIX = '.claimed'
+    PENDING_PREFIX = '.pending-'
+
+    def __init__(self, store):
+        self.store = store
+        self.pool_dir = os.path.join(store.key_dir, self.POOL_SUBDIR)
+        self.sweep()
+
+    # keys claimed by processes that died before releasing them; such a key
+    # may already be in a certificate, so it is removed, never put back
+    def sweep(self):
+        try:
+            subdirs = os.listdir(self.pool_dir)
+        except FileNotFoundError:
+            return
+
+        for subdir in subdirs:
+            key_dir = os.path.join(self.pool_dir, subdir)
+            try:
+                names = os.listdir(key_dir)
+            except (FileNotFoundError, NotADirectoryError):
+                continue
+
+            for name in names:
+                if not name.endswith(self.CLAIMED_SUFFIX):
+                    continue
+                try:
+                    pid = int(name[:-len(self.CLAIMED_SUFFIX)].split('.')[-2])
+                except (ValueError, IndexError):
+                    continue
+                if not is_alive(pid):
+                    try:
+                        os.unlink(os.path.join(key_dir, name))
+                    except FileNotFoundError:
+                        pass
+
+    def get_dir(self, bits):
+        return os.path.join(self.pool_dir, 'rsa-{}'.format(bits))
+
+    def make_dir(self, bits):
+        key_dir = self.get_dir(bits)
+        if os.path.isdir(key_dir):
+            return key_dir
+
+        os.makedirs(os.path.dirname(self.store.key_dir), exist_ok=True)
+        # one level at a time, os.makedirs() only gives the last one its mode,
+        # and the umask applies to mkdir, so each new level gets a chmod
+        for path in (self.store.key_dir, self.pool_dir, key_dir):
+            try:
+                os.mkdir(path, self.store.PRIVATE_KEY_SUBDIR_PERMS)
+            except FileExistsError:
+                continue
+            os.chmod(path, self.store.PRIVATE_KEY_SUBDIR_PERMS)
+        return key_dir
+
+    def list_keys(self, bits):
+        try:
+            return [ f for f in os.listdir(self.get_dir(bits)) if f.endswith(self.KEY_SUFFIX) ]
+        except FileNotFoundError:
+            return []
+
+    def count(self, bits):
+        return len(self.list_keys(bits))
+
+    def status(self):
+        try:
+            subdirs = sorted(os.listdir(self.pool_dir))
+        except FileNotFoundError:
+            return
+
+        for subdir in subdirs:
+            if subdir.startswith('rsa-'):
+                bits = int(subdir[len('rsa-'):])
+                yield bits, self.count(bits)
+
+    def add(self, bits, private_key):
+        key_dir = self.make_dir(bits)
+        name = uuid.uuid4().hex
+        tmp_path = os.path.join(key_dir, self.PENDING_PREFIX + name)
+        with open(tmp_path, 'wt', opener=self.store.restricted_opener) as fd:
+            fd.write(private_key)
+
+        # a key only becomes visible to takers once it is complete
+        os.rename(tmp_path, os.path.join(key_dir, name + self.KEY_SUFFIX))
+
+    def claim(self, bits):
+        with trace_span('keypool', 'claim', bits=bits) as span:
+            path = self._claim(bits)
+            span.set(hit=bool(path))
+        return path
+
+    def _claim(self, bits):
+        key_dir = self.get_dir(bits)
+        claim_suffix = '.{}.{}{}'.format(os.getpid(), threading.get_ident(), self.CLAIMED_SUFFIX)
+
+        for name in self.list_keys(bits):
+            path = os.path.join(key_dir, name)
+            claimed_path = path + claim_suffix
+            try:
+                # rename is atomic, only one of the competing takers succeeds
+                os.rename(path, claimed_path)
+            except FileNotFoundError:
+                continue
+
+            return claimed_path
+
+        return None
+
+    def release(self, claimed_path):
+        os.unlink(claimed_path)
+
+    @contextmanager
+    def take(self, bits):
+        path = self.claim(bits)
+        try:
+            yield path
+        finally:
+            if path:
+                self.release(path)
+
+    def fill(self, bits, count, openssl=None, jobs=None):
+        openssl = openssl or OpenSSL()
+        if count <= 0:
+            return 0
+
+        if jobs == 1 or count == 1:
+            for _ in range(count):
+                _generate_key(self, openssl, bits)
+            return count
+
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            futures = [ executor.submit(_generate_key, self, openssl, bits) for _ in range(count) ]
+            for future in futures:
+                future.result()
+
+        return count
+
+    def top_up(self, bits, keep, openssl=None, jobs=None):
+        return self.fill(bits, keep - self.count(bits), openssl=openssl, jobs=jobs)
+
+
+def _generate_key(key_pool, openssl, bits):
+    key_pool.add(bits, openssl.generate_rsa_key(bits))
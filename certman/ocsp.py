@@ -0,0 +1,307 @@
+__all__ = [ 'OCSPResponder', 'make_ocsp_server' ]
+
+import sys
+import time
+import base64
+import threading
+from collections import namedtuple, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler
+from urllib.parse import unquote
+
+from .revocation import RevocationList, normalize_serial, NO_EXPIRY
+from .server import TCPServer, UnixServer, MAX_BODY_SIZE
+from .temporary import make_temp_file, remove_temp_file
+from .x509 import DecodeError, pem_to_der, public_key_hash, decode_ocsp_request
+from .trace import trace_span
+
+RESPONSE_MINUTES = 24 * 60
+# responses are signed again once less than this share of their validity is left
+REFRESH_FRACTION = 0.25
+CACHE_SIZE = 20000
+SIGN_JOBS = 8
+CHECK_INTERVAL = 60
+
+# unsigned OCSPResponses carrying only a responseStatus
+RESPONSE_MALFORMED = bytes.fromhex('30030a0101')
+RESPONSE_TRY_LATER = bytes.fromhex('30030a0103')
+RESPONSE_UNAUTHORIZED = bytes.fromhex('30030a0106')
+
+Response = namedtuple('Response', 'der next_update revoked'.split())
+
+# signed responses, least recently served evicted first
+class ResponseCache:
+    def __init__(self, size=CACHE_SIZE):
+        self.size = size
+        self.responses = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            response = self.responses.get(key)
+            if response is not None:
+                self.responses.move_to_end(key)
+            return response
+
+    def peek(self, key):
+        with self._lock:
+            return self.responses.get(key)
+
+    def put(self, key, response):
+        with self._lock:
+            self.responses[key] = response
+            self.responses.move_to_end(key)
+            while len(self.responses) > self.size:
+                self.responses.popitem(last=False)
+
+    def keys(self):
+        with self._lock:
+            return list(self.responses)
+
+    def __len__(self):
+        return len(self.responses)
+
+class Issuer:
+    def __init__(self, store, context):
+        self.context = context
+        self.paths = store.get_context_paths(context)
+        self.key_hash = public_key_hash(pem_to_der(context.require_certificate))
+        self.revocations = RevocationList(store, context)
+        # serials of the certificates found in the store
+        self.serials = set()
+        # serials found by the previous refresh
+        self.scanned = set()
+        # revoked serials seen by the previous refresh
+        self.revoked = set()
+
+    def is_known(self, serial):
+        return serial in self.serials or serial in self.revocations.entries
+
+    # "openssl ca" index with every known serial, revocations taking precedence;
+    # openssl wants unique names for valid entries, so the serial stands in for one
+    def database(self):
+        lines = OrderedDict((serial, '\t'.join(('V', NO_EXPIRY, '', serial, 'unknown', serial)))
+                            for serial in self.serials)
+        for serial, entry in self.revocations.entries.items():
+            lines[serial] = RevocationList.format_line(entry).rstrip('\n')
+        return ''.join(line + '\n' for line in lines.values())
+
+# Answers OCSP requests for the CAs of a store from signed responses held in
+# memory. Responses are signed ahead of time by a background thread, which
+# also signs them again before their nextUpdate and as soon as a serial is
+# revoked. The request path never touches a CA key: a serial whose response
+# was evicted gets "tryLater" and is queued for the background thread.
+class OCSPResponder:
+    minutes = RESPONSE_MINUTES
+    jobs = SIGN_JOBS
+    check_interval = CHECK_INTERVAL
+    verbose = False
+
+    def __init__(self, store, openssl, ca_basenames=None, minutes=None, cache_size=None,
+                 jobs=None, check_interval=None, verbose=None):
+        self.store = store
+        self.openssl = openssl
+        self.ca_basenames = ca_basenames
+        if minutes:
+            self.minutes = minutes
+        if jobs:
+            self.jobs = jobs
+        if check_interval:
+            self.check_interval = check_interval
+        if verbose is not None:
+            self.verbose = verbose
+
+        self.cache = ResponseCache(cache_size or CACHE_SIZE)
+        self.issuers = {}
+        self.pending = set()
+        self.pending_lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.stopping = threading.Event()
+        self.thread = None
+
+    def load_issuers(self):
+        issuers = {}
+        for context in self.store.get_ca_certs(load_cert=True):
+            if self.ca_basenames and context.basename not in self.ca_basenames:
+                continue
+            issuer = Issuer(self.store, context)
+            issuers[issuer.key_hash] = issuer
+
+        missing = set(self.ca_basenames or ()) - set(i.context.basename for i in issuers.values())
+        if missing:
+            raise FileNotFoundError('CA certificate {} was not found in the store'.format(
+                ', '.join(sorted(missing))))
+
+        self.issuers = issuers
+
+    def scan(self, issuer):
+        info_source = self.store.index or self.openssl
+        contexts = list(self.store.get_certs(issuer.context, load_cert=not self.store.index))
+        issuer.serials = set(normalize_serial(certinfo.serial)
+                             for certinfo in info_source.get_info_many(contexts))
+        issuer.revocations.refresh()
+
+    def due(self, issuer, initial=False):
+        now = time.time()
+        margin = self.minutes * 60 * REFRESH_FRACTION
+        revoked = set(issuer.revocations.entries)
+
+        if initial:
+            # certificates in the store before serials that were only revoked
+            serials = sorted(issuer.serials) + sorted(revoked - issuer.serials)
+        else:
+            # certificates issued or revoked since the previous refresh
+            serials = sorted(revoked - issuer.revoked) + sorted(issuer.serials - issuer.scanned)
+            for key_hash, serial in self.cache.keys():
+                if key_hash != issuer.key_hash:
+                    continue
+                response = self.cache.peek((key_hash, serial))
+                if (response is None or response.next_update - now < margin
+                        or response.revoked != (serial in revoked)):
+                    serials.append(serial)
+
+        with self.pending_lock:
+            queued = set(serial for key_hash, serial in self.pending if key_hash == issuer.key_hash)
+            self.pending -= set((issuer.key_hash, serial) for serial in queued)
+
+        issuer.revoked = revoked
+        issuer.scanned = issuer.serials
+        # requested serials first, anything beyond the cache size would be evicted at once
+        due = OrderedDict.fromkeys(sorted(serial for serial in queued if issuer.is_known(serial)))
+        due.update(OrderedDict.fromkeys(serials))
+        return list(due)[:self.cache.size]
+
+    def sign(self, issuer, serials):
+        if not serials:
+            return
+
+        database_path = make_temp_file(issuer.database())
+        try:
+            def sign_one(serial):
+                return serial, self.openssl.ocsp_response(issuer.paths, database_path, serial,
+                                                          self.minutes)
+
+            # counted from before signing, so it never outlives the real nextUpdate
+            next_update = time.time() + self.minutes * 60
+            with trace_span('ocsp', 'sign', ca=issuer.context.basename, responses=len(serials)):
+                with ThreadPoolExecutor(max_workers=self.jobs) as executor:
+                    for serial, der in executor.map(sign_one, serials):
+                        self.cache.put((issuer.key_hash, serial), Response(
+                            der, next_update, serial in issuer.revocations.entries))
+        finally:
+            remove_temp_file(database_path)
+
+    def refresh(self, initial=False):
+        for issuer in list(self.issuers.values()):
+            self.scan(issuer)
+            self.sign(issuer, self.due(issuer, initial=initial))
+
+    def lookup(self, request_der):
+        try:
+            cert_ids = decode_ocsp_request(request_der)
+            # pre-signed responses answer exactly one certificate
+            if len(cert_ids) != 1:
+                raise DecodeError('Only single certificate requests are supported')
+            key_hash, serial = cert_ids[0]
+            serial = normalize_serial(serial)
+        except ValueError:
+            return RESPONSE_MALFORMED, None
+
+        issuer = self.issuers.get(key_hash)
+        if issuer is None:
+            return RESPONSE_UNAUTHORIZED, None
+
+        response = self.cache.get((key_hash, serial))
+        if response is not None and response.next_update > time.time():
+            return response.der, response.next_update
+
+        if not issuer.is_known(serial):
+            return RESPONSE_UNAUTHORIZED, None
+
+        with self.pending_lock:
+            self.pending.add((key_hash, serial))
+        self.wakeup.set()
+        return RESPONSE_TRY_LATER, None
+
+    def run(self):
+        initial = True
+        while not self.stopping.is_set():
+            try:
+                self.refresh(initial=initial)
+                initial = False
+            except Exception as e:
+                self.log_message('OCSP refresh failed: %s', e)
+
+            self.wakeup.wait(self.check_interval)
+            self.wakeup.clear()
+
+    # as the request handlers log, with the same -v switch
+    def log_message(self, format, *args):
+        if self.verbose:
+            sys.stderr.write('[{}] {}\n'.format(time.strftime('%d/%b/%Y %H:%M:%S'), format % args))
+
+    def start(self):
+        self.load_issuers()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stopping.set()
+        self.wakeup.set()
+        if self.thread:
+            self.thread.join()
+            self.thread = None
+
+class OCSPRequestHandler(BaseHTTPRequestHandler):
+    server_version = 'certman-ocsp'
+
+    @property
+    def responder(self):
+        return self.server.responder
+
+    def address_string(self):
+        if isinstance(self.client_address, tuple):
+            return self.client_address[0]
+        return 'unix'
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def send_ocsp(self, request_der):
+        der, next_update = self.responder.lookup(request_der)
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/ocsp-response')
+        self.send_header('Content-Length', str(len(der)))
+        if next_update:
+            self.send_header('Cache-Control', 'max-age={}, public, no-transform, must-revalidate'
+                             .format(max(0, int(next_update - time.time()))))
+        self.end_headers()
+        self.wfile.write(der)
+
+    def do_GET(self):
+        try:
+            request_der = base64.b64decode(unquote(self.path.lstrip('/')), validate=True)
+        except ValueError:
+            self.send_ocsp(b'')
+            return
+
+        self.send_ocsp(request_der)
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        if length > MAX_BODY_SIZE:
+            self.send_error(413)
+            return
+
+        self.send_ocsp(self.rfile.read(length))
+
+def make_ocsp_server(responder, socket_path=None, host='127.0.0.1', port=8081, verbose=False):
+    if socket_path:
+        server = UnixServer(socket_path, OCSPRequestHandler)
+    else:
+        server = TCPServer((host, port), OCSPRequestHandler)
+
+    server.responder = responder
+    server.verbose = verbose
+    return server
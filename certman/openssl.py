@@ -1,67 +1,389 @@
-__all__ = [ 'OpenSSL' ]
+__all__ = [ 'OpenSSL', 'PARSER_NATIVE', 'PARSER_OPENSSL' ]
 
 import subprocess
+import hashlib
+import base64
 import re
+from concurrent.futures import ThreadPoolExecutor
 
-from .temporary import make_temp_file
+from .temporary import inherited_file, make_temp_file, remove_temp_file
+from .cfg import Config
+from .trace import trace_span, argv_summary, NULL_SPAN
 from .certinfo import CertInfo
+from .x509 import DecodeError, pem_to_der, parse_pem, format_fingerprint, certificate_names
 
 TIMEOUT = 30
+GET_INFO_JOBS = 8
+PEM_LINE_LENGTH = 64
+
+PARSER_NATIVE = 'native'
+PARSER_OPENSSL = 'openssl'
+
+def der_to_pem(der):
+    text = base64.b64encode(der).decode()
+    return '-----BEGIN CERTIFICATE-----\n{}\n-----END CERTIFICATE-----\n'.format('\n'.join(
+            text[pos:pos + PEM_LINE_LENGTH] for pos in range(0, len(text), PEM_LINE_LENGTH)))
+
+# (binary, command, option) -> whether the command lists the option in its help
+_option_support = {}
 
 class OpenSSL:
     binary = 'openssl'
+    parser = PARSER_NATIVE
+    # how commands are actually run, see OpenSSLPool
+    engine = 'spawn'
+
+    INFO_ARGS = [
+        'x509', '-noout',
+        '-dates', '-subject', '-issuer', '-email', '-fingerprint', '-serial',
+        '-ext', 'basicConstraints,keyUsage,extendedKeyUsage,subjectAltName',
+        '-nameopt', 'esc_2253,esc_2254,esc_ctrl,utf8,sep_comma_plus_space',
+        ]
+
+    # a batch of certificates wrapped by crl2pkcs7, see get_info_openssl_many()
+    PRINT_CERTS_ARGS = [ 'pkcs7', '-print_certs', '-text', '-noout' ]
 
-    def __init__(self, binary=None):
+    RE_TEXT_SECTION = re.compile(r'^Certificate:$', re.M)
+    RE_TEXT_SERIAL = re.compile(r'^ +Serial Number: ?(?:(-?)\d+ \(-?0x([0-9a-f]+)\)|'
+                                r'(\(Negative\))?\n +([0-9a-f:]+))$', re.M)
+    RE_TEXT_VALIDITY = re.compile(r'^ +Not Before: (.+)\n +Not After : (.+)$', re.M)
+    RE_TEXT_EXTENSION = re.compile(r'^ +(X509v3 (?:Basic Constraints|Key Usage|Extended Key Usage|'
+                                   r'Subject Alternative Name):.*)\n((?: {16}.*\n?)*)', re.M)
+
+    def __init__(self, binary=None, parser=None):
         if binary is not None:
             self.binary = binary
 
-    def run(self, args, input=None):
-        try:
-            proc = subprocess.run([self.binary, *args],
-                    capture_output=True, check=True, text=True,
-                    timeout=TIMEOUT, input=input)
+        if parser is not None:
+            self.parser = parser
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
 
-        except subprocess.CalledProcessError as e:
-            raise Exception('{}\nOutput:\n{}'.format(e, e.stderr))
+    def close(self):
+        pass
+
+    def run(self, args, input=None, pass_fds=()):
+        with trace_span('openssl', args[0], input_bytes=len(input) if input else 0) as span:
+            # summarized only when a tracer takes it
+            if span is not NULL_SPAN:
+                span.set(argv=argv_summary(args))
+            try:
+                proc = subprocess.run([self.binary, *args],
+                        capture_output=True, check=True, text=True,
+                        timeout=TIMEOUT, input=input, pass_fds=pass_fds)
+
+            except subprocess.CalledProcessError as e:
+                span.set(status=e.returncode, output_bytes=len(e.stdout or ''),
+                         error_bytes=len(e.stderr or ''))
+                raise Exception('{}\nOutput:\n{}'.format(e, e.stderr))
+
+            span.set(status=proc.returncode, output_bytes=len(proc.stdout),
+                     error_bytes=len(proc.stderr))
 
         return proc.stdout
 
     def add_rsa_key(self, context):
-        output = self.run(['rsa'], input=context.require_private_key)
+        output = self.run(self.rsa_key_args, input=context.require_private_key)
+        context.add(output)
+        return context
+
+    def generate_rsa_key(self, bits):
+        return self.run(['genpkey', '-algorithm', 'RSA', '-pkeyopt', 'rsa_keygen_bits:{}'.format(bits)])
+
+    def generate_key(self, request):
+        return self.run(['genpkey', *request.genpkey_args])
+
+    @staticmethod
+    def key_args(context, key_path):
+        if not key_path:
+            return []
+
+        # openssl does not print a key it did not generate
+        context.add_from_file(key_path)
+        return ['-key', key_path]
+
+    @classmethod
+    def new_key_args(cls, context, request, key_path):
+        if key_path:
+            return cls.key_args(context, key_path)
+        return request.new_key_args
+
+    def request(self, context, request, key_path=None):
+        output = self.run(['req', '-new', '-config', '-',
+                           *self.new_key_args(context, request, key_path)],
+                          input=request.config.generate)
         context.add(output)
         return context
 
-    def request(self, context, request):
+    def self_signed(self, context, request, key_path=None):
         cfg_text = request.config.generate
-        tmp_path = make_temp_file(cfg_text)
-        output = self.run(['req', '-new', '-config', tmp_path])
+        output = self.run(self.self_signed_args(context, request, key_path), input=cfg_text)
         context.add(output)
-        return context, tmp_path
+        return context
+
+    @classmethod
+    def self_signed_args(cls, context, request, key_path=None):
+        return [*'req -x509 -config - -days {}'.format(request.days).split(),
+                *cls.new_key_args(context, request, key_path)]
+
+    def supports_option(self, command, option):
+        key = (self.binary, command, option)
+        supported = _option_support.get(key)
+        if supported is None:
+            try:
+                proc = subprocess.run([self.binary, command, '-help'], capture_output=True,
+                                      text=True, timeout=TIMEOUT)
+                supported = ' {} '.format(option) in proc.stdout + proc.stderr
+            except (OSError, subprocess.TimeoutExpired):
+                supported = False
+            _option_support[key] = supported
+
+        return supported
+
+    # "openssl req" can sign with -CA/-CAkey since OpenSSL 3.0
+    @property
+    def req_ca_signing(self):
+        return self.supports_option('req', '-CA')
+
+    # OpenSSL 3.0 writes PKCS#8 unless asked for the traditional format
+    @property
+    def rsa_key_args(self):
+        if self.supports_option('rsa', '-traditional'):
+            return ['rsa', '-traditional']
+        return ['rsa']
 
-    def self_signed(self, context, request):
+    def signed(self, context, request, ca_paths, key_path=None, serial=None):
         cfg_text = request.config.generate
-        output = self.run('req -x509 -config - -days {}'.format(request.days).split(), input=cfg_text)
+
+        # key, certificate and CA signature in one process, the CSR is never materialized
+        if self.req_ca_signing:
+            output = self.run(self.req_sign_args(context, request, ca_paths, key_path, serial),
+                              input=cfg_text)
+            context.add(output)
+            return context
+
+        self.request(context, request, key_path=key_path)
+        with inherited_file(cfg_text) as (extfile_path, pass_fds):
+            output = self.run(self.sign_args(request, ca_paths, extfile_path, serial),
+                              input=context.require_request, pass_fds=pass_fds)
+
         context.add(output)
         return context
 
-    def signed(self, context, request, ca_paths):
-        _, tmp_path = self.request(context, request)
-        output = self.run([
+    @staticmethod
+    def serial_args(serial):
+        if serial is None:
+            return []
+        return ['-set_serial', '0x{:X}'.format(serial)]
+
+    @classmethod
+    def req_sign_args(cls, context, request, ca_paths, key_path=None, serial=None):
+        return [
+            'req', '-new', '-x509', '-config', '-',
+            '-CA', ca_paths.cert,
+            '-CAkey', ca_paths.key,
+            '-days', str(request.days),
+            *cls.serial_args(serial),
+            *cls.new_key_args(context, request, key_path),
+            ]
+
+    # without an allocated serial openssl keeps its own counter in a .srl file
+    @classmethod
+    def sign_args(cls, request, ca_paths, extfile_path, serial=None):
+        return [
             'x509', '-req', '-in', '-',
             '-CA', ca_paths.cert,
             '-CAkey', ca_paths.key,
             '-days', str(request.days),
-            '-CAcreateserial',
-            '-extfile', tmp_path, '-extensions', 'v3_ext',
-            ], input=context.require_request)
-        context.add(output)
-        return context
+            *(cls.serial_args(serial) if serial is not None else ['-CAcreateserial']),
+            '-extfile', extfile_path, '-extensions', 'v3_ext',
+            ]
+
+    # the database is in the "openssl ca" index format, see RevocationList
+    def crl(self, ca_paths, database, number, days, base_number=None):
+        with inherited_file(database) as (database_path, database_fds):
+            cfg_text = self.crl_config(database_path, number, days, base_number).generate
+            with inherited_file(cfg_text) as (config_path, config_fds):
+                return self.run(self.crl_args(ca_paths, config_path),
+                                pass_fds=(*database_fds, *config_fds))
+
+    # CRL numbers are kept by certman, so "openssl ca" never writes a crlnumber file
+    @staticmethod
+    def crl_config(database_path, number, days, base_number=None):
+        config = Config()
+
+        config['ca']['default_ca'] = 'crl_ca'
+        crl_ca = config['crl_ca']
+        crl_ca['database'] = database_path
+        crl_ca['default_md'] = 'default'
+        crl_ca['default_crl_days'] = days
+        crl_ca['crl_extensions'] = 'crl_ext'
+
+        crl_ext = config['crl_ext']
+        crl_ext['authorityKeyIdentifier'] = 'keyid'
+        crl_ext['2.5.29.20'] = 'ASN1:INTEGER:{}'.format(number)
+        if base_number is not None:
+            # deltaCRLIndicator
+            crl_ext['2.5.29.27'] = 'critical,ASN1:INTEGER:{}'.format(base_number)
+
+        return config
+
+    @staticmethod
+    def crl_args(ca_paths, config_path):
+        return [
+            'ca', '-gencrl', '-batch', '-config', config_path,
+            '-cert', ca_paths.cert,
+            '-keyfile', ca_paths.key,
+            ]
+
+    # signs a response for one serial: with -index and -serial, "openssl ocsp"
+    # builds the request and answers it in the same run
+    def ocsp_response(self, ca_paths, database_path, serial, minutes):
+        response_path = make_temp_file('')
+        try:
+            self.run(self.ocsp_args(ca_paths, database_path, serial, minutes, response_path))
+            with open(response_path, 'rb') as fd:
+                return fd.read()
+        finally:
+            remove_temp_file(response_path)
+
+    @staticmethod
+    def ocsp_args(ca_paths, database_path, serial, minutes, response_path):
+        return [
+            'ocsp', '-index', database_path,
+            '-CA', ca_paths.cert,
+            '-rsigner', ca_paths.cert,
+            '-rkey', ca_paths.key,
+            '-issuer', ca_paths.cert,
+            '-serial', '0x{}'.format(serial),
+            '-no_nonce', '-nmin', str(minutes),
+            '-respout', response_path,
+            ]
+
+    # PEM SubjectPublicKeyInfo of a private key
+    def public_key(self, private_key):
+        return self.run(['pkey', '-pubout'], input=private_key)
+
+    # certs-only PKCS#7 of a PEM bundle, written to output_path
+    def pkcs7(self, certs_path, output_path, der=False):
+        self.run(self.pkcs7_args(certs_path, output_path, der))
+
+    @staticmethod
+    def pkcs7_args(certs_path, output_path, der=False):
+        return [
+            'crl2pkcs7', '-nocrl',
+            '-certfile', certs_path,
+            '-outform', 'DER' if der else 'PEM',
+            '-out', output_path,
+            ]
 
     def get_info(self, context):
-        output = self.run([
-            'x509', '-noout',
-            '-dates', '-subject', '-issuer', '-email', '-fingerprint',
-            '-ext', 'basicConstraints,keyUsage,subjectAltName',
-            '-nameopt', 'esc_2253,esc_2254,esc_ctrl,utf8,sep_comma_plus_space',
-            ], input=context.require_certificate)
-        return CertInfo.parse(output)
+        if self.parser == PARSER_NATIVE:
+            try:
+                return parse_pem(context.require_certificate)
+            except DecodeError:
+                pass
+
+        return self.get_info_openssl(context)
+
+    def get_info_many(self, contexts, jobs=None):
+        contexts = list(contexts)
+        infos = [ None ] * len(contexts)
+        pending = []
+
+        for num, context in enumerate(contexts):
+            if self.parser == PARSER_NATIVE:
+                try:
+                    infos[num] = parse_pem(context.require_certificate)
+                    continue
+                except DecodeError:
+                    pass
+
+            pending.append(num)
+
+        if pending:
+            # whatever the built-in decoder cannot read goes to openssl in one batch
+            results = self.get_info_openssl_many([ contexts[num] for num in pending ], jobs=jobs)
+            for num, certinfo in zip(pending, results):
+                infos[num] = certinfo
+
+        return infos
+
+    # "x509" reads a single certificate, so a batch is wrapped by crl2pkcs7 and
+    # printed by "pkcs7 -print_certs -text": two runs for any number. That text
+    # ignores -nameopt, so names come from the built-in decoder, and whatever
+    # it cannot name goes through get_info_openssl() one by one.
+    def get_info_openssl_many(self, contexts, jobs=None):
+        contexts = list(contexts)
+        infos = [ None ] * len(contexts)
+        batch = []
+        single = []
+
+        for num, context in enumerate(contexts):
+            try:
+                der = pem_to_der(context.require_certificate)
+                batch.append((num, der, certificate_names(der)))
+            except DecodeError:
+                single.append(num)
+
+        if batch:
+            sections = self.print_certs([ der for _, der, _ in batch ])
+            for (num, der, names), section in zip(batch, sections):
+                infos[num] = self.parse_info(contexts[num], self.info_from_text(section, der, *names))
+
+        if single:
+            with ThreadPoolExecutor(max_workers=jobs or GET_INFO_JOBS) as executor:
+                results = executor.map(lambda num: self.get_info_openssl(contexts[num]), single)
+                for num, certinfo in zip(single, results):
+                    infos[num] = certinfo
+
+        return infos
+
+    def print_certs(self, ders):
+        bundle = ''.join(der_to_pem(der) for der in ders)
+        with inherited_file(bundle) as (bundle_path, pass_fds):
+            pkcs7 = self.run([ 'crl2pkcs7', '-nocrl', '-certfile', bundle_path ], pass_fds=pass_fds)
+
+        sections = self.RE_TEXT_SECTION.split(self.run(self.PRINT_CERTS_ARGS, input=pkcs7))[1:]
+        if len(sections) != len(ders):
+            raise ValueError('openssl printed {} of {} certificates'.format(len(sections), len(ders)))
+        return sections
+
+    # what INFO_ARGS would print, from a certificate's "-text" section
+    @classmethod
+    def info_from_text(cls, text, der, subject, issuer):
+        serial = cls.RE_TEXT_SERIAL.search(text)
+        validity = cls.RE_TEXT_VALIDITY.search(text)
+        if not serial or not validity:
+            raise ValueError('Unexpected certificate text from openssl')
+
+        sign = '-' if serial.group(1) or serial.group(3) else ''
+        digits = (serial.group(2) or serial.group(4).replace(':', '')).upper()
+        lines = [
+            'notBefore=' + validity.group(1),
+            'notAfter=' + validity.group(2),
+            'subject=' + subject,
+            'issuer=' + issuer,
+            'SHA1 Fingerprint=' + format_fingerprint(hashlib.sha1(der).digest()),
+            'serial=' + sign + digits.zfill(len(digits) + len(digits) % 2),
+            ]
+        for header, values in cls.RE_TEXT_EXTENSION.findall(text):
+            lines.append(header)
+            lines.extend(values.splitlines())
+
+        return '\n'.join(lines) + '\n'
+
+    def get_info_openssl(self, context):
+        output = self.run(self.INFO_ARGS, input=context.require_certificate)
+        return self.parse_info(context, output)
+
+    @staticmethod
+    def parse_info(context, output):
+        certinfo = CertInfo.parse(output)
+        certinfo.fingerprint_sha256 = format_fingerprint(
+                hashlib.sha256(pem_to_der(context.require_certificate)).digest())
+        return certinfo
@@ -0,0 +1,264 @@
+__all__ = [ 'OpenSSLPool' ]
+
+import os
+import selectors
+import subprocess
+import threading
+import time
+
+from .openssl import OpenSSL, TIMEOUT
+from .temporary import make_temp_file, remove_temp_file
+from .trace import trace_span, argv_summary, NULL_SPAN
+
+PROMPT = b'OpenSSL> '
+STARTUP_TIMEOUT = 5
+READ_SIZE = 65536
+
+class WorkerError(Exception):
+    pass
+
+class InteractiveWorker:
+    def __init__(self, binary):
+        self.proc = subprocess.Popen([binary],
+                stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        os.set_blocking(self.proc.stdout.fileno(), False)
+        os.set_blocking(self.proc.stderr.fileno(), False)
+
+    @property
+    def alive(self):
+        return self.proc.poll() is None
+
+    def wait_prompt(self, timeout):
+        stdout = []
+        stderr = []
+        deadline = time.monotonic() + timeout
+
+        with selectors.DefaultSelector() as selector:
+            selector.register(self.proc.stdout, selectors.EVENT_READ, stdout)
+            selector.register(self.proc.stderr, selectors.EVENT_READ, stderr)
+
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise subprocess.TimeoutExpired(self.proc.args, timeout)
+
+                for key, _ in selector.select(remaining):
+                    data = os.read(key.fd, READ_SIZE)
+                    if not data:
+                        raise WorkerError('openssl worker exited unexpectedly\nOutput:\n{}'.format(
+                            b''.join(stderr).decode(errors='replace')))
+                    key.data.append(data)
+
+                if stdout and b''.join(stdout).endswith(PROMPT):
+                    break
+
+            # the prompt is printed after the command flushed its error output
+            while True:
+                try:
+                    data = os.read(self.proc.stderr.fileno(), READ_SIZE)
+                except BlockingIOError:
+                    break
+                if not data:
+                    break
+                stderr.append(data)
+
+        return (b''.join(stdout)[:-len(PROMPT)].decode(),
+                b''.join(stderr).decode(errors='replace'))
+
+    @staticmethod
+    def can_quote(arg):
+        return bool(arg) and '"' not in arg and '\n' not in arg and not arg.endswith('\\')
+
+    @staticmethod
+    def quote(arg):
+        if any(c.isspace() for c in arg):
+            return '"{}"'.format(arg)
+        return arg
+
+    def execute(self, args, timeout):
+        line = ' '.join(self.quote(arg) for arg in args) + '\n'
+        self.proc.stdin.write(line.encode())
+        self.proc.stdin.flush()
+
+        stdout, stderr = self.wait_prompt(timeout)
+        if stderr.rstrip().endswith('error in {}'.format(args[0])):
+            raise Exception('Command {!r} failed\nOutput:\n{}'.format(args, stderr))
+
+        return stdout
+
+    def close(self):
+        if self.alive:
+            try:
+                self.proc.stdin.write(b'quit\n')
+                self.proc.stdin.close()
+                self.proc.wait(timeout=1)
+            except (OSError, subprocess.TimeoutExpired):
+                self.proc.kill()
+                self.proc.wait()
+
+        self.proc.stdout.close()
+        self.proc.stderr.close()
+
+class OpenSSLPool(OpenSSL):
+    workers = 2
+    timeout = TIMEOUT
+
+    def __init__(self, binary=None, workers=None, timeout=None, parser=None):
+        super().__init__(binary, parser=parser)
+        if workers:
+            self.workers = workers
+        if timeout:
+            self.timeout = timeout
+        self._reset()
+
+    def _reset(self):
+        # idle workers, most recently used last
+        self._idle = []
+        self._started = 0
+        self._supported = None
+        self._lock = threading.Lock()
+        # signalled when a worker goes idle or a worker slot is freed
+        self._changed = threading.Condition(self._lock)
+
+    # worker processes are not inherited by copies sent to other processes
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        for key in ('_idle', '_started', '_supported', '_lock', '_changed'):
+            del state[key]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._reset()
+
+    @property
+    def supported(self):
+        if self._supported is None:
+            with self._lock:
+                if self._supported is None:
+                    self._probe()
+        return self._supported
+
+    # "spawn" when the binary has no interactive mode (OpenSSL 3.0 and later)
+    @property
+    def engine(self):
+        return 'persistent' if self.supported else 'spawn'
+
+    def _probe(self):
+        try:
+            worker = InteractiveWorker(self.binary)
+        except OSError:
+            self._supported = False
+            return
+
+        try:
+            worker.wait_prompt(STARTUP_TIMEOUT)
+        except (WorkerError, subprocess.TimeoutExpired):
+            # OpenSSL 3.0 and later have no interactive mode
+            worker.close()
+            self._supported = False
+            return
+
+        self._supported = True
+        self._started += 1
+        self._idle.append(worker)
+
+    # An idle worker, or a new one while fewer than workers are running.
+    # Otherwise waits until a worker is released, or until a crashed or
+    # timed out one is discarded and its slot can be used for a new one.
+    def _acquire(self):
+        dead = []
+        with self._changed:
+            while True:
+                worker = None
+                while self._idle:
+                    worker = self._idle.pop()
+                    if worker.alive:
+                        break
+                    # crashed while idle, its slot goes to a fresh worker
+                    dead.append(worker)
+                    self._started -= 1
+                    worker = None
+
+                if worker or self._started < self.workers:
+                    break
+                self._changed.wait()
+
+            if worker is None:
+                self._started += 1
+
+        for crashed in dead:
+            crashed.close()
+        if worker:
+            return worker
+
+        try:
+            worker = InteractiveWorker(self.binary)
+            worker.wait_prompt(STARTUP_TIMEOUT)
+            return worker
+        except Exception:
+            self._discard(None)
+            raise
+
+    def _release(self, worker):
+        with self._changed:
+            self._idle.append(worker)
+            self._changed.notify()
+
+    def _discard(self, worker):
+        if worker:
+            worker.close()
+        with self._changed:
+            self._started -= 1
+            self._changed.notify()
+
+    @staticmethod
+    def _with_input_file(args, path):
+        args = list(args)
+        try:
+            args[args.index('-')] = path
+        except ValueError:
+            args.extend(('-in', path))
+        return args
+
+    def run(self, args, input=None, pass_fds=()):
+        # inherited descriptors cannot reach an already running worker
+        if (pass_fds or not self.supported
+                or not all(InteractiveWorker.can_quote(arg) for arg in args)):
+            return super().run(args, input=input, pass_fds=pass_fds)
+
+        tmp_path = None
+        if input is not None:
+            # stdin of the worker carries commands, so input goes through a file
+            tmp_path = make_temp_file(input)
+            args = self._with_input_file(args, tmp_path)
+
+        worker = self._acquire()
+        try:
+            with trace_span('openssl', args[0], engine='persistent',
+                            input_bytes=len(input) if input else 0) as span:
+                if span is not NULL_SPAN:
+                    span.set(argv=argv_summary(args))
+                output = worker.execute(args, self.timeout)
+                span.set(output_bytes=len(output))
+        except (WorkerError, subprocess.TimeoutExpired, OSError) as e:
+            self._discard(worker)
+            raise Exception('{}'.format(e))
+        except Exception:
+            self._release(worker)
+            raise
+        else:
+            self._release(worker)
+        finally:
+            if tmp_path:
+                remove_temp_file(tmp_path)
+
+        return output
+
+    def close(self):
+        with self._lock:
+            idle = self._idle
+            self._idle = []
+
+        for worker in idle:
+            self._discard(worker)
@@ -0,0 +1,119 @@
+__all__ = [ 'RenewResult', 'renewal_request', 'renew_certificate', 'renew_many' ]
+
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+from .context import Context
+from .dn import RDNSequence
+from .req import Request
+from .issue import is_signed_by_ca, make_certificate_with_key, store_certificate
+from .serial import SerialAllocator
+from .x509 import DecodeError, pem_to_der, subject_name
+
+RENEW_JOBS = 8
+
+RenewResult = namedtuple('RenewResult', 'context error'.split())
+
+# subject, SANs and CA flag of an issued certificate, with a new validity;
+# rdns is the subject as decoded by subject_name()
+def renewal_request(certinfo, rdns, days=None, hash_algo=None):
+    is_ca = 'CA:TRUE' in certinfo.basic_constraints
+    domain_names = []
+    for name in certinfo.subject_alt_name:
+        kind, _, value = name.partition(':')
+        if kind != 'DNS':
+            raise ValueError('Cannot renew a certificate with a {} subject alternative name'.format(kind))
+        domain_names.append(value)
+
+    return Request(RDNSequence(rdns), is_ca=is_ca,
+                   domain_names=domain_names or None, days=days, hash_algo=hash_algo)
+
+def decoded_subject(context):
+    try:
+        return subject_name(pem_to_der(context.require_certificate))
+    except DecodeError as e:
+        raise ValueError('Cannot read the subject of {}: {}'.format(context.basename, e))
+
+# Signs a stored certificate again with its stored key, keeping the name, so
+# no key is generated. A CA certificate loaded without its issuer is signed
+# by the CA found by issuer subject, or by itself when it is a root. The
+# renewal is refused unless its subject is the same as the original's byte
+# for byte, string types included.
+def renew_certificate(store, openssl, context, days=None, hash_algo=None,
+                      serials=None, serial=None, ca_by_subject=None):
+    store.load_context(context, load_cert=True, load_key=True)
+    certinfo = openssl.get_info(context)
+    rdns, subject = decoded_subject(context)
+    request = renewal_request(certinfo, rdns, days=days, hash_algo=hash_algo)
+
+    renewed = Context(context.basename, ca_context=context.ca_context, is_ca=context.is_ca)
+    if renewed.is_ca and renewed.ca_context is None and not certinfo.is_self_signed:
+        issuer = (ca_by_subject or {}).get(certinfo.issuer)
+        if issuer is None:
+            raise FileNotFoundError('Issuing CA "{}" of {} was not found in the store'.format(
+                certinfo.issuer, context.basename))
+        renewed.ca_context = Context(issuer.basename, is_ca=True)
+
+    if serial is None and is_signed_by_ca(renewed):
+        serial = (serials or SerialAllocator(store)).allocate(renewed.ca_context)
+
+    key_path = store.get_context_paths(context).key
+    make_certificate_with_key(store, openssl, renewed, request, key_path, serial=serial)
+    if decoded_subject(renewed)[1] != subject:
+        raise ValueError('The subject of the renewed certificate differs from "{}"'.format(
+            certinfo.subject))
+    return renewed
+
+def load_ca_by_subject(store, openssl):
+    contexts = list(store.get_ca_certs(load_cert=True))
+    return { certinfo.subject: context
+             for context, certinfo in zip(contexts, openssl.get_info_many(contexts)) }
+
+# renews contexts on a thread pool and stores them in one group commit
+def renew_many(store, openssl, contexts, days=None, hash_algo=None, serials=None,
+               jobs=None, callback=None):
+    contexts = list(contexts)
+    serials = serials or SerialAllocator(store)
+    ca_by_subject = None
+    if any(context.is_ca and context.ca_context is None for context in contexts):
+        ca_by_subject = load_ca_by_subject(store, openssl)
+
+    # one range of serials per CA for certificates whose issuer is known up front
+    assigned = {}
+    by_ca = {}
+    for context in contexts:
+        if is_signed_by_ca(context):
+            by_ca.setdefault(context.ca_context.basename, (context.ca_context, []))[1].append(context)
+    for ca_context, signed in by_ca.values():
+        assigned.update(zip(map(id, signed), serials.reserve(ca_context, len(signed))))
+
+    results = []
+
+    def collect(result):
+        results.append(result)
+        if callback:
+            callback(result)
+
+    def renew_one(context):
+        try:
+            return RenewResult(renew_certificate(store, openssl, context, days=days,
+                                                 hash_algo=hash_algo, serials=serials,
+                                                 serial=assigned.get(id(context)),
+                                                 ca_by_subject=ca_by_subject), None)
+        except Exception as e:
+            return RenewResult(context, str(e))
+
+    with store.group_commit():
+        with ThreadPoolExecutor(max_workers=jobs or RENEW_JOBS) as executor:
+            for result in executor.map(renew_one, contexts):
+                if result.error:
+                    collect(result)
+                    continue
+
+                try:
+                    store_certificate(store, result.context,
+                                      on_commit=lambda context, result=result: collect(result))
+                except Exception as e:
+                    collect(RenewResult(result.context, str(e)))
+
+    return results
@@ -2,12 +2,14 @@ __all__ = [
         'Request',
         'BITS_2K', 'BITS_4K',
         'HASH_SHA256', 'HASH_SHA512',
+        'KEY_RSA', 'KEY_EC', 'KEY_ED25519',
+        'CURVE_P256', 'CURVE_P384', 'CURVE_P521',
         ]
 
 from collections import OrderedDict
 
 from .dn import DNSection
-from .cfg import Config
+from .cfg import Config, quote_value
 
 BITS_2K = 2048
 BITS_4K = 4096
@@ -15,14 +17,24 @@ BITS_4K = 4096
 HASH_SHA256 = 'sha256'
 HASH_SHA512 = 'sha512'
 
+KEY_RSA = 'rsa'
+KEY_EC = 'ec'
+KEY_ED25519 = 'ed25519'
+
+CURVE_P256 = 'P-256'
+CURVE_P384 = 'P-384'
+CURVE_P521 = 'P-521'
+
 class Request:
     # defaults
     bits = BITS_4K
     days = 3650
     hash_algo = HASH_SHA512
+    key_type = KEY_RSA
+    curve = CURVE_P256
 
     def __init__(self, dn=None, is_ca=False, domain_names=None,
-                 bits=None, days=None, hash_algo=None):
+                 bits=None, days=None, hash_algo=None, key_type=None, curve=None):
         self.dn = dn or DNSection()
         self.is_ca = is_ca
         self.domain_names = domain_names
@@ -36,6 +48,35 @@ class Request:
         if hash_algo:
             self.hash_algo = hash_algo
 
+        if key_type:
+            if key_type not in (KEY_RSA, KEY_EC, KEY_ED25519):
+                raise ValueError('Unknown key type: {}'.format(key_type))
+            self.key_type = key_type
+
+        if curve:
+            self.curve = curve
+
+    @property
+    def is_rsa(self):
+        return self.key_type == KEY_RSA
+
+    # arguments for openssl req to generate a new key; RSA keys come from default_bits
+    @property
+    def new_key_args(self):
+        if self.key_type == KEY_EC:
+            return ['-newkey', 'ec', '-pkeyopt', 'ec_paramgen_curve:{}'.format(self.curve)]
+        elif self.key_type == KEY_ED25519:
+            return ['-newkey', 'ed25519']
+        return []
+
+    @property
+    def genpkey_args(self):
+        if self.key_type == KEY_EC:
+            return ['-algorithm', 'EC', '-pkeyopt', 'ec_paramgen_curve:{}'.format(self.curve)]
+        elif self.key_type == KEY_ED25519:
+            return ['-algorithm', 'ED25519']
+        return ['-algorithm', 'RSA', '-pkeyopt', 'rsa_keygen_bits:{}'.format(self.bits)]
+
     @property
     def config(self):
         config = Config()
@@ -48,8 +89,11 @@ class Request:
         req['prompt'] = 'no'
         req['req_extensions'] = 'v3_ext'
         req['x509_extensions'] = 'v3_ext'
+        # the configuration is written as UTF-8
+        req['utf8'] = 'yes'
+        req['string_mask'] = 'utf8only'
 
-        config['req_dn'] = self.dn.ordered_dict
+        config['req_dn'] = OrderedDict((key, quote_value(value)) for key, value in self.dn.items())
 
         v3_ext = config['v3_ext']
         if self.is_ca:
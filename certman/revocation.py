@@ -0,0 +1,209 @@
+__all__ = [ 'RevocationList', 'RevokedEntry', 'REASONS', 'normalize_serial' ]
+
+import os
+import json
+import time
+import threading
+from collections import namedtuple
+
+from .store import locked_file
+from .trace import trace_span
+
+REVOKED_SUFFIX = '.revoked'
+REVOKED_LOCK_SUFFIX = '.revoked.lock'
+CRL_SUFFIX = '.crl'
+DELTA_CRL_SUFFIX = '.delta.crl'
+CRL_STATE_SUFFIX = '.crl.json'
+CRL_LOCK_SUFFIX = '.crl.lock'
+
+REASONS = ('unspecified', 'keyCompromise', 'CACompromise', 'affiliationChanged',
+           'superseded', 'cessationOfOperation', 'certificateHold')
+
+CRL_DAYS = 7
+# a delta CRL is issued while it lists at most this many new revocations
+MAX_DELTA_ENTRIES = 1000
+
+# the expiry column is required by "openssl ca" but not used for CRLs
+NO_EXPIRY = '99991231235959Z'
+UNKNOWN_SUBJECT = 'unknown'
+
+RevokedEntry = namedtuple('RevokedEntry', 'serial revoked_at reason subject'.split())
+
+def normalize_serial(serial):
+    if isinstance(serial, int):
+        value = serial
+    else:
+        text = serial.strip().replace(':', '')
+        if text.lower().startswith('0x'):
+            text = text[2:]
+        value = int(text, 16)
+
+    if value <= 0:
+        raise ValueError('Invalid serial number: {}'.format(serial))
+
+    text = '{:X}'.format(value)
+    return '0' + text if len(text) % 2 else text
+
+# Revoked serials of one CA, kept in <CA>.revoked in the "openssl ca" index
+# format. The file is only ever appended to: membership is a dict lookup,
+# refreshing reads just the bytes appended since the last read, and the
+# revocations after the last full CRL are a byte range for the delta CRL.
+class RevocationList:
+    def __init__(self, store, ca_context):
+        self.store = store
+        self.ca_context = ca_context
+        self.path = store.get_artifact_path(ca_context, REVOKED_SUFFIX)
+        self.entries = {}
+        # bytes of complete lines read so far
+        self.offset = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def parse_line(line):
+        fields = line.split('\t')
+        if len(fields) != 6 or fields[0] != 'R':
+            raise ValueError('Malformed revocation entry: {!r}'.format(line))
+
+        revoked_at, _, reason = fields[2].partition(',')
+        return RevokedEntry(fields[3], revoked_at, reason or None, fields[5])
+
+    @staticmethod
+    def format_line(entry):
+        revoked = entry.revoked_at
+        if entry.reason:
+            revoked += ',' + entry.reason
+        subject = ' '.join((entry.subject or UNKNOWN_SUBJECT).split())
+        return '\t'.join(('R', NO_EXPIRY, revoked, entry.serial, 'unknown', subject)) + '\n'
+
+    def refresh(self):
+        with self._lock:
+            try:
+                with open(self.path, 'rb') as fd:
+                    fd.seek(self.offset)
+                    data = fd.read()
+            except FileNotFoundError:
+                return
+
+            # a line cut short by a crash is left for the next append to truncate
+            end = data.rfind(b'\n') + 1
+            if not end:
+                return
+
+            with trace_span('revocation', 'refresh', path=self.path, bytes=end):
+                for line in data[:end].decode().splitlines():
+                    entry = self.parse_line(line)
+                    self.entries[entry.serial] = entry
+            self.offset += end
+
+    def is_revoked(self, serial):
+        self.refresh()
+        return normalize_serial(serial) in self.entries
+
+    def __contains__(self, serial):
+        return self.is_revoked(serial)
+
+    def __len__(self):
+        self.refresh()
+        return len(self.entries)
+
+    # serials is an iterable of serial numbers or (serial, subject) pairs;
+    # returns the entries that were not revoked before
+    def revoke_many(self, serials, reason=None, revoked_at=None):
+        if reason is not None and reason not in REASONS:
+            raise ValueError('Unknown revocation reason: {}'.format(reason))
+
+        revoked_at = revoked_at or time.strftime('%y%m%d%H%M%SZ', time.gmtime())
+        requested = []
+        for item in serials:
+            serial, subject = item if isinstance(item, tuple) else (item, None)
+            requested.append(RevokedEntry(normalize_serial(serial), revoked_at, reason, subject))
+
+        with locked_file(self.store.get_artifact_path(self.ca_context, REVOKED_LOCK_SUFFIX)):
+            self.refresh()
+            added = {}
+            for entry in requested:
+                if entry.serial not in self.entries and entry.serial not in added:
+                    added[entry.serial] = entry
+            if not added:
+                return []
+
+            data = ''.join(self.format_line(entry) for entry in added.values()).encode()
+            with trace_span('revocation', 'append', path=self.path, entries=len(added),
+                            bytes=len(data)):
+                fd = os.open(self.path, os.O_WRONLY | os.O_CREAT, 0o644)
+                try:
+                    # drop a partial line, then append everything in one write
+                    os.ftruncate(fd, self.offset)
+                    os.lseek(fd, self.offset, os.SEEK_SET)
+                    os.write(fd, data)
+                    if self.store.durable:
+                        os.fsync(fd)
+                finally:
+                    os.close(fd)
+
+            if self.store.durable and self.offset == 0:
+                self.store.sync_dirs([ os.path.dirname(self.path) ])
+
+            self.refresh()
+
+        return list(added.values())
+
+    def revoke(self, serial, subject=None, reason=None):
+        return bool(self.revoke_many([ (serial, subject) ], reason=reason))
+
+    def read_state(self):
+        try:
+            with open(self.store.get_artifact_path(self.ca_context, CRL_STATE_SUFFIX), 'rt') as fd:
+                return json.load(fd)
+        except FileNotFoundError:
+            return {}
+
+    def get_crl_path(self, delta=False):
+        return self.store.get_artifact_path(self.ca_context,
+                                            DELTA_CRL_SUFFIX if delta else CRL_SUFFIX)
+
+    # A full CRL lists every revocation and becomes the base of the following
+    # delta CRLs, which list only the revocations appended after it. Unless
+    # delta is given, a delta CRL is made while there is a base and it would
+    # hold at most max_delta entries. Returns the PEM and whether it is a delta.
+    def generate_crl(self, openssl, delta=None, days=CRL_DAYS, max_delta=MAX_DELTA_ENTRIES):
+        ca_paths = self.store.get_context_paths(self.ca_context)
+
+        with locked_file(self.store.get_artifact_path(self.ca_context, CRL_LOCK_SUFFIX)):
+            self.refresh()
+            state = self.read_state()
+            number = state.get('number', 0) + 1
+            base_number = state.get('base_number')
+            base_offset = state.get('base_offset', 0)
+
+            try:
+                with open(self.path, 'rb') as fd:
+                    data = fd.read(self.offset)
+            except FileNotFoundError:
+                data = b''
+            new_entries = data[base_offset:].count(b'\n')
+
+            if delta is None:
+                delta = base_number is not None and new_entries <= max_delta
+            elif delta and base_number is None:
+                raise Exception('No full CRL was generated for CA {} yet'.format(
+                    self.ca_context.basename))
+
+            with trace_span('revocation', 'crl', ca=self.ca_context.basename, delta=delta,
+                            entries=new_entries if delta else len(self.entries)):
+                if delta:
+                    crl = openssl.crl(ca_paths, data[base_offset:].decode(), number, days,
+                                      base_number=base_number)
+                else:
+                    crl = openssl.crl(ca_paths, data.decode(), number, days)
+
+            self.store.replace_file(self.get_crl_path(delta), crl)
+
+            state['number'] = number
+            if not delta:
+                state['base_number'] = number
+                state['base_offset'] = self.offset
+            self.store.replace_file(self.store.get_artifact_path(self.ca_context, CRL_STATE_SUFFIX),
+                                    json.dumps(state) + '\n')
+
+        return crl, delta
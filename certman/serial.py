@@ -0,0 +1,75 @@
+__all__ = [ 'SerialAllocator' ]
+
+import secrets
+
+from .store import locked_file
+from .trace import trace_span
+
+SERIAL_SUFFIX = '.serial'
+SERIAL_LOCK_SUFFIX = '.serial.lock'
+OPENSSL_SERIAL_SUFFIX = '.srl'
+
+RANDOM_SERIAL_BITS = 128
+# a new counter starts at a random point, away from serials openssl chose by itself
+INITIAL_SERIAL_BITS = 63
+
+# Serial numbers for certificates signed by a CA, passed to openssl with
+# -set_serial. The next sequential serial of every CA is kept in a
+# <CA>.serial file beside its certificate, replaced under an flock() by
+# renaming a new file over the old one. Reserving a range takes the lock
+# once, so worker pools can sign under one CA without sharing anything
+# but the numbers they were given.
+class SerialAllocator:
+    def __init__(self, store, random=False):
+        self.store = store
+        self.random = random
+
+    def get_path(self, ca_context):
+        return self.store.get_artifact_path(ca_context, SERIAL_SUFFIX)
+
+    def read_next(self, ca_context):
+        try:
+            with open(self.get_path(ca_context), 'rt') as fd:
+                return int(fd.read().strip(), 16)
+        except FileNotFoundError:
+            pass
+
+        # continue where "openssl x509 -CAcreateserial" stopped
+        srl_path = self.store.get_artifact_path(ca_context, OPENSSL_SERIAL_SUFFIX)
+        try:
+            with open(srl_path, 'rt') as fd:
+                return int(fd.read().strip(), 16) + 1
+        except FileNotFoundError:
+            return secrets.randbits(INITIAL_SERIAL_BITS) | 1
+
+    def write_next(self, ca_context, serial):
+        self.store.replace_file(self.get_path(ca_context), '{:X}\n'.format(serial))
+
+    def random_serial(self):
+        while True:
+            serial = secrets.randbits(RANDOM_SERIAL_BITS)
+            if serial:
+                return serial
+
+    # the counter is persisted before any serial is handed out, so a crash
+    # can skip serials but never repeat one
+    def reserve(self, ca_context, count):
+        if self.random:
+            return [ self.random_serial() for _ in range(count) ]
+
+        with trace_span('serial', 'reserve', ca=ca_context.basename, count=count):
+            with locked_file(self.store.get_artifact_path(ca_context, SERIAL_LOCK_SUFFIX)):
+                first = self.read_next(ca_context)
+                self.write_next(ca_context, first + count)
+
+        return range(first, first + count)
+
+    # keeps the counter above serials a CA gave out before it came into the
+    # store, so sequential serials never repeat an imported one
+    def advance_past(self, ca_context, serial):
+        with locked_file(self.store.get_artifact_path(ca_context, SERIAL_LOCK_SUFFIX)):
+            if self.read_next(ca_context) <= serial:
+                self.write_next(ca_context, serial + 1)
+
+    def allocate(self, ca_context):
+        return self.reserve(ca_context, 1)[0]
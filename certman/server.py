@@ -0,0 +1,311 @@
+__all__ = [ 'CertificateService', 'ServiceBusy', 'make_server' ]
+
+import os
+import json
+import queue
+import ipaddress
+import threading
+import socketserver
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+
+from .context import Context
+from .store import Store
+from .batch import BatchEntry
+from .issue import verify_can_issue, issue_certificate
+from .serial import SerialAllocator
+
+REQUEST_TIMEOUT = 120
+MAX_BODY_SIZE = 1 << 20
+
+class ServiceBusy(Exception):
+    pass
+
+# names from requests become store paths, so nothing that could leave the CA directory
+def check_basename(basename):
+    if (not isinstance(basename, str) or not basename or '/' in basename or '\0' in basename or '..' in basename
+            or basename.startswith(('.', '+'))):
+        raise ValueError('invalid certificate name: {!r}'.format(basename))
+    return basename
+
+class Job:
+    def __init__(self, func, args):
+        self.func = func
+        self.args = args
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+    def run(self):
+        try:
+            self.result = self.func(*self.args)
+        except Exception as e:
+            self.error = e
+        finally:
+            self.done.set()
+
+class CertificateService:
+    workers = 4
+    queue_size = 64
+
+    def __init__(self, store, openssl, key_pool=None, workers=None, queue_size=None, serials=None):
+        self.store = store
+        self.openssl = openssl
+        self.key_pool = key_pool
+        self.serials = serials or SerialAllocator(store)
+        if workers:
+            self.workers = workers
+        if queue_size:
+            self.queue_size = queue_size
+
+        self.jobs = queue.Queue(maxsize=self.queue_size)
+        self.threads = []
+        self.ca_cache = {}
+        self.ca_cache_lock = threading.Lock()
+
+    def start(self):
+        for _ in range(self.workers):
+            thread = threading.Thread(target=self.worker, daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    def stop(self):
+        for _ in self.threads:
+            self.jobs.put(None)
+        for thread in self.threads:
+            thread.join()
+        self.threads = []
+
+    def worker(self):
+        while True:
+            job = self.jobs.get()
+            if job is None:
+                return
+            job.run()
+
+    def submit(self, func, *args, timeout=REQUEST_TIMEOUT):
+        job = Job(func, args)
+        try:
+            self.jobs.put_nowait(job)
+        except queue.Full:
+            raise ServiceBusy('Too many requests in progress')
+
+        if not job.done.wait(timeout):
+            raise TimeoutError('Request was not processed in time')
+
+        if job.error:
+            raise job.error
+
+        return job.result
+
+    # CA certificates stay parsed in memory until their file changes
+    def get_ca(self, basename):
+        context = Context(basename, is_ca=True)
+        paths = self.store.get_context_paths(context)
+        self.store.verify_exists(context, paths, check_cert=True)
+        mtime = self.store.stat(paths.cert).st_mtime_ns
+
+        with self.ca_cache_lock:
+            cached = self.ca_cache.get(basename)
+            if cached and cached[0] == mtime:
+                return cached[1], cached[2]
+
+        self.store.load_context(context, load_cert=True)
+        certinfo = self.openssl.get_info(context)
+        with self.ca_cache_lock:
+            self.ca_cache[basename] = (mtime, context, certinfo)
+        return context, certinfo
+
+    def issue(self, record, with_key=False):
+        check_basename(record.get('name'))
+        if record.get('ca'):
+            check_basename(record['ca'])
+
+        entry = BatchEntry.from_record(record)
+        context = entry.make_context()
+        context.is_ca = bool(record.get('is_ca'))
+        if context.is_ca:
+            entry.request.is_ca = True
+            entry.request.domain_names = None
+
+        verify_can_issue(self.store, context)
+
+        # allocated serials let any number of workers sign under the same CA
+        issue_certificate(self.store, self.openssl, context, entry.request,
+                          key_pool=self.key_pool, serials=self.serials)
+
+        return self.describe(context, self.openssl.get_info(context), with_key=with_key)
+
+    def get_cert(self, ca_basename, basename, with_key=False):
+        check_basename(basename)
+        if ca_basename:
+            check_basename(ca_basename)
+            ca_context, _ = self.get_ca(ca_basename)
+        else:
+            ca_context = Store.self_signed_context()
+
+        context = Context(basename, ca_context=ca_context)
+        self.store.load_context(context, load_cert=True, load_key=with_key)
+        return self.describe(context, self.openssl.get_info(context), with_key=with_key)
+
+    def get_ca_cert(self, basename, with_key=False):
+        check_basename(basename)
+        context, certinfo = self.get_ca(basename)
+        if with_key:
+            context = Context(basename, is_ca=True)
+            self.store.load_context(context, load_cert=True, load_key=True)
+        return self.describe(context, certinfo, with_key=with_key)
+
+    def tree(self):
+        # StoreIndex.get_info_many() is a drop-in for OpenSSL.get_info_many()
+        info_source = self.store.index or self.openssl
+        cas = []
+        for ca_context in self.store.get_ca_certs(load_cert=False):
+            _, ca_info = self.get_ca(ca_context.basename)
+            contexts = list(self.store.get_certs(ca_context, load_cert=not self.store.index))
+            cas.append({
+                'name': ca_context.basename,
+                'subject': ca_info.subject,
+                'issuer': ca_info.issuer,
+                'certs': [ { 'name': context.basename, 'subject': certinfo.subject }
+                           for context, certinfo in zip(contexts, info_source.get_info_many(contexts)) ],
+            })
+        return { 'cas': cas }
+
+    @staticmethod
+    def describe(context, certinfo, with_key=False):
+        result = {
+            'name': context.basename,
+            'subject': certinfo.subject,
+            'issuer': certinfo.issuer,
+            'serial': certinfo.serial,
+            'not_before': certinfo.not_before_raw,
+            'not_after': certinfo.not_after_raw,
+            'certificate': context.certificate,
+        }
+        if with_key:
+            result['private_key'] = context.private_key
+        return result
+
+class RequestHandler(BaseHTTPRequestHandler):
+    server_version = 'certman'
+
+    @property
+    def service(self):
+        return self.server.service
+
+    def address_string(self):
+        if isinstance(self.client_address, tuple):
+            return self.client_address[0]
+        return 'unix'
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def send_json(self, status, payload, headers=()):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for key, value in headers:
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def handle_call(self, func, *args):
+        try:
+            result = self.service.submit(func, *args)
+        except ServiceBusy as e:
+            self.send_json(503, { 'error': str(e) }, headers=[ ('Retry-After', '1') ])
+        except FileNotFoundError as e:
+            self.send_json(404, { 'error': str(e) })
+        except FileExistsError as e:
+            self.send_json(409, { 'error': str(e) })
+        except (ValueError, KeyError) as e:
+            self.send_json(400, { 'error': str(e) })
+        except Exception as e:
+            self.send_json(500, { 'error': str(e) })
+        else:
+            self.send_json(200, result)
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        query = parse_qs(url.query)
+        with_key = query.get('key', ['0'])[0] not in ('0', '', 'false')
+        if with_key and not self.server.allow_private_keys:
+            self.send_json(403, { 'error': 'Private keys are not served, see --allow-private-keys' })
+            return
+
+        if url.path == '/tree':
+            self.handle_call(self.service.tree)
+        elif url.path == '/get-ca' and 'name' in query:
+            self.handle_call(self.service.get_ca_cert, query['name'][0], with_key)
+        elif url.path == '/get-cert' and 'name' in query:
+            self.handle_call(self.service.get_cert, query.get('ca', [''])[0], query['name'][0], with_key)
+        else:
+            self.send_json(404, { 'error': 'Unknown request' })
+
+    def do_POST(self):
+        url = urlsplit(self.path)
+        if url.path != '/issue':
+            self.send_json(404, { 'error': 'Unknown request' })
+            return
+
+        length = int(self.headers.get('Content-Length') or 0)
+        if length > MAX_BODY_SIZE:
+            self.send_json(413, { 'error': 'Request too large' })
+            return
+
+        try:
+            record = json.loads(self.rfile.read(length) or b'{}')
+            if not isinstance(record, dict):
+                raise ValueError('Request body must be a JSON object')
+        except ValueError as e:
+            self.send_json(400, { 'error': str(e) })
+            return
+
+        self.handle_call(self.service.issue, record, self.server.allow_private_keys)
+
+class TCPServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+class UnixServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def server_bind(self):
+        try:
+            os.unlink(self.server_address)
+        except FileNotFoundError:
+            pass
+        old_umask = os.umask(0o177)
+        try:
+            super().server_bind()
+        finally:
+            os.umask(old_umask)
+
+def is_loopback(server):
+    if isinstance(server, UnixServer):
+        return True
+    return ipaddress.ip_address(server.server_address[0].split('%')[0]).is_loopback
+
+# Private keys, asked with key=1 and returned by /issue, only with
+# allow_private_keys. They go out unencrypted to anyone who can connect, so
+# this is refused unless the server is bound to a Unix socket, created 0600,
+# or to a loopback address.
+def make_server(service, socket_path=None, host='127.0.0.1', port=8080, verbose=False,
+                allow_private_keys=False):
+    if socket_path:
+        server = UnixServer(socket_path, RequestHandler)
+    else:
+        server = TCPServer((host, port), RequestHandler)
+
+    if allow_private_keys and not is_loopback(server):
+        server.server_close()
+        raise ValueError('Private keys can only be served on a Unix socket or a loopback address, '
+                         'not on {}'.format(host))
+
+    server.service = service
+    server.verbose = verbose
+    server.allow_private_keys = allow_private_keys
+    return server
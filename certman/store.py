@@ -1,9 +1,143 @@
 __all__ = [ 'Store' ]
 
 from .context import Context
+from .trace import trace_span
 
 import os
-from collections import namedtuple
+import re
+import json
+import time
+import uuid
+import fcntl
+import hashlib
+import threading
+from contextlib import contextmanager
+from collections import namedtuple, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+DIR_FD_SUPPORTED = (os.open in os.supports_dir_fd and os.stat in os.supports_dir_fd
+                    and os.listdir in os.supports_fd)
+
+STAGING_PREFIX = '.staging-'
+GROUP_COMMIT_SIZE = 64
+FSYNC_JOBS = 8
+# open directory descriptors kept per store, least recently used closed first
+DIR_FD_CACHE_SIZE = 64
+
+LAYOUT_FLAT = 'flat'
+LAYOUT_SHARDED = 'sharded'
+SHARD_LEVELS = 1
+MAX_SHARD_LEVELS = 3
+RE_SHARD = re.compile('[0-9a-f]{2}$')
+# how long a reader may go on with a layout it has read before checking the marker
+FORMAT_CHECK_INTERVAL = 1.0
+MIGRATE_CHUNK = 1000
+
+# shard_levels is 0 for the flat layout; while migrating, leaves are written
+# to the sharded layout and looked up in both
+StoreFormat = namedtuple('StoreFormat', 'layout shard_levels migrating'.split())
+FLAT_FORMAT = StoreFormat(LAYOUT_FLAT, 0, False)
+
+def fsync_path(path, directory=False):
+    fd = os.open(path, os.O_RDONLY | (os.O_DIRECTORY if directory else 0))
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+# exclusive flock() on a lock file, between threads as well as processes
+@contextmanager
+def locked_file(path):
+    fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        with trace_span('store', 'lock', path=path):
+            fcntl.flock(fd, fcntl.LOCK_EX)
+        yield
+    finally:
+        os.close(fd)
+
+# A cached directory descriptor, closed once it has been evicted and the
+# last caller using it is done with it
+class DirHandle:
+    def __init__(self, fd):
+        self.fd = fd
+        self.users = 0
+        self.evicted = False
+
+    def release(self):
+        self.users -= 1
+        if self.evicted and not self.users:
+            os.close(self.fd)
+
+    def evict(self):
+        self.evicted = True
+        if not self.users:
+            os.close(self.fd)
+
+def discard_staged(files):
+    for staging_path, _ in files:
+        try:
+            os.unlink(staging_path)
+        except FileNotFoundError:
+            pass
+
+# Certificates staged by Store.store() and made durable together: one round of
+# fsyncs for all staged files, the renames, then one fsync per directory.
+class WriteGroup:
+    def __init__(self, store, max_pending=GROUP_COMMIT_SIZE):
+        self.store = store
+        self.max_pending = max_pending
+        self.pending = []
+        self._lock = threading.Lock()
+
+    def add(self, context, files, on_commit=None):
+        with self._lock:
+            self.pending.append((context, files, on_commit))
+            if len(self.pending) < self.max_pending:
+                return
+        self.commit()
+
+    def commit(self):
+        with self._lock:
+            pending = self.pending
+            self.pending = []
+        if not pending:
+            return
+
+        store = self.store
+        staged = [ staging_path for _, files, _ in pending for staging_path, _ in files ]
+
+        with trace_span('store', 'commit', certs=len(pending), files=len(staged),
+                        durable=store.durable):
+            try:
+                if store.durable:
+                    # concurrent fsyncs share journal commits on most filesystems
+                    with ThreadPoolExecutor(max_workers=FSYNC_JOBS) as executor:
+                        list(executor.map(fsync_path, staged))
+
+                for _, files, _ in pending:
+                    store.install_files(files)
+            except BaseException:
+                for _, files, _ in pending:
+                    discard_staged(files)
+                raise
+
+            if store.durable:
+                store.sync_dirs(os.path.dirname(path) for _, files, _ in pending for _, path in files)
+
+        if store.index:
+            store.index.update_many(context for context, _, _ in pending)
+
+        for context, _, on_commit in pending:
+            if on_commit:
+                on_commit(context)
+
+    def discard(self):
+        with self._lock:
+            pending = self.pending
+            self.pending = []
+        for _, files, _ in pending:
+            discard_staged(files)
 
 class Store:
     SELF_SIGNED_SUBDIR = '+SELF_SIGNED'
@@ -15,28 +149,199 @@ class Store:
     KEY_SUFFIX = '.key'
     RSA_KEY_SUFFIX = '.rsa'
     REQUEST_SUFFIX = '.req'
+    FORMAT_FILENAME = '.certman-format'
+    FORMAT_LOCK_FILENAME = '.certman-format.lock'
 
     CertificatePaths = namedtuple('CertificatePaths', 'cert key rsa_key req'.split())
 
-    def __init__(self, root_dir=None, key_dir=None):
-        self.root_dir = root_dir or os.path.abspath(os.curdir)
+    # metadata index updated on every store(), see StoreIndex
+    index = None
+
+    # fsync written files and their directories before store() returns
+    durable = True
+
+    def __init__(self, root_dir=None, key_dir=None, durable=None):
+        self.root_dir = os.path.abspath(root_dir or os.curdir)
         self.key_dir = key_dir or os.path.join(self.root_dir, self.PRIVATE_KEY_SUBDIR)
+        if durable is not None:
+            self.durable = durable
+        self._reset()
+
+    def _reset(self):
+        self._dir_fds = OrderedDict()
+        self._prepared_dirs = set()
+        self._dirs_lock = threading.Lock()
+        self._group = None
+        self._format = None
+        self._format_key = None
+        self._format_checked = 0
+
+    # descriptors, locks and pending writes stay in the process that opened them
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        for key in ('_dir_fds', '_prepared_dirs', '_dirs_lock', '_group',
+                    '_format', '_format_key', '_format_checked'):
+            state.pop(key, None)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._reset()
+
+    def close(self):
+        with self._dirs_lock:
+            dir_fds = self._dir_fds
+            self._dir_fds = OrderedDict()
+
+            for handle in dir_fds.values():
+                handle.evict()
 
     @classmethod
     def self_signed_context(cls):
         return Context(cls.SELF_SIGNED_SUBDIR, is_ca=True)
 
+    @property
+    def format_path(self):
+        return os.path.join(self.root_dir, self.FORMAT_FILENAME)
+
+    # The layout of leaf directories, from the marker file in the store root
+    # (flat when there is none). Writers check the marker every time, so no
+    # certificate is written to a layout the store just left; readers check
+    # it at most every FORMAT_CHECK_INTERVAL seconds.
+    def format(self, fresh=False):
+        now = time.monotonic()
+        if not fresh and self._format is not None and now - self._format_checked < FORMAT_CHECK_INTERVAL:
+            return self._format
+
+        try:
+            st = self.stat(self.format_path)
+            key = (st.st_mtime_ns, st.st_size, st.st_ino)
+        except FileNotFoundError:
+            key = None
+
+        if self._format is None or key != self._format_key:
+            if key is None:
+                self._format = FLAT_FORMAT
+            else:
+                data = json.loads(self.read_text(self.format_path))
+                self._format = StoreFormat(data['layout'], data.get('shard_levels', 0),
+                                           data.get('migrating', False))
+            self._format_key = key
+
+        self._format_checked = now
+        return self._format
+
+    def write_format(self, store_format):
+        data = { 'layout': store_format.layout, 'shard_levels': store_format.shard_levels }
+        if store_format.migrating:
+            data['migrating'] = True
+        self.replace_file(self.format_path, json.dumps(data) + '\n')
+        self._format = None
+
+    @staticmethod
+    def shard_of(basename, levels):
+        digest = hashlib.sha256(basename.encode()).hexdigest()
+        return os.path.join(*(digest[2 * level:2 * level + 2] for level in range(levels)))
+
+    def store_basepaths(self, basename, cert_dir, key_dir=None):
+        if not key_dir:
+            key_dir = os.path.join(cert_dir, self.PRIVATE_KEY_SUBDIR)
+
+        return (os.path.join(cert_dir, basename), os.path.join(key_dir, basename))
+
+    # write preparation, reads resolve paths with store_basepaths() and never touch the tree
     def make_store_basepaths(self, basename, cert_dir, key_dir=None):
         if not key_dir:
             key_dir = os.path.join(cert_dir, self.PRIVATE_KEY_SUBDIR)
 
-        os.makedirs(cert_dir, exist_ok=True)
+        if (cert_dir, key_dir) not in self._prepared_dirs:
+            with trace_span('store', 'makedirs', path=cert_dir):
+                created = not os.path.isdir(cert_dir)
+                os.makedirs(cert_dir, exist_ok=True)
+                try:
+                    os.makedirs(key_dir, mode=self.PRIVATE_KEY_SUBDIR_PERMS)
+                    created = True
+                except FileExistsError:
+                    os.chmod(key_dir, self.PRIVATE_KEY_SUBDIR_PERMS)
+
+                # new directory entries are only durable once their parents are synced
+                if created and self.durable:
+                    self.sync_dirs([ os.path.dirname(cert_dir), cert_dir, os.path.dirname(key_dir) ])
+
+            with self._dirs_lock:
+                self._prepared_dirs.add((cert_dir, key_dir))
+
+        return self.store_basepaths(basename, cert_dir, key_dir)
+
+    # Descriptor of a directory for *at() calls, valid until the block ends.
+    # At most DIR_FD_CACHE_SIZE are kept open, so walking a sharded store
+    # does not hold one descriptor per shard.
+    @contextmanager
+    def dir_fd(self, path):
+        with self._dirs_lock:
+            handle = self._dir_fds.get(path)
+            if handle is not None:
+                self._dir_fds.move_to_end(path)
+                handle.users += 1
+
+        if handle is None:
+            fd = os.open(path, os.O_RDONLY | os.O_DIRECTORY)
+            with self._dirs_lock:
+                handle = self._dir_fds.get(path)
+                if handle is None:
+                    handle = self._dir_fds[path] = DirHandle(fd)
+                    while len(self._dir_fds) > DIR_FD_CACHE_SIZE:
+                        self._dir_fds.popitem(last=False)[1].evict()
+                else:
+                    os.close(fd)
+                handle.users += 1
+
+        try:
+            yield handle.fd
+        finally:
+            with self._dirs_lock:
+                handle.release()
+
+    def _drop_stale_dir_fd(self, path):
+        with self._dirs_lock:
+            handle = self._dir_fds.get(path)
+            if handle is None:
+                return False
+            # a removed directory has no links left, a recreated one needs a new handle
+            if os.fstat(handle.fd).st_nlink:
+                return False
+            del self._dir_fds[path]
+            handle.evict()
+        return True
+
+    def _at(self, path, func):
+        if not DIR_FD_SUPPORTED:
+            return func(path, None)
+
+        dirname, name = os.path.split(path)
         try:
-            os.makedirs(key_dir, mode=self.PRIVATE_KEY_SUBDIR_PERMS)
-        except FileExistsError:
-            os.chmod(key_dir, self.PRIVATE_KEY_SUBDIR_PERMS)
+            with self.dir_fd(dirname) as dir_fd:
+                return func(name, dir_fd)
+        except FileNotFoundError:
+            if not self._drop_stale_dir_fd(dirname):
+                raise
+        with self.dir_fd(dirname) as dir_fd:
+            return func(name, dir_fd)
 
-        return (os.path.join(cert_dir, basename), os.path.join(key_dir, basename))
+    def stat(self, path):
+        return self._at(path, lambda name, dir_fd: os.stat(name, dir_fd=dir_fd))
+
+    def exists(self, path):
+        try:
+            self.stat(path)
+        except FileNotFoundError:
+            return False
+        return True
+
+    def read_text(self, path):
+        fd = self._at(path, lambda name, dir_fd: os.open(name, os.O_RDONLY, dir_fd=dir_fd))
+        with open(fd, 'rt') as f:
+            return f.read()
 
     def load_context(self, context, load_cert=False, load_key=False,
                      load_rsa_key=False, load_req=False, reload=False):
@@ -56,16 +361,97 @@ class Store:
                            check_rsa_key=load_rsa_key, check_req=load_req)
 
         if load_cert:
-            context.add_from_file(paths.cert)
+            self.read_file(context, paths.cert)
         if load_key:
-            context.add_from_file(paths.key)
+            self.read_file(context, paths.key)
         if load_rsa_key:
-            context.add_from_file(paths.rsa_key)
+            self.read_file(context, paths.rsa_key)
         if load_req:
-            context.add_from_file(paths.req)
+            self.read_file(context, paths.req)
 
         return context
 
+    def read_file(self, context, path):
+        with trace_span('store', 'read', path=path):
+            context.add(self.read_text(path))
+
+    @staticmethod
+    def write_file(path, content, opener=None):
+        with trace_span('store', 'write', path=path, bytes=len(content)):
+            with open(path, 'wt', opener=opener) as fd:
+                fd.write(content)
+
+    # writes a file under a temporary name in the directory of its final path
+    @staticmethod
+    def stage_file(path, content, opener=None, sync=False):
+        staging_path = os.path.join(os.path.dirname(path), STAGING_PREFIX + uuid.uuid4().hex)
+        with trace_span('store', 'write', path=path, bytes=len(content)):
+            try:
+                with open(staging_path, 'wt', opener=opener) as fd:
+                    fd.write(content)
+                    if sync:
+                        fd.flush()
+                        os.fsync(fd.fileno())
+            except BaseException:
+                discard_staged([ (staging_path, path) ])
+                raise
+        return staging_path, path
+
+    # the certificate comes last, so a visible certificate always has its key
+    @staticmethod
+    def install_files(files):
+        for num, (staging_path, path) in enumerate(files):
+            try:
+                os.rename(staging_path, path)
+            except BaseException:
+                discard_staged(files[num:])
+                raise
+
+    # single file replaced atomically, outside of any group commit
+    def replace_file(self, path, content, opener=None):
+        self.install_files([ self.stage_file(path, content, opener=opener, sync=self.durable) ])
+        if self.durable:
+            self.sync_dirs([ os.path.dirname(path) ])
+
+    def sync_dirs(self, paths):
+        for path in sorted(set(paths)):
+            with trace_span('store', 'fsync', path=path):
+                fsync_path(path, directory=True)
+
+    @contextmanager
+    def group_commit(self, max_pending=GROUP_COMMIT_SIZE):
+        if self._group is not None:
+            yield self._group
+            return
+
+        group = WriteGroup(self, max_pending=max_pending)
+        self._group = group
+        try:
+            yield group
+            group.commit()
+        except BaseException:
+            group.discard()
+            raise
+        finally:
+            self._group = None
+
+    def list_cert_files(self, path):
+        with trace_span('store', 'listdir', path=path) as span:
+            if DIR_FD_SUPPORTED:
+                try:
+                    with self.dir_fd(path) as dir_fd:
+                        entries = os.listdir(dir_fd)
+                except FileNotFoundError:
+                    entries = []
+                if not entries and self._drop_stale_dir_fd(path):
+                    with self.dir_fd(path) as dir_fd:
+                        entries = os.listdir(dir_fd)
+            else:
+                entries = os.listdir(path)
+            files = [ f for f in entries if f.endswith(self.CERT_SUFFIX) ]
+            span.set(entries=len(files))
+        return files
+
     def verify_exists(self, context, paths=None,
                       check_cert=False, check_key=False,
                       check_rsa_key=False, check_req=False, inverted_check=False):
@@ -74,13 +460,13 @@ class Store:
 
         failed_item = None
 
-        if check_cert and inverted_check is os.path.exists(paths.cert):
+        if check_cert and inverted_check is self.exists(paths.cert):
             failed_item = "cert"
-        elif check_key and inverted_check is os.path.exists(paths.key):
+        elif check_key and inverted_check is self.exists(paths.key):
             failed_item = "key"
-        elif check_rsa_key and inverted_check is os.path.exists(paths.rsa_key):
+        elif check_rsa_key and inverted_check is self.exists(paths.rsa_key):
             failed_item = "rsa_key"
-        elif check_req and inverted_check is os.path.exists(paths.req):
+        elif check_req and inverted_check is self.exists(paths.req):
             failed_item = "req"
 
         if not failed_item:
@@ -112,9 +498,11 @@ class Store:
             raise FileNotFoundError('{}{} was not found in the store'.format(
                 desc_prefix, description))
 
-    def get_context_paths(self, context):
+    def get_context_paths(self, context, prepare=False):
+        basepaths = self.make_store_basepaths if prepare else self.store_basepaths
+
         if context.is_ca:
-            cert_basepath, key_basepath = self.make_store_basepaths(
+            cert_basepath, key_basepath = basepaths(
                     context.basename, self.root_dir, self.key_dir)
 
         else:
@@ -123,50 +511,211 @@ class Store:
             else:
                 ca_basename = self.CA_DIR_SUFFIX
 
-            ca_basepath, _ = self.make_store_basepaths(
+            ca_basepath, _ = basepaths(
                     ca_basename, self.root_dir, self.key_dir)
-            cert_basepath, key_basepath = self.make_store_basepaths(
-                    context.basename, ca_basepath + self.CA_DIR_SUFFIX)
+            ca_dir = ca_basepath + self.CA_DIR_SUFFIX
 
+            store_format = self.format(fresh=prepare)
+            if store_format.shard_levels:
+                shard_dir = os.path.join(ca_dir, self.shard_of(context.basename,
+                                                               store_format.shard_levels))
+                paths = self.make_paths(*basepaths(context.basename, shard_dir))
+                # a leaf that was not moved yet is still in the flat directory
+                if prepare or not store_format.migrating or self.exists(paths.cert):
+                    return paths
+
+            cert_basepath, key_basepath = basepaths(context.basename, ca_dir)
+
+        return self.make_paths(cert_basepath, key_basepath)
+
+    def make_paths(self, cert_basepath, key_basepath):
         return self.CertificatePaths(cert_basepath + self.CERT_SUFFIX,
                                      key_basepath + self.KEY_SUFFIX,
                                      key_basepath + self.RSA_KEY_SUFFIX,
                                      cert_basepath + self.REQUEST_SUFFIX)
 
-    def get_ca_certs(self):
+    # derived files live beside the certificate, or beside the key for private ones
+    def get_artifact_path(self, context, suffix, private=False):
+        paths = self.get_context_paths(context)
+        if private:
+            return paths.key[:-len(self.KEY_SUFFIX)] + suffix
+        return paths.cert[:-len(self.CERT_SUFFIX)] + suffix
+
+    def get_ca_certs(self, load_cert=True):
         try:
-            files = list(f for f in os.listdir(self.root_dir) if f.endswith(self.CERT_SUFFIX))
+            files = self.list_cert_files(self.root_dir)
         except FileNotFoundError:
             return
 
         for f in files:
             basename, _ = os.path.splitext(f)
             context = Context(basename, is_ca=True)
-            self.load_context(context, load_cert=True)
+            if load_cert:
+                self.load_context(context, load_cert=True)
             yield context
 
-    def get_certs(self, context):
-        ca_basepath, _ = self.make_store_basepaths(
+    def get_ca_dir(self, context):
+        ca_basepath, _ = self.store_basepaths(
                 context.basename, self.root_dir, self.key_dir)
-        ca_dir = ca_basepath + self.CA_DIR_SUFFIX
+        return ca_basepath + self.CA_DIR_SUFFIX
 
+    def list_shards(self, path, levels):
         try:
-            files = list(f for f in os.listdir(ca_dir) if f.endswith(self.CERT_SUFFIX))
+            with trace_span('store', 'listdir', path=path):
+                shards = sorted(f for f in os.listdir(path) if RE_SHARD.match(f))
         except FileNotFoundError:
             return
 
-        for f in files:
-            basename, _ = os.path.splitext(f)
-            ctx = Context(basename, ca_context=context)
-            self.load_context(ctx, load_cert=True)
-            yield ctx
+        for shard in shards:
+            if levels > 1:
+                for sub_shard in self.list_shards(os.path.join(path, shard), levels - 1):
+                    yield os.path.join(shard, sub_shard)
+            else:
+                yield shard
+
+    # Leaf directories of a CA: '' is the flat directory itself, anything
+    # else a shard below it. Each can be passed to get_certs() on its own.
+    def get_shards(self, context):
+        store_format = self.format()
+        if not store_format.shard_levels or store_format.migrating:
+            yield ''
+        if store_format.shard_levels:
+            yield from self.list_shards(self.get_ca_dir(context), store_format.shard_levels)
+
+    def get_certs(self, context, load_cert=True, shard=None):
+        ca_dir = self.get_ca_dir(context)
+        shards = self.get_shards(context) if shard is None else [ shard ]
+        # a leaf being moved shows up in both layouts
+        seen = set() if shard is None and self.format().migrating else None
+
+        for shard in shards:
+            try:
+                files = self.list_cert_files(os.path.join(ca_dir, shard) if shard else ca_dir)
+            except FileNotFoundError:
+                continue
+
+            for f in files:
+                basename, _ = os.path.splitext(f)
+                if seen is not None:
+                    if basename in seen:
+                        continue
+                    seen.add(basename)
+                ctx = Context(basename, ca_context=context)
+                if load_cert:
+                    self.load_context(ctx, load_cert=True)
+                yield ctx
+
+    # Moves the leaves of a flat store into hashed shard directories while the
+    # store stays in use. The marker goes to "migrating" first, then every leaf
+    # is hard-linked into its shard, certificate last, before the flat names
+    # are removed, so a reader always finds a complete set of files in one of
+    # the two places. Files derived from a certificate are not moved and are
+    # rebuilt in the shard on first use. Returns the number of leaves moved.
+    def migrate(self, shard_levels=SHARD_LEVELS):
+        if not 0 < shard_levels <= MAX_SHARD_LEVELS:
+            raise ValueError('Shard levels must be between 1 and {}'.format(MAX_SHARD_LEVELS))
+
+        with locked_file(os.path.join(self.root_dir, self.FORMAT_LOCK_FILENAME)):
+            store_format = self.format(fresh=True)
+            if store_format.layout == LAYOUT_SHARDED and store_format.shard_levels != shard_levels:
+                raise Exception('Store is already sharded with {} levels'.format(
+                    store_format.shard_levels))
+            if store_format.layout == LAYOUT_SHARDED and not store_format.migrating:
+                return 0
+
+            self.write_format(StoreFormat(LAYOUT_SHARDED, shard_levels, True))
+            # readers in other processes switch to looking in both layouts
+            time.sleep(FORMAT_CHECK_INTERVAL)
+
+            moved = 0
+            ca_contexts = [ self.self_signed_context() ] + list(self.get_ca_certs(load_cert=False))
+            # writers that read the old marker may still add flat leaves, so
+            # directories are listed again until nothing is left to move
+            while True:
+                count = sum(self.migrate_certs(ca_context) for ca_context in ca_contexts)
+                if not count:
+                    break
+                moved += count
+
+            self.write_format(StoreFormat(LAYOUT_SHARDED, shard_levels, False))
+
+        return moved
+
+    def migrate_certs(self, ca_context):
+        ca_dir = self.get_ca_dir(ca_context)
+        try:
+            files = self.list_cert_files(ca_dir)
+        except FileNotFoundError:
+            return 0
+
+        for start in range(0, len(files), MIGRATE_CHUNK):
+            with trace_span('store', 'migrate', path=ca_dir,
+                            certs=len(files[start:start + MIGRATE_CHUNK])):
+                self.migrate_chunk(ca_dir, [ os.path.splitext(f)[0]
+                                             for f in files[start:start + MIGRATE_CHUNK] ],
+                                   ca_context)
+
+        return len(files) + self.migrate_leftovers(ca_dir, ca_context)
+
+    # Keys and requests left in the flat layout by an interrupted chunk: the
+    # certificate is unlinked first, so they are no longer found through it.
+    # Linking them finds the copy already moved, and they are unlinked.
+    def migrate_leftovers(self, ca_dir, ca_context):
+        leftovers = set()
+        for directory, suffixes in ((os.path.join(ca_dir, self.PRIVATE_KEY_SUBDIR),
+                                     (self.KEY_SUFFIX, self.RSA_KEY_SUFFIX)),
+                                    (ca_dir, (self.REQUEST_SUFFIX,))):
+            try:
+                names = os.listdir(directory)
+            except FileNotFoundError:
+                continue
+            leftovers.update(os.path.splitext(name)[0] for name in names
+                             if os.path.splitext(name)[1] in suffixes)
+
+        leftovers = sorted(leftovers)
+        for start in range(0, len(leftovers), MIGRATE_CHUNK):
+            self.migrate_chunk(ca_dir, leftovers[start:start + MIGRATE_CHUNK], ca_context)
+        return len(leftovers)
+
+    def migrate_chunk(self, ca_dir, basenames, ca_context):
+        moves = []
+        for basename in basenames:
+            source = self.make_paths(*self.store_basepaths(basename, ca_dir))
+            target = self.get_context_paths(Context(basename, ca_context=ca_context), prepare=True)
+            for source_path, target_path in zip((source.key, source.rsa_key, source.req, source.cert),
+                                                (target.key, target.rsa_key, target.req, target.cert)):
+                try:
+                    os.link(source_path, target_path)
+                except FileNotFoundError:
+                    continue
+                except FileExistsError:
+                    # moved before an interruption, or written again since
+                    pass
+                moves.append((source_path, target_path))
+
+        if self.durable:
+            self.sync_dirs(os.path.dirname(target_path) for _, target_path in moves)
+
+        if self.index:
+            self.index.move_many((source_path, target_path) for source_path, target_path in moves
+                                 if source_path.endswith(self.CERT_SUFFIX))
+
+        # certificates first, so a listed certificate always has its key
+        for source_path, _ in sorted(moves, key=lambda move: not move[0].endswith(self.CERT_SUFFIX)):
+            os.unlink(source_path)
+
+        if self.durable:
+            self.sync_dirs(os.path.dirname(source_path) for source_path, _ in moves)
 
     @staticmethod
     def restricted_opener(filename, flags):
         return os.open(filename, flags, mode=Store.PRIVATE_KEY_FILE_PERMS)
 
-    def store(self, context, with_request=False, require_rsa=False):
-        paths = self.get_context_paths(context)
+    # Writes the certificate files of a context. Every file is staged and renamed
+    # into place; inside group_commit() the renames and fsyncs are deferred to
+    # the group and on_commit is called with the context once it is durable.
+    def store(self, context, with_request=False, require_rsa=False, on_commit=None):
+        paths = self.get_context_paths(context, prepare=True)
 
         certificate = context.require_certificate
         private_key = context.require_private_key
@@ -181,16 +730,32 @@ class Store:
         else:
             request = None
 
-        with open(paths.cert, 'wt') as fd:
-            fd.write(certificate)
+        group = self._group
+        sync = self.durable and group is None
+        files = []
+        try:
+            files.append(self.stage_file(paths.key, private_key,
+                                         opener=self.restricted_opener, sync=sync))
+            if rsa_private_key:
+                files.append(self.stage_file(paths.rsa_key, rsa_private_key,
+                                             opener=self.restricted_opener, sync=sync))
+            if request:
+                files.append(self.stage_file(paths.req, request, sync=sync))
+            files.append(self.stage_file(paths.cert, certificate, sync=sync))
+        except BaseException:
+            discard_staged(files)
+            raise
+
+        if group is not None:
+            group.add(context, files, on_commit)
+            return
 
-        with open(paths.key, 'wt', opener=self.restricted_opener) as fd:
-            fd.write(private_key)
+        self.install_files(files)
+        if sync:
+            self.sync_dirs(os.path.dirname(path) for _, path in files)
 
-        if rsa_private_key:
-            with open(paths.rsa_key, 'wt', opener=self.restricted_opener) as fd:
-                fd.write(rsa_private_key)
+        if self.index:
+            self.index.update(context)
 
-        if request:
-            with open(paths.req, 'wt') as fd:
-                fd.write(request)
+        if on_commit:
+            on_commit(context)
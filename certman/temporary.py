@@ -1,15 +1,22 @@
-__all__ = [ 'make_temp_file', 'clean_temp_files' ]
+__all__ = [ 'make_temp_file', 'remove_temp_file', 'clean_temp_files', 'inherited_file' ]
 
 import tempfile
+import threading
 import os
+from contextlib import contextmanager
+
+from .trace import trace_span
 
 class TempFileManager:
     _instance = None
+    _instance_lock = threading.Lock()
 
     @classmethod
     def instance(cls):
         if not cls._instance:
-            cls._instance = cls()
+            with cls._instance_lock:
+                if not cls._instance:
+                    cls._instance = cls()
 
         return cls._instance
 
@@ -18,8 +25,7 @@ class TempFileManager:
             return
 
         tmp_dir = parent_dir + '/ca_cert_manager'
-        if not os.path.exists(tmp_dir):
-            os.makedirs(tmp_dir, mode=0o700)
+        os.makedirs(tmp_dir, mode=0o700, exist_ok=True)
 
         if os.access(tmp_dir, os.X_OK | os.R_OK | os.W_OK):
             return tmp_dir
@@ -38,27 +44,68 @@ class TempFileManager:
         raise Exception("No suitable temporary directory found")
 
     def __init__(self):
-        self.files = []
+        self.files = set()
+        self.lock = threading.Lock()
         self.tempdir = self._get_temp_dir()
 
     def create(self, content):
-        fd, name = tempfile.mkstemp(prefix='cacertmanager', dir=self.tempdir)
-        self.files.append(name)
-        os.write(fd, content.encode())
-        os.close(fd)
+        with trace_span('temp', 'create', bytes=len(content)) as span:
+            fd, name = tempfile.mkstemp(prefix='cacertmanager', dir=self.tempdir)
+            span.set(path=name)
+            with self.lock:
+                self.files.add(name)
+            try:
+                os.write(fd, content.encode())
+            finally:
+                os.close(fd)
         return name
 
+    def remove(self, name):
+        try:
+            os.unlink(name)
+        except FileNotFoundError:
+            pass
+
+        with self.lock:
+            self.files.discard(name)
+
     def clean(self):
-        for filename in self.files:
+        with self.lock:
+            files = self.files
+            self.files = set()
+
+        for filename in files:
             try:
                 os.unlink(filename)
             except FileNotFoundError:
                 pass
 
-        self.files = []
-
 def make_temp_file(content):
     return TempFileManager.instance().create(content)
 
+def remove_temp_file(name):
+    TempFileManager.instance().remove(name)
+
 def clean_temp_files():
-    TempFileManager.instance().clean()
+    # nothing to clean if no temporary file was ever made, and no directory to create
+    if TempFileManager._instance:
+        TempFileManager._instance.clean()
+
+# content for a child process as a path plus fds to pass to it: an anonymous memfd
+# opened through /dev/fd where available, otherwise a regular temporary file
+@contextmanager
+def inherited_file(content):
+    if not hasattr(os, 'memfd_create'):
+        name = make_temp_file(content)
+        try:
+            yield name, ()
+        finally:
+            remove_temp_file(name)
+        return
+
+    fd = os.memfd_create('certman')
+    try:
+        os.write(fd, content.encode())
+        yield '/dev/fd/{}'.format(fd), (fd,)
+    finally:
+        os.close(fd)
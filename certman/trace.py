@@ -0,0 +1,170 @@
+__all__ = [ 'add_trace_hook', 'remove_trace_hook', 'trace_span', 'open_trace',
+            'JsonLinesTrace', 'ChromeTrace', 'TRACE_JSONL', 'TRACE_CHROME' ]
+
+import os
+import json
+import time
+import resource
+import threading
+
+TRACE_JSONL = 'jsonl'
+TRACE_CHROME = 'chrome'
+
+ARGV_SUMMARY_LENGTH = 200
+
+# hooks are called with every finished span; an empty list means tracing is off
+_hooks = []
+_hooks_lock = threading.Lock()
+
+def add_trace_hook(hook):
+    global _hooks
+    with _hooks_lock:
+        # copy on write, spans iterate over the list without locking
+        _hooks = _hooks + [ hook ]
+
+def remove_trace_hook(hook):
+    global _hooks
+    with _hooks_lock:
+        _hooks = [ h for h in _hooks if h is not hook ]
+
+class _NullSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def set(self, **kwargs):
+        pass
+
+NULL_SPAN = _NullSpan()
+
+class Span:
+    def __init__(self, category, name, args, hooks):
+        self.category = category
+        self.name = name
+        self.args = args
+        self.hooks = hooks
+
+    def set(self, **kwargs):
+        self.args.update(kwargs)
+
+    def __enter__(self):
+        self.start = time.time()
+        self.wall_start = time.perf_counter()
+        self.cpu_start = time.thread_time()
+        if self.category == 'openssl':
+            self.child_cpu_start = self._child_cpu()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        event = {
+            'cat': self.category,
+            'name': self.name,
+            'ts': self.start,
+            'wall': time.perf_counter() - self.wall_start,
+            'cpu': time.thread_time() - self.cpu_start,
+            'pid': os.getpid(),
+            'tid': threading.get_ident(),
+            'args': self.args,
+        }
+        if self.category == 'openssl':
+            # only approximate while other threads wait for their own children
+            event['child_cpu'] = self._child_cpu() - self.child_cpu_start
+        if exc_type:
+            event['error'] = '{}: {}'.format(exc_type.__name__, exc)
+
+        for hook in self.hooks:
+            hook(event)
+        return False
+
+    @staticmethod
+    def _child_cpu():
+        usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+        return usage.ru_utime + usage.ru_stime
+
+def trace_span(category, name, **args):
+    hooks = _hooks
+    if not hooks:
+        return NULL_SPAN
+    return Span(category, name, args, hooks)
+
+def tracing():
+    return bool(_hooks)
+
+def argv_summary(args):
+    summary = ' '.join(str(arg) for arg in args)
+    if len(summary) > ARGV_SUMMARY_LENGTH:
+        summary = summary[:ARGV_SUMMARY_LENGTH - 3] + '...'
+    return summary
+
+class TraceFile:
+    def __init__(self, path):
+        # one os.write() per event keeps lines whole when forked workers share the file
+        self.fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC | os.O_APPEND, 0o644)
+        self.owner_pid = os.getpid()
+        self.start()
+
+    def write(self, text):
+        os.write(self.fd, text.encode())
+
+    def start(self):
+        pass
+
+    def finish(self):
+        pass
+
+    def __call__(self, event):
+        self.write(self.format(event))
+
+    def close(self):
+        remove_trace_hook(self)
+        if self.fd is None:
+            return
+        if os.getpid() == self.owner_pid:
+            self.finish()
+        os.close(self.fd)
+        self.fd = None
+
+class JsonLinesTrace(TraceFile):
+    def format(self, event):
+        return json.dumps(event) + '\n'
+
+# Trace Event Format, loads in chrome://tracing and Perfetto
+class ChromeTrace(TraceFile):
+    def start(self):
+        self.write('[\n')
+
+    def format(self, event):
+        args = dict(event['args'], cpu_us=int(event['cpu'] * 1e6))
+        if 'child_cpu' in event:
+            args['child_cpu_us'] = int(event['child_cpu'] * 1e6)
+        if 'error' in event:
+            args['error'] = event['error']
+
+        return json.dumps({
+            'name': event['name'],
+            'cat': event['cat'],
+            'ph': 'X',
+            'ts': int(event['ts'] * 1e6),
+            'dur': int(event['wall'] * 1e6),
+            'pid': event['pid'],
+            'tid': event['tid'],
+            'args': args,
+        }) + ',\n'
+
+    def finish(self):
+        # a closing metadata event keeps the array valid JSON despite the trailing commas
+        self.write(json.dumps({ 'name': 'process_name', 'ph': 'M', 'pid': self.owner_pid,
+                                'args': { 'name': 'certman' } }) + ']\n')
+
+def open_trace(path, trace_format=TRACE_JSONL):
+    if trace_format == TRACE_CHROME:
+        trace = ChromeTrace(path)
+    elif trace_format == TRACE_JSONL:
+        trace = JsonLinesTrace(path)
+    else:
+        raise ValueError('Unknown trace format: {}'.format(trace_format))
+
+    add_trace_hook(trace)
+    return trace
@@ -0,0 +1,125 @@
+__all__ = [ 'TreeNode', 'walk_tree', 'NODE_CA', 'NODE_MISSING_CA', 'NODE_CERT' ]
+
+from collections import namedtuple, deque
+from concurrent.futures import ThreadPoolExecutor
+
+from .trace import trace_span
+
+NODE_CA = 'ca'
+# an issuer of CAs in the store that is not in the store itself
+NODE_MISSING_CA = 'missing-ca'
+NODE_CERT = 'cert'
+
+TREE_JOBS = 8
+# leaves read and parsed per task
+TREE_CHUNK = 256
+
+# context and certinfo are None for a missing CA; ca_context is the parent
+# CA of a leaf
+TreeNode = namedtuple('TreeNode', 'kind depth subject context certinfo ca_context'.split())
+
+CARecord = namedtuple('CARecord', 'subject context certinfo children'.split())
+
+def build_ca_tree(store, info_source, load_cert=True):
+    ca_contexts = list(store.get_ca_certs(load_cert=load_cert))
+    ca_map = {}
+    for ca_context, certinfo in zip(ca_contexts, info_source.get_info_many(ca_contexts)):
+        ca_map[certinfo.subject] = CARecord(certinfo.subject, ca_context, certinfo, [])
+
+    roots = []
+    missing = {}
+    for record in ca_map.values():
+        issuer = record.certinfo.issuer
+        if issuer == record.subject:
+            roots.append(record)
+            continue
+
+        parent = ca_map.get(issuer)
+        if parent is None:
+            parent = missing.get(issuer)
+        if parent is None:
+            parent = missing[issuer] = CARecord(issuer, None, None, [])
+            roots.append(parent)
+        parent.children.append(record)
+
+    roots.sort(key=lambda record: record.subject)
+    return roots
+
+def find_ca(records, basename):
+    for record in records:
+        if record.context and record.context.basename == basename:
+            return record
+        found = find_ca(record.children, basename)
+        if found:
+            return found
+    return None
+
+# Certificates of the CA tree in display order: each CA, then the CAs it
+# signed, then its leaves. Only the CA certificates are read up front; the
+# leaves are read shard by shard and parsed in chunks on a thread pool, at
+# most a few chunks ahead of the consumer, so nodes come out as soon as they
+# are resolved and memory does not grow with the number of leaves. With
+# ca_basename only that CA and what it signed is read, and depth limits how
+# many levels below the top are read at all.
+def walk_tree(store, info_source, ca_basename=None, depth=None, load_cert=True, jobs=None):
+    with trace_span('tree', 'cas'):
+        roots = build_ca_tree(store, info_source, load_cert=load_cert)
+
+    if ca_basename:
+        top = find_ca(roots, ca_basename)
+        if top is None:
+            raise FileNotFoundError('CA certificate {} was not found in the store'.format(ca_basename))
+        roots = [ top ]
+
+    def leaf_chunks(ca_context):
+        for shard in store.get_shards(ca_context):
+            contexts = []
+            for context in store.get_certs(ca_context, load_cert=False, shard=shard):
+                contexts.append(context)
+                if len(contexts) >= TREE_CHUNK:
+                    yield contexts
+                    contexts = []
+            if contexts:
+                yield contexts
+
+    # nodes in display order, chunks of leaves as callables still to be run
+    def plan(record, level):
+        kind = NODE_CA if record.context else NODE_MISSING_CA
+        yield TreeNode(kind, level, record.subject, record.context, record.certinfo, None)
+        if depth is not None and level >= depth:
+            return
+
+        for child in record.children:
+            yield from plan(child, level + 1)
+
+        if record.context:
+            for contexts in leaf_chunks(record.context):
+                yield read_chunk(record.context, contexts, level + 1)
+
+    def read_chunk(ca_context, contexts, level):
+        def read():
+            if load_cert:
+                for context in contexts:
+                    store.load_context(context, load_cert=True)
+            return [ TreeNode(NODE_CERT, level, certinfo.subject, context, certinfo, ca_context)
+                     for context, certinfo in zip(contexts, info_source.get_info_many(contexts)) ]
+        return read
+
+    jobs = jobs or TREE_JOBS
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        ahead = deque()
+        for root in roots:
+            for item in plan(root, 0):
+                ahead.append(item if isinstance(item, TreeNode) else executor.submit(item))
+                # keeps the workers busy without reading ahead of the output
+                while len(ahead) > 2 * jobs or (ahead and isinstance(ahead[0], TreeNode)):
+                    yield from emit(ahead.popleft())
+
+        while ahead:
+            yield from emit(ahead.popleft())
+
+def emit(item):
+    if isinstance(item, TreeNode):
+        yield item
+    else:
+        yield from item.result()
@@ -0,0 +1,600 @@
+__all__ = [ 'DecodeError', 'pem_to_der', 'parse_der', 'parse_pem', 'format_fingerprint',
+            'subject_name', 'certificate_names', 'public_key_hash', 'spki_key_hash', 'private_key_hash', 'private_key_to_pkcs8',
+            'decode_ocsp_request' ]
+
+import re
+import base64
+import hashlib
+
+from .certinfo import CertInfo
+
+# Decodes the subset of X.509 that certman issues and inspects, producing
+# the same text openssl prints for get_info(). Anything else raises
+# DecodeError, so the caller can fall back to running openssl.
+
+class DecodeError(ValueError):
+    pass
+
+TAG_BOOLEAN = 0x01
+TAG_INTEGER = 0x02
+TAG_BIT_STRING = 0x03
+TAG_OCTET_STRING = 0x04
+TAG_OID = 0x06
+TAG_UTF8_STRING = 0x0c
+TAG_NUMERIC_STRING = 0x12
+TAG_PRINTABLE_STRING = 0x13
+TAG_T61_STRING = 0x14
+TAG_IA5_STRING = 0x16
+TAG_UTC_TIME = 0x17
+TAG_GENERALIZED_TIME = 0x18
+TAG_VISIBLE_STRING = 0x1a
+TAG_UNIVERSAL_STRING = 0x1c
+TAG_BMP_STRING = 0x1e
+TAG_SEQUENCE = 0x30
+TAG_SET = 0x31
+
+STRING_ENCODINGS = {
+    TAG_UTF8_STRING: 'utf-8',
+    TAG_NUMERIC_STRING: 'latin-1',
+    TAG_PRINTABLE_STRING: 'latin-1',
+    TAG_T61_STRING: 'latin-1',
+    TAG_IA5_STRING: 'latin-1',
+    TAG_VISIBLE_STRING: 'latin-1',
+    TAG_UNIVERSAL_STRING: 'utf-32-be',
+    TAG_BMP_STRING: 'utf-16-be',
+}
+
+NAME_ATTRIBUTES = {
+    '2.5.4.3': 'CN',
+    '2.5.4.4': 'SN',
+    '2.5.4.5': 'serialNumber',
+    '2.5.4.6': 'C',
+    '2.5.4.7': 'L',
+    '2.5.4.8': 'ST',
+    '2.5.4.9': 'street',
+    '2.5.4.10': 'O',
+    '2.5.4.11': 'OU',
+    '2.5.4.12': 'title',
+    '2.5.4.13': 'description',
+    '2.5.4.15': 'businessCategory',
+    '2.5.4.17': 'postalCode',
+    '2.5.4.42': 'GN',
+    '2.5.4.43': 'initials',
+    '2.5.4.44': 'generationQualifier',
+    '2.5.4.46': 'dnQualifier',
+    '2.5.4.65': 'pseudonym',
+    '2.5.4.97': 'organizationIdentifier',
+    '0.9.2342.19200300.100.1.1': 'UID',
+    '0.9.2342.19200300.100.1.25': 'DC',
+    '1.2.840.113549.1.9.1': 'emailAddress',
+    '1.3.6.1.4.1.311.60.2.1.1': 'jurisdictionL',
+    '1.3.6.1.4.1.311.60.2.1.2': 'jurisdictionST',
+    '1.3.6.1.4.1.311.60.2.1.3': 'jurisdictionC',
+}
+
+KEY_USAGE_NAMES = (
+    'Digital Signature',
+    'Non Repudiation',
+    'Key Encipherment',
+    'Data Encipherment',
+    'Key Agreement',
+    'Certificate Sign',
+    'CRL Sign',
+    'Encipher Only',
+    'Decipher Only',
+)
+
+EXTENDED_KEY_USAGE_NAMES = {
+    '1.3.6.1.5.5.7.3.1': 'TLS Web Server Authentication',
+    '1.3.6.1.5.5.7.3.2': 'TLS Web Client Authentication',
+    '1.3.6.1.5.5.7.3.3': 'Code Signing',
+    '1.3.6.1.5.5.7.3.4': 'E-mail Protection',
+    '1.3.6.1.5.5.7.3.8': 'Time Stamping',
+    '1.3.6.1.5.5.7.3.9': 'OCSP Signing',
+    '2.5.29.37.0': 'Any Extended Key Usage',
+}
+
+EXT_BASIC_CONSTRAINTS = '2.5.29.19'
+EXT_KEY_USAGE = '2.5.29.15'
+EXT_EXTENDED_KEY_USAGE = '2.5.29.37'
+EXT_SUBJECT_ALT_NAME = '2.5.29.17'
+
+OID_SHA1 = '1.3.14.3.2.26'
+OID_RSA_ENCRYPTION = '1.2.840.113549.1.1.1'
+OID_EC_PUBLIC_KEY = '1.2.840.10045.2.1'
+
+PEM_PKCS8_KEY = 'PRIVATE KEY'
+PEM_RSA_KEY = 'RSA PRIVATE KEY'
+PEM_EC_KEY = 'EC PRIVATE KEY'
+
+# DER AlgorithmIdentifier of rsaEncryption, and the id-ecPublicKey OID
+RSA_ALGORITHM_DER = bytes.fromhex('300d06092a864886f70d0101010500')
+EC_PUBLIC_KEY_OID_DER = bytes.fromhex('06072a8648ce3d0201')
+
+MONTHS = ('Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun',
+          'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec')
+
+# RFC 2253 escaping as done by openssl with -nameopt esc_2253,esc_2254,esc_ctrl,utf8
+ESCAPE_BACKSLASH = set(',+"\\<>;')
+ESCAPE_HEX = set('*()')
+
+RE_PEM_CERTIFICATE = re.compile(r'-----BEGIN CERTIFICATE-----\s*(.*?)\s*-----END CERTIFICATE-----', re.S)
+
+
+def read_tlv(data, offset):
+    try:
+        tag = data[offset]
+        if tag & 0x1f == 0x1f:
+            raise DecodeError('High tag numbers are not supported')
+
+        length = data[offset + 1]
+        offset += 2
+        if length & 0x80:
+            num_bytes = length & 0x7f
+            if num_bytes == 0 or num_bytes > 4:
+                raise DecodeError('Unsupported length encoding')
+            length = int.from_bytes(data[offset:offset + num_bytes], 'big')
+            offset += num_bytes
+    except IndexError:
+        raise DecodeError('Truncated DER data')
+
+    end = offset + length
+    if end > len(data):
+        raise DecodeError('Truncated DER data')
+
+    return tag, offset, end
+
+
+def read_children(data, start, end):
+    children = []
+    while start < end:
+        tag, value_start, value_end = read_tlv(data, start)
+        children.append((tag, value_start, value_end))
+        start = value_end
+    return children
+
+
+def expect(element, tag):
+    if element[0] != tag:
+        raise DecodeError('Expected tag 0x{:02x}, got 0x{:02x}'.format(tag, element[0]))
+    return element
+
+
+def decode_oid(value):
+    if not value:
+        raise DecodeError('Empty OID')
+
+    parts = []
+    current = 0
+    for byte in value:
+        current = (current << 7) | (byte & 0x7f)
+        if not byte & 0x80:
+            parts.append(current)
+            current = 0
+
+    first = parts[0]
+    if first < 40:
+        head = [ 0, first ]
+    elif first < 80:
+        head = [ 1, first - 40 ]
+    else:
+        head = [ 2, first - 80 ]
+
+    return '.'.join(str(p) for p in head + parts[1:])
+
+
+def decode_string(tag, value):
+    try:
+        encoding = STRING_ENCODINGS[tag]
+    except KeyError:
+        raise DecodeError('Unsupported string type 0x{:02x}'.format(tag))
+
+    try:
+        return value.decode(encoding)
+    except UnicodeDecodeError as e:
+        raise DecodeError(str(e))
+
+
+def escape_dn_value(value):
+    chars = []
+    last = len(value) - 1
+    for pos, char in enumerate(value):
+        if char in ESCAPE_BACKSLASH:
+            chars.append('\\' + char)
+        elif (pos == 0 and char in ' #') or (pos == last and char == ' '):
+            chars.append('\\' + char)
+        elif char in ESCAPE_HEX or ord(char) < 0x20 or ord(char) == 0x7f:
+            chars.append('\\{:02X}'.format(ord(char)))
+        else:
+            chars.append(char)
+    return ''.join(chars)
+
+
+def escape_oneline_value(raw):
+    chars = []
+    for byte in raw:
+        if byte < 0x20 or byte > 0x7e:
+            chars.append('\\x{:02X}'.format(byte))
+        elif byte in b'/+':
+            chars.append('\\' + chr(byte))
+        else:
+            chars.append(chr(byte))
+    return ''.join(chars)
+
+
+def decode_name(data, start, end):
+    rdns = []
+    for rdn_set in read_children(data, start, end):
+        expect(rdn_set, TAG_SET)
+        rdn = []
+        for attribute in read_children(data, rdn_set[1], rdn_set[2]):
+            expect(attribute, TAG_SEQUENCE)
+            children = read_children(data, attribute[1], attribute[2])
+            if len(children) != 2:
+                raise DecodeError('Malformed name attribute')
+
+            oid = decode_oid(data[slice(*expect(children[0], TAG_OID)[1:])])
+            try:
+                short_name = NAME_ATTRIBUTES[oid]
+            except KeyError:
+                raise DecodeError('Unsupported name attribute {}'.format(oid))
+
+            tag, value_start, value_end = children[1]
+            raw = data[value_start:value_end]
+            rdn.append((short_name, decode_string(tag, raw), raw))
+        rdns.append(rdn)
+
+    return rdns
+
+
+def format_name(rdns):
+    return ', '.join(' + '.join('{}={}'.format(key, escape_dn_value(value))
+                                for key, value, _ in rdn)
+                     for rdn in rdns)
+
+
+def format_name_oneline(rdns):
+    return ''.join('/' + '+'.join('{}={}'.format(key, escape_oneline_value(raw))
+                                  for key, _, raw in rdn)
+                   for rdn in rdns)
+
+
+def decode_time(tag, value):
+    text = value.decode('ascii', errors='replace')
+    if tag == TAG_UTC_TIME and re.fullmatch(r'\d{12}Z', text):
+        year = int(text[0:2])
+        year += 2000 if year < 50 else 1900
+        rest = text[2:]
+    elif tag == TAG_GENERALIZED_TIME and re.fullmatch(r'\d{14}Z', text):
+        year = int(text[0:4])
+        rest = text[4:]
+    else:
+        raise DecodeError('Unsupported time value {!r}'.format(text))
+
+    month, day, hour, minute, second = (int(rest[i:i + 2]) for i in range(0, 10, 2))
+    if not 1 <= month <= 12:
+        raise DecodeError('Invalid month in {!r}'.format(text))
+
+    return '{} {:2d} {:02d}:{:02d}:{:02d} {} GMT'.format(
+            MONTHS[month - 1], day, hour, minute, second, year)
+
+
+def decode_serial(value):
+    if not value or value[0] & 0x80:
+        raise DecodeError('Negative or empty serial number')
+
+    stripped = value.lstrip(b'\0')
+    return (stripped or b'\0').hex().upper()
+
+
+def decode_basic_constraints(data, start, end):
+    values = []
+    is_ca = False
+    for tag, value_start, value_end in read_children(data, start, end):
+        if tag == TAG_BOOLEAN:
+            is_ca = data[value_start:value_end] != b'\0'
+        elif tag == TAG_INTEGER:
+            values.append('pathlen:{}'.format(int.from_bytes(data[value_start:value_end], 'big')))
+        else:
+            raise DecodeError('Malformed basic constraints')
+
+    return [ 'CA:TRUE' if is_ca else 'CA:FALSE' ] + values
+
+
+def decode_key_usage(value):
+    if not value:
+        raise DecodeError('Empty key usage')
+
+    bits = value[1:]
+    return [ name for num, name in enumerate(KEY_USAGE_NAMES)
+             if num // 8 < len(bits) and bits[num // 8] & (0x80 >> (num % 8)) ]
+
+
+def decode_extended_key_usage(data, start, end):
+    usages = []
+    for element in read_children(data, start, end):
+        oid = decode_oid(data[slice(*expect(element, TAG_OID)[1:])])
+        usages.append(EXTENDED_KEY_USAGE_NAMES.get(oid, oid))
+    return usages
+
+
+def format_ip_address(value):
+    if len(value) == 4:
+        return '.'.join(str(b) for b in value)
+    if len(value) == 16:
+        return ':'.join('{:X}'.format(int.from_bytes(value[i:i + 2], 'big')) for i in range(0, 16, 2))
+    raise DecodeError('Invalid IP address length')
+
+
+def decode_subject_alt_name(data, start, end):
+    names = []
+    for tag, value_start, value_end in read_children(data, start, end):
+        value = data[value_start:value_end]
+        if tag == 0x81:
+            names.append('email:' + decode_string(TAG_IA5_STRING, value))
+        elif tag == 0x82:
+            names.append('DNS:' + decode_string(TAG_IA5_STRING, value))
+        elif tag == 0x86:
+            names.append('URI:' + decode_string(TAG_IA5_STRING, value))
+        elif tag == 0x87:
+            names.append('IP Address:' + format_ip_address(value))
+        elif tag == 0x88:
+            names.append('Registered ID:' + decode_oid(value))
+        elif tag == 0xa4:
+            name = expect(read_tlv(data, value_start), TAG_SEQUENCE)
+            names.append('DirName:' + format_name_oneline(decode_name(data, name[1], name[2])))
+        else:
+            raise DecodeError('Unsupported general name type 0x{:02x}'.format(tag))
+
+    return names
+
+
+def decode_extensions(certinfo, data, start, end):
+    for extension in read_children(data, start, end):
+        expect(extension, TAG_SEQUENCE)
+        children = read_children(data, extension[1], extension[2])
+        oid = decode_oid(data[slice(*expect(children[0], TAG_OID)[1:])])
+        _, value_start, value_end = expect(children[-1], TAG_OCTET_STRING)
+
+        if oid == EXT_KEY_USAGE:
+            _, bits_start, bits_end = expect(read_tlv(data, value_start), TAG_BIT_STRING)
+            certinfo._key_usage = decode_key_usage(data[bits_start:bits_end])
+            continue
+
+        if oid not in (EXT_BASIC_CONSTRAINTS, EXT_EXTENDED_KEY_USAGE, EXT_SUBJECT_ALT_NAME):
+            continue
+
+        _, inner_start, inner_end = expect(read_tlv(data, value_start), TAG_SEQUENCE)
+        if oid == EXT_BASIC_CONSTRAINTS:
+            certinfo._basic_constraints = decode_basic_constraints(data, inner_start, inner_end)
+        elif oid == EXT_EXTENDED_KEY_USAGE:
+            certinfo._extended_usage = decode_extended_key_usage(data, inner_start, inner_end)
+        else:
+            certinfo._subject_alt_name = decode_subject_alt_name(data, inner_start, inner_end)
+
+
+def format_fingerprint(digest):
+    return ':'.join('{:02X}'.format(b) for b in digest)
+
+
+def parse_der(der):
+    certinfo = CertInfo()
+
+    _, cert_start, cert_end = expect(read_tlv(der, 0), TAG_SEQUENCE)
+    _, tbs_start, tbs_end = expect(read_tlv(der, cert_start), TAG_SEQUENCE)
+    fields = read_children(der, tbs_start, tbs_end)
+
+    # skip the explicit [0] version
+    if fields and fields[0][0] == 0xa0:
+        fields = fields[1:]
+
+    if len(fields) < 6:
+        raise DecodeError('Malformed TBSCertificate')
+
+    serial, _, issuer, validity, subject, _ = fields[:6]
+    certinfo.serial = decode_serial(der[slice(*expect(serial, TAG_INTEGER)[1:])])
+    certinfo.issuer = format_name(decode_name(der, *expect(issuer, TAG_SEQUENCE)[1:]))
+    certinfo.subject = format_name(decode_name(der, *expect(subject, TAG_SEQUENCE)[1:]))
+
+    times = read_children(der, *expect(validity, TAG_SEQUENCE)[1:])
+    if len(times) != 2:
+        raise DecodeError('Malformed validity')
+    certinfo.not_before_raw, certinfo.not_after_raw = (
+            decode_time(tag, der[start:end]) for tag, start, end in times)
+
+    for tag, start, end in fields[6:]:
+        if tag == 0xa3:
+            _, ext_start, ext_end = expect(read_tlv(der, start), TAG_SEQUENCE)
+            decode_extensions(certinfo, der, ext_start, ext_end)
+
+    der = der[:cert_end]
+    certinfo.fingerprint = format_fingerprint(hashlib.sha1(der).digest())
+    certinfo.fingerprint_sha256 = format_fingerprint(hashlib.sha256(der).digest())
+
+    return certinfo
+
+
+def pem_to_der(text):
+    m = RE_PEM_CERTIFICATE.search(text)
+    if not m:
+        raise DecodeError('No PEM certificate found')
+
+    try:
+        return base64.b64decode(m.group(1), validate=False)
+    except ValueError as e:
+        raise DecodeError(str(e))
+
+
+def parse_pem(text):
+    return parse_der(pem_to_der(text))
+
+
+# fields of the TBSCertificate from the serial number on
+def tbs_fields(der):
+    _, cert_start, _ = expect(read_tlv(der, 0), TAG_SEQUENCE)
+    _, tbs_start, tbs_end = expect(read_tlv(der, cert_start), TAG_SEQUENCE)
+    fields = read_children(der, tbs_start, tbs_end)
+    if fields and fields[0][0] == 0xa0:
+        fields = fields[1:]
+
+    if len(fields) < 6:
+        raise DecodeError('Malformed TBSCertificate')
+    return fields
+
+
+# The subject as RDNs of (short name, value) pairs, unescaped, and the DER
+# contents of the Name, for comparing subjects byte for byte
+def subject_name(der):
+    _, start, end = expect(tbs_fields(der)[4], TAG_SEQUENCE)
+    rdns = [ [ (key, value) for key, value, _ in rdn ] for rdn in decode_name(der, start, end) ]
+    return rdns, der[start:end]
+
+
+# subject and issuer formatted as openssl prints them for get_info()
+def certificate_names(der):
+    fields = tbs_fields(der)
+    return tuple(format_name(decode_name(der, *expect(fields[num], TAG_SEQUENCE)[1:]))
+                 for num in (4, 2))
+
+
+# hash of the subjectPublicKey bits, the issuerKeyHash of an OCSP CertID
+def public_key_hash(der, algorithm='sha1'):
+    spki = read_children(der, *expect(tbs_fields(der)[5], TAG_SEQUENCE)[1:])
+    if len(spki) != 2:
+        raise DecodeError('Malformed SubjectPublicKeyInfo')
+
+    return bit_string_hash(der, spki[1], algorithm)
+
+
+# (issuerKeyHash, serial) of every SHA-1 CertID in an OCSPRequest
+def decode_ocsp_request(der):
+    _, req_start, _ = expect(read_tlv(der, 0), TAG_SEQUENCE)
+    _, tbs_start, tbs_end = expect(read_tlv(der, req_start), TAG_SEQUENCE)
+
+    # skip the explicit [0] version and [1] requestorName
+    fields = [ field for field in read_children(der, tbs_start, tbs_end)
+               if field[0] not in (0xa0, 0xa1) ]
+    if not fields:
+        raise DecodeError('Malformed TBSRequest')
+
+    cert_ids = []
+    for request in read_children(der, *expect(fields[0], TAG_SEQUENCE)[1:]):
+        req_cert = read_children(der, *expect(request, TAG_SEQUENCE)[1:])
+        if not req_cert:
+            raise DecodeError('Malformed Request')
+
+        cert_id = read_children(der, *expect(req_cert[0], TAG_SEQUENCE)[1:])
+        if len(cert_id) != 4:
+            raise DecodeError('Malformed CertID')
+
+        algorithm, _, key_hash, serial = cert_id
+        algorithm = read_children(der, *expect(algorithm, TAG_SEQUENCE)[1:])
+        if not algorithm or decode_oid(der[slice(*expect(algorithm[0], TAG_OID)[1:])]) != OID_SHA1:
+            raise DecodeError('Only SHA-1 CertIDs are supported')
+
+        cert_ids.append((der[slice(*expect(key_hash, TAG_OCTET_STRING)[1:])],
+                         decode_serial(der[slice(*expect(serial, TAG_INTEGER)[1:])])))
+
+    return cert_ids
+
+
+def encode_tlv(tag, value):
+    length = len(value)
+    if length < 0x80:
+        header = bytes((tag, length))
+    else:
+        size = (length.bit_length() + 7) // 8
+        header = bytes((tag, 0x80 | size)) + length.to_bytes(size, 'big')
+    return header + value
+
+
+def bit_string_hash(der, element, algorithm):
+    _, start, end = expect(element, TAG_BIT_STRING)
+    # the first byte of a BIT STRING counts its unused bits
+    return hashlib.new(algorithm, der[start + 1:end]).digest()
+
+
+# same hash as public_key_hash(), from a DER SubjectPublicKeyInfo
+def spki_key_hash(der, algorithm='sha256'):
+    _, start, end = expect(read_tlv(der, 0), TAG_SEQUENCE)
+    spki = read_children(der, start, end)
+    if len(spki) != 2:
+        raise DecodeError('Malformed SubjectPublicKeyInfo')
+    return bit_string_hash(der, spki[1], algorithm)
+
+
+def rsa_key_hash(der, start, end, algorithm):
+    fields = read_children(der, *expect(read_tlv(der, start), TAG_SEQUENCE)[1:])
+    if len(fields) < 3:
+        raise DecodeError('Malformed RSAPrivateKey')
+    # subjectPublicKey of an RSA certificate is the DER RSAPublicKey
+    public_key = encode_tlv(TAG_SEQUENCE, b''.join(
+            encode_tlv(TAG_INTEGER, der[slice(*expect(field, TAG_INTEGER)[1:])])
+            for field in fields[1:3]))
+    return hashlib.new(algorithm, public_key).digest()
+
+
+def ec_private_key_fields(der, start):
+    fields = read_children(der, *expect(read_tlv(der, start), TAG_SEQUENCE)[1:])
+    if len(fields) < 2:
+        raise DecodeError('Malformed ECPrivateKey')
+    return fields
+
+
+def ec_key_hash(der, start, algorithm):
+    for tag, field_start, field_end in ec_private_key_fields(der, start)[2:]:
+        if tag == 0xa1:
+            return bit_string_hash(der, read_tlv(der, field_start), algorithm)
+    raise DecodeError('EC private key without a public key')
+
+
+def pkcs8_fields(der):
+    fields = read_children(der, *expect(read_tlv(der, 0), TAG_SEQUENCE)[1:])
+    if len(fields) < 3:
+        raise DecodeError('Malformed PrivateKeyInfo')
+
+    algorithm = read_children(der, *expect(fields[1], TAG_SEQUENCE)[1:])
+    oid = decode_oid(der[slice(*expect(algorithm[0], TAG_OID)[1:])])
+    _, key_start, key_end = expect(fields[2], TAG_OCTET_STRING)
+    return oid, key_start, key_end
+
+
+# Hash of the public key that goes with a private key, comparable with
+# public_key_hash() of a certificate. Covers RSA and EC keys in PKCS#8 and
+# in their traditional formats; other keys raise DecodeError.
+def private_key_hash(der, label=PEM_PKCS8_KEY, algorithm='sha256'):
+    if label == PEM_RSA_KEY:
+        return rsa_key_hash(der, 0, len(der), algorithm)
+    if label == PEM_EC_KEY:
+        return ec_key_hash(der, 0, algorithm)
+    if label != PEM_PKCS8_KEY:
+        raise DecodeError('Unsupported private key type: {}'.format(label))
+
+    oid, key_start, key_end = pkcs8_fields(der)
+    if oid == OID_RSA_ENCRYPTION:
+        return rsa_key_hash(der, key_start, key_end, algorithm)
+    if oid == OID_EC_PUBLIC_KEY:
+        return ec_key_hash(der, key_start, algorithm)
+    raise DecodeError('Unsupported private key algorithm: {}'.format(oid))
+
+
+# PKCS#8 PrivateKeyInfo, the only key format kept in the store
+def private_key_to_pkcs8(der, label=PEM_PKCS8_KEY):
+    if label == PEM_PKCS8_KEY:
+        return der
+
+    if label == PEM_RSA_KEY:
+        algorithm = RSA_ALGORITHM_DER
+    elif label == PEM_EC_KEY:
+        for tag, start, end in ec_private_key_fields(der, 0)[2:]:
+            if tag == 0xa0:
+                curve = der[start:end]
+                break
+        else:
+            raise DecodeError('EC private key without curve parameters')
+        algorithm = encode_tlv(TAG_SEQUENCE, EC_PUBLIC_KEY_OID_DER + curve)
+    else:
+        raise DecodeError('Unsupported private key type: {}'.format(label))
+
+    return encode_tlv(TAG_SEQUENCE, encode_tlv(TAG_INTEGER, b'\x00') + algorithm
+                      + encode_tlv(TAG_OCTET_STRING, der))
@@ -1,9 +1,15 @@
 #!/usr/bin/env python3
 
-import os, sys, argparse
+import os, sys, json, time, sqlite3, argparse, tempfile
+from datetime import datetime, timezone
 
 from certman import *
 
+TREE_JOBS = 8
+
+# writable indexes go back to a rollback journal when the command ends
+OPEN_INDEXES = []
+
 def command_line_add_common_request_args(cmd_parser):
     cmd_parser.add_argument("-c", "--common-name", "--cn",
                             help="set Common Name (CN) field of the Distinguished Name (DN), "
@@ -22,15 +28,27 @@ def command_line_add_common_request_args(cmd_parser):
                             help="set Country (C) field of the DN")
     cmd_parser.add_argument("-E", "--email",
                             help="set emailAddress field of the DN")
+    command_line_add_common_key_args(cmd_parser)
+
+
+def command_line_add_common_key_args(cmd_parser):
     cmd_parser.add_argument("-b", "--bits", metavar='N',
                             help="use key of N bits long, N = 2048 or 4096 (default)",
                             type=int, choices=(2048, 4096), default=4096)
+    cmd_parser.add_argument("--key-type", choices=('rsa', 'ec', 'ed25519'), default='rsa',
+                            help="key algorithm, RSA (default), elliptic curve or Ed25519; "
+                                 "EC and Ed25519 keys are generated almost instantly")
+    cmd_parser.add_argument("--curve", choices=('P-256', 'P-384', 'P-521'), default='P-256',
+                            help="curve for EC keys, default is P-256")
     cmd_parser.add_argument("-H", "--hash",
                             help="use specified hash algorithm, either sha256 or sha512 (default)",
                             choices=('sha256', 'sha512'), default='sha512')
     cmd_parser.add_argument("-d", "--days",
                             help="set certificate validity period in days, default is 3650",
                             type=int, default=3650)
+    cmd_parser.add_argument("--random-serial", action='store_true',
+                            help="give CA-signed certificates random 128-bit serial numbers "
+                                 "instead of the next number from the CA's counter")
 
 
 def certificate_path_type(path):
@@ -48,13 +66,41 @@ def certificate_path_type(path):
 def command_line_add_common_get_args(cmd_parser):
     cmd_parser.add_argument("-c", "--cert", help="extract certificate", action='store_true')
     cmd_parser.add_argument("-k", "--key", help="extract private key", action='store_true')
-    cmd_parser.add_argument("-r", "--rsa-key", help="extract RSA private key", action='store_true')
+    cmd_parser.add_argument("-r", "--rsa-key", help="extract RSA private key in the traditional format, "
+                                                    "RSA keys only", action='store_true')
+    cmd_parser.add_argument("--chain", action='store_true',
+                            help="extract the issuing CA certificates, nearest first, "
+                                 "without the certificate itself")
+    cmd_parser.add_argument("--fullchain", action='store_true',
+                            help="extract the certificate followed by its issuing CA certificates")
+    cmd_parser.add_argument("-A", "--artifact", choices=ARTIFACTS,
+                            help="extract a derived file, produced on first use and cached in the "
+                                 "store: rsa, der, p12 (no password), chain or fullchain")
 
 
 def command_line_parser():
     parser = argparse.ArgumentParser(description="Simple file-based certificate tree manager")
     parser.add_argument("-s", "--store",
                         help="certificate store path, current directory by default")
+    parser.add_argument("-e", "--engine", choices=('spawn', 'persistent'), default='spawn',
+                        help="how to run openssl: a new process per operation (default) "
+                             "or a pool of long-lived interactive openssl processes, "
+                             "falling back to spawning if the binary has no interactive mode")
+    parser.add_argument("--engine-workers", metavar="N", type=int,
+                        help="number of persistent openssl processes, default is 2")
+    parser.add_argument("-p", "--parser", choices=(PARSER_NATIVE, PARSER_OPENSSL), default=PARSER_NATIVE,
+                        help="how to read certificate fields: the built-in decoder (default), "
+                             "which falls back to openssl for unsupported certificates, "
+                             "or always openssl")
+    parser.add_argument("--no-index", action='store_true',
+                        help="do not use or update the certificate metadata index")
+    parser.add_argument("--no-sync", action='store_true',
+                        help="do not fsync written certificates and keys, faster but not "
+                             "crash-safe; files are still replaced atomically")
+    parser.add_argument("--trace", metavar="FILE",
+                        help="record timings of openssl runs and store I/O to FILE")
+    parser.add_argument("--trace-format", choices=(TRACE_JSONL, TRACE_CHROME), default=TRACE_JSONL,
+                        help="JSON lines (default) or Chrome trace events for chrome://tracing")
     subparsers = parser.add_subparsers(description="Utility commands", dest="command")
 
     cert_parser = subparsers.add_parser("cert", help="create new server/client certificate")
@@ -101,12 +147,267 @@ def command_line_parser():
                                       "certificate (alternative to -s option)")
 
     get_tree_parser = subparsers.add_parser("tree", help="list all certificates in the store")
+    get_tree_parser.add_argument("-D", "--depth", metavar="N", type=int,
+                                 help="only list N levels below the top, 0 lists just the CAs "
+                                      "at the top; deeper levels are not read at all")
+    get_tree_parser.add_argument("-f", "--format", choices=('text', 'jsonl'), default='text',
+                                 help="indented subjects (default) or one JSON object per "
+                                      "certificate with its subject, issuer, SHA-256 "
+                                      "fingerprint, expiry and path")
+    get_tree_parser.add_argument("basename", metavar="CA_NAME", nargs='?',
+                                 help="only list this CA and the certificates below it")
+
+    expiring_parser = subparsers.add_parser("expiring",
+                                            help="list certificates expiring soon, soonest first")
+    expiring_parser.add_argument("-w", "--within", metavar="DURATION", default="30d",
+                                 help="how far ahead to look, e.g. 30d, 12h, 2w or 1w3d, "
+                                      "a bare number is days, default is 30d; "
+                                      "expired certificates are always listed")
+    expiring_parser.add_argument("-a", "--ca", metavar="CA_NAME", action="append",
+                                 help="only this CA and the certificates it signed, "
+                                      "can be specified several times")
+    expiring_parser.add_argument("-f", "--format", choices=('text', 'json'), default='text',
+                                 help="one line of text (default) or one JSON object per certificate")
+
+    cert_batch_parser = subparsers.add_parser("cert-batch",
+                                              help="create many certificates listed in a manifest")
+    command_line_add_common_key_args(cert_batch_parser)
+    cert_batch_parser.add_argument("-a", "--ca", metavar="CA_NAME",
+                                   help="default signing CA for entries that do not specify one "
+                                        "(the default is to create self-signed certificates)")
+    cert_batch_parser.add_argument("-j", "--jobs", metavar="N", type=int,
+                                   help="number of worker processes, "
+                                        "the number of CPUs by default")
+    cert_batch_parser.add_argument("-f", "--format", choices=('json', 'csv'),
+                                   help="manifest format, guessed from the file extension by default")
+    cert_batch_parser.add_argument("manifest", metavar="MANIFEST",
+                                   help="JSON list of objects or CSV file with a header; "
+                                        "recognized fields are name, ca, common_name, "
+                                        "organization_unit, organization, locality, state, "
+                                        "country, email, names, bits, days, hash, "
+                                        "key_type and curve")
+
+    renew_parser = subparsers.add_parser("renew",
+                                         help="sign certificates again with their existing keys")
+    renew_parser.add_argument("-a", "--ca", metavar="CA_NAME",
+                              help="parent CA of the named certificates; with no names and no "
+                                   "--expiring, every certificate signed by this CA is renewed")
+    renew_parser.add_argument("-s", "--self-signed", action='store_true',
+                              help="the named certificates are self-signed")
+    renew_parser.add_argument("-A", "--ca-cert", metavar="CA_NAME", action="append",
+                              help="renew a CA certificate, can be specified several times")
+    renew_parser.add_argument("-w", "--expiring", metavar="DURATION",
+                              help="renew every certificate, CA certificates included, that "
+                                   "expires within DURATION (e.g. 30d), only those of -a CA "
+                                   "if given; expired certificates are renewed too")
+    renew_parser.add_argument("-d", "--days",
+                              help="new validity period in days, default is 3650",
+                              type=int, default=3650)
+    renew_parser.add_argument("-H", "--hash",
+                              help="use specified hash algorithm, either sha256 or sha512 (default)",
+                              choices=('sha256', 'sha512'), default='sha512')
+    renew_parser.add_argument("-j", "--jobs", metavar="N", type=int,
+                              help="number of certificates signed in parallel, default is 8")
+    renew_parser.add_argument("--random-serial", action='store_true',
+                              help="give CA-signed certificates random 128-bit serial numbers "
+                                   "instead of the next number from the CA's counter")
+    renew_parser.add_argument("paths", metavar="[[CA_NAME]/]NAME", nargs='*',
+                              type=certificate_path_type,
+                              help="certificates to renew, named as in get-cert")
+
+    revoke_parser = subparsers.add_parser("revoke", help="revoke certificates signed by a CA")
+    revoke_parser.add_argument("-a", "--ca", metavar="CA_NAME", required=True,
+                               help="the CA that signed the certificates")
+    revoke_parser.add_argument("--serial", metavar="HEX", action="append",
+                               help="revoke a serial number, can be specified several times")
+    revoke_parser.add_argument("-f", "--serials-file", metavar="FILE",
+                               help="revoke the serial numbers listed in FILE, one per line, "
+                                    "'-' reads them from standard input")
+    revoke_parser.add_argument("-R", "--reason", choices=REASONS,
+                               help="revocation reason recorded in the CRL")
+    revoke_parser.add_argument("names", metavar="NAME", nargs='*',
+                               help="names of certificates in the store to revoke")
+
+    crl_parser = subparsers.add_parser("crl", help="generate a certificate revocation list for a CA")
+    crl_type = crl_parser.add_mutually_exclusive_group()
+    crl_type.add_argument("--full", action='store_true',
+                          help="generate a full CRL, the base of later delta CRLs")
+    crl_type.add_argument("--delta", action='store_true',
+                          help="generate a delta CRL with the revocations since the last full CRL")
+    crl_parser.add_argument("-d", "--days", type=int, default=7,
+                            help="days until the next CRL update, default is 7")
+    crl_parser.add_argument("--max-delta", metavar="N", type=int, default=1000,
+                            help="without --full or --delta, generate a full CRL once a delta "
+                                 "CRL would list more than N revocations, default is 1000")
+    crl_parser.add_argument("basename", metavar="CA_NAME", help="a name of the CA certificate")
+
+    keypool_parser = subparsers.add_parser("keypool", help="manage the pool of pre-generated keys")
+    keypool_subparsers = keypool_parser.add_subparsers(dest="keypool_command")
+    keypool_fill_parser = keypool_subparsers.add_parser("fill", help="generate keys into the pool")
+    keypool_fill_parser.add_argument("-b", "--bits", metavar='N',
+                                     help="generate keys of N bits long, N = 2048 or 4096 (default)",
+                                     type=int, choices=(2048, 4096), default=4096)
+    keypool_fill_count = keypool_fill_parser.add_mutually_exclusive_group(required=True)
+    keypool_fill_count.add_argument("-n", "--count", metavar="N", type=int,
+                                    help="add N new keys to the pool")
+    keypool_fill_count.add_argument("-k", "--keep", metavar="N", type=int,
+                                    help="top the pool up to N ready keys")
+    keypool_fill_parser.add_argument("-i", "--interval", metavar="SECONDS", type=float,
+                                     help="with --keep, keep running and top the pool up "
+                                          "every SECONDS seconds")
+    keypool_fill_parser.add_argument("-j", "--jobs", metavar="N", type=int,
+                                     help="number of worker processes, "
+                                          "the number of CPUs by default")
+    keypool_subparsers.add_parser("status", help="show the number of ready keys")
+
+    serve_parser = subparsers.add_parser("serve",
+                                         help="run a daemon answering issue, get-cert, get-ca "
+                                              "and tree requests over HTTP")
+    serve_parser.add_argument("-u", "--socket", metavar="PATH",
+                              help="listen on a Unix socket instead of TCP")
+    serve_parser.add_argument("-l", "--listen", metavar="HOST", default="127.0.0.1",
+                              help="TCP address to listen on, default is 127.0.0.1")
+    serve_parser.add_argument("-P", "--port", type=int, default=8080,
+                              help="TCP port to listen on, default is 8080")
+    serve_parser.add_argument("-w", "--workers", metavar="N", type=int, default=4,
+                              help="number of requests processed at once, default is 4")
+    serve_parser.add_argument("-q", "--queue", metavar="N", type=int, default=64,
+                              help="number of requests allowed to wait, further requests are "
+                                   "refused with 503 until the queue drains, default is 64")
+    serve_parser.add_argument("--allow-private-keys", action='store_true',
+                              help="return private keys from get-cert and get-ca with key=1 and "
+                                   "with issued certificates; keys are sent unencrypted and "
+                                   "unauthenticated to anyone who can connect, so this is only "
+                                   "accepted on a Unix socket or a loopback address")
+    serve_parser.add_argument("-v", "--verbose", action='store_true', help="log every request")
+
+    ocsp_parser = subparsers.add_parser("ocsp-serve",
+                                        help="run an OCSP responder for the CAs in the store")
+    ocsp_parser.add_argument("-a", "--ca", metavar="CA_NAME", action="append",
+                             help="answer for this CA only, can be specified several times, "
+                                  "all CAs by default")
+    ocsp_parser.add_argument("-u", "--socket", metavar="PATH",
+                             help="listen on a Unix socket instead of TCP")
+    ocsp_parser.add_argument("-l", "--listen", metavar="HOST", default="127.0.0.1",
+                             help="TCP address to listen on, default is 127.0.0.1")
+    ocsp_parser.add_argument("-P", "--port", type=int, default=8081,
+                             help="TCP port to listen on, default is 8081")
+    ocsp_parser.add_argument("-m", "--minutes", type=int, default=24 * 60,
+                             help="validity of signed responses in minutes, they are signed "
+                                  "again when a quarter of it is left, default is 1440")
+    ocsp_parser.add_argument("-c", "--cache-size", metavar="N", type=int, default=20000,
+                             help="number of signed responses kept in memory, default is 20000")
+    ocsp_parser.add_argument("-j", "--jobs", metavar="N", type=int, default=8,
+                             help="number of responses signed at once, default is 8")
+    ocsp_parser.add_argument("-i", "--interval", metavar="SECONDS", type=float, default=60,
+                             help="how often to look for new certificates, revocations and "
+                                  "responses due for signing, default is 60")
+    ocsp_parser.add_argument("-v", "--verbose", action='store_true', help="log every request and refresh failures")
+
+    subparsers.add_parser("check-parser",
+                          help="compare the built-in certificate decoder with openssl "
+                               "on every certificate in the store")
+
+    reindex_parser = subparsers.add_parser("reindex", help="refresh the certificate metadata index")
+    reindex_parser.add_argument("-f", "--full", action='store_true',
+                                help="drop the index and parse every certificate again")
+
+    export_parser = subparsers.add_parser("export",
+                                          help="write the certificates of a CA as one bundle or archive")
+    export_source = export_parser.add_mutually_exclusive_group(required=True)
+    export_source.add_argument("-a", "--ca", metavar="CA_NAME",
+                               help="export certificates signed by this CA")
+    export_source.add_argument("-s", "--self-signed", action='store_true',
+                               help="export self-signed certificates")
+    export_parser.add_argument("-f", "--format", choices=EXPORT_FORMATS, default=EXPORT_PEM,
+                               help="concatenated PEM bundle (default), tar archive or "
+                                    "certs-only PKCS#7")
+    export_parser.add_argument("-m", "--match", metavar="PATTERN",
+                               help="only certificates whose name matches a shell-style wildcard")
+    export_parser.add_argument("-C", "--with-ca", action='store_true',
+                               help="include the CA certificate, first")
+    export_parser.add_argument("-k", "--keys", action='store_true',
+                               help="include private keys, tar only; the CA key is never exported")
+    export_parser.add_argument("-z", "--gzip", action='store_true', help="compress the tar archive")
+    export_parser.add_argument("--der", action='store_true', help="write PKCS#7 as DER instead of PEM")
+    export_parser.add_argument("-o", "--output", metavar="FILE",
+                               help="write to FILE, replaced once complete, instead of standard output")
+    export_parser.add_argument("names", metavar="NAME", nargs='*',
+                               help="certificates to export, all of them by default")
+
+    import_parser = subparsers.add_parser("import",
+                                          help="add existing certificates and keys from PEM bundles")
+    import_parser.add_argument("-j", "--jobs", metavar="N", type=int,
+                               help="number of openssl runs for keys that are neither RSA nor EC, "
+                                    "default is 8")
+    import_parser.add_argument("-n", "--dry-run", action='store_true',
+                               help="show where certificates would go without writing anything")
+    import_parser.add_argument("-v", "--verbose", action='store_true',
+                               help="print every certificate, not just failures")
+    import_parser.add_argument("files", metavar="FILE", nargs='+',
+                               help="PEM files with certificates and private keys in any order, "
+                                    "'-' reads standard input")
+
+    layout_parser = subparsers.add_parser("layout",
+                                          help="show the store layout or move leaves into shards")
+    layout_parser.add_argument("--shard", action='store_true',
+                               help="move the certificates signed by each CA into hashed "
+                                    "subdirectories; the store can be used meanwhile, an "
+                                    "interrupted move is resumed by running it again")
+    layout_parser.add_argument("--levels", metavar="N", type=int, default=1,
+                               help="shard directory levels, 256 directories each, default is 1")
+
+    artifacts_parser = subparsers.add_parser("artifacts",
+                                             help="precompute derived files for a CA and its certificates")
+    artifacts_parser.add_argument("-t", "--type", metavar="ARTIFACT", choices=ARTIFACTS, action='append',
+                                  help="artifact to build: rsa, der, p12, chain or fullchain, "
+                                       "can be specified several times, default is all of them")
+    artifacts_parser.add_argument("-s", "--self-signed", action='store_true',
+                                  help="process self-signed certificates instead of a CA")
+    artifacts_parser.add_argument("-j", "--jobs", metavar="N", type=int,
+                                  help="number of parallel jobs, default is 8")
+    artifacts_parser.add_argument("basename", metavar="CA_NAME", nargs='?',
+                                  help="a name of the CA certificate")
 
     return parser
 
 
 def create_store(args):
-    return Store(root_dir=args.store)
+    return Store(root_dir=args.store, durable=not args.no_sync)
+
+
+# reading commands only use an existing index, opened read-only; creating
+# it is left to reindex and the commands that write
+def attach_index(args, store, openssl, create=False, read_only=False):
+    if args.no_index:
+        return None
+
+    index = StoreIndex(store, openssl, read_only=read_only)
+    if not create and not os.path.exists(index.path):
+        return None
+
+    if read_only:
+        try:
+            index.db
+        except sqlite3.Error:
+            return None
+    else:
+        OPEN_INDEXES.append(index)
+
+    store.index = index
+    return index
+
+
+def close_indexes():
+    while OPEN_INDEXES:
+        OPEN_INDEXES.pop().close()
+
+
+def create_openssl(args):
+    if args.engine == 'persistent':
+        return OpenSSLPool(workers=args.engine_workers, parser=args.parser)
+
+    return OpenSSL(parser=args.parser)
 
 
 def build_request(args, is_ca=False):
@@ -126,33 +427,26 @@ def build_request(args, is_ca=False):
                    email_address=args.email)
 
     req = Request(dn, is_ca=is_ca, domain_names=domain_names,
-                  bits=args.bits, days=args.days, hash_algo=args.hash)
+                  bits=args.bits, days=args.days, hash_algo=args.hash,
+                  key_type=args.key_type, curve=args.curve)
 
     return req
 
 
 def create_cert(args, is_ca=False):
-    openssl = OpenSSL()
     store = create_store(args)
     req = build_request(args, is_ca=is_ca)
     if args.ca:
         ca_context = Context(args.ca, is_ca=True)
-        context = Context(args.basename, is_ca=is_ca, ca_context=ca_context)
-        ca_paths = store.get_context_paths(ca_context)
-        store.verify_exists(ca_context, paths=ca_paths, check_cert=True, check_key=True)
-        store.verify_exists(context, check_cert=True, check_key=True,
-                            check_rsa_key=True, check_req=True, inverted_check=True)
-        openssl.signed(context, req, ca_paths)
-
     else:
         ca_context = Store.self_signed_context()
-        context = Context(args.basename, is_ca=is_ca, ca_context=ca_context)
-        store.verify_exists(context, check_cert=True, check_key=True,
-                            check_rsa_key=True, check_req=True, inverted_check=True)
-        openssl.self_signed(context, req)
 
-    openssl.add_rsa_key(context)
-    store.store(context, with_request=bool(args.ca))
+    context = Context(args.basename, is_ca=is_ca, ca_context=ca_context)
+    verify_can_issue(store, context)
+    with create_openssl(args) as openssl:
+        attach_index(args, store, openssl)
+        issue_certificate(store, openssl, context, req, key_pool=KeyPool(store),
+                          serials=SerialAllocator(store, random=args.random_serial))
 
 
 def handle_cert(args):
@@ -163,6 +457,137 @@ def handle_ca(args):
     create_cert(args, is_ca=True)
 
 
+def handle_cert_batch(args):
+    store = create_store(args)
+    defaults = {
+        'ca': args.ca,
+        'bits': args.bits,
+        'days': args.days,
+        'hash': args.hash,
+        'key_type': args.key_type,
+        'curve': args.curve,
+    }
+    entries = load_manifest(args.manifest, manifest_format=args.format, defaults=defaults)
+
+    errors = validate_batch(store, entries)
+    if errors:
+        for result in errors:
+            print('{}: {}'.format(result.entry.description, result.error), file=sys.stderr)
+        raise Exception("Manifest validation failed for {} of {} entries, nothing was issued".format(
+            len(errors), len(entries)))
+
+    def report(result):
+        if result.error:
+            print('{}: FAILED: {}'.format(result.entry.description, result.error), file=sys.stderr)
+        else:
+            print('{}: issued'.format(result.entry.description))
+
+    with create_openssl(args) as openssl:
+        attach_index(args, store, openssl)
+        results = issue_batch(store, entries, openssl=openssl, key_pool=KeyPool(store),
+                              jobs=args.jobs, callback=report,
+                              serials=SerialAllocator(store, random=args.random_serial))
+    failed = sum(1 for result in results if result.error)
+
+    print('{} issued, {} failed, {} total'.format(len(results) - failed, failed, len(results)))
+    if failed:
+        raise Exception("{} of {} certificates were not issued".format(failed, len(results)))
+
+
+def renewal_contexts(args, store, openssl):
+    contexts = [ Context(basename, is_ca=True) for basename in args.ca_cert or [] ]
+
+    for ca_basename, basename in args.paths:
+        if args.ca:
+            ca_basename = args.ca
+        elif args.self_signed:
+            ca_basename = ''
+
+        if ca_basename is None:
+            raise Exception("No parent CA certificate name given for {}".format(basename))
+
+        if ca_basename:
+            ca_context = Context(ca_basename, is_ca=True)
+        else:
+            ca_context = Store.self_signed_context()
+        contexts.append(Context(basename, ca_context=ca_context))
+
+    if args.expiring:
+        index = store.index
+        expiring = find_expiring(store, index or openssl, parse_duration(args.expiring),
+                                 ca_basenames=[ args.ca ] if args.ca else None,
+                                 load_cert=not index, jobs=TREE_JOBS)
+        contexts.extend(cert.context for cert in expiring)
+    elif args.ca and not args.paths and not args.ca_cert:
+        ca_context = Context(args.ca, is_ca=True)
+        store.verify_exists(ca_context, check_cert=True)
+        contexts.extend(store.get_certs(ca_context, load_cert=False))
+
+    for context in contexts:
+        store.verify_exists(context, check_cert=True, check_key=True)
+
+    # the same certificate may be both named and expiring
+    unique = {}
+    for context in contexts:
+        ca_basename = context.ca_context.basename if context.ca_context else None
+        unique.setdefault((context.is_ca, ca_basename, context.basename), context)
+    return list(unique.values())
+
+
+def handle_renew(args):
+    store = create_store(args)
+
+    def report(result):
+        if result.error:
+            print('{}: FAILED: {}'.format(result.context.basename, result.error), file=sys.stderr)
+        else:
+            print('{}: renewed'.format(result.context.basename))
+
+    with create_openssl(args) as openssl:
+        attach_index(args, store, openssl)
+        contexts = renewal_contexts(args, store, openssl)
+        if not contexts:
+            if args.expiring:
+                print('0 renewed, 0 failed, 0 total')
+                return
+            raise Exception("Specify certificates to renew")
+
+        results = renew_many(store, openssl, contexts, days=args.days, hash_algo=args.hash,
+                             serials=SerialAllocator(store, random=args.random_serial),
+                             jobs=args.jobs, callback=report)
+    failed = sum(1 for result in results if result.error)
+
+    print('{} renewed, {} failed, {} total'.format(len(results) - failed, failed, len(results)))
+    if failed:
+        raise Exception("{} of {} certificates were not renewed".format(failed, len(results)))
+
+
+def handle_keypool(args):
+    key_pool = KeyPool(create_store(args))
+
+    if args.keypool_command == 'fill':
+        if args.interval and not args.keep:
+            raise Exception("--interval requires --keep")
+
+        with create_openssl(args) as openssl:
+            if args.count:
+                key_pool.fill(args.bits, args.count, openssl=openssl, jobs=args.jobs)
+                return
+
+            while True:
+                key_pool.top_up(args.bits, args.keep, openssl=openssl, jobs=args.jobs)
+                if not args.interval:
+                    return
+                time.sleep(args.interval)
+
+    elif args.keypool_command == 'status':
+        for bits, count in key_pool.status():
+            print('rsa-{}: {} keys'.format(bits, count))
+
+    else:
+        raise Exception("Specify a keypool command: fill or status")
+
+
 def print_fenced_text(text):
     if not text:
         return
@@ -171,15 +596,32 @@ def print_fenced_text(text):
 
 
 def write_context(args, context):
-    if not args.cert and not args.key and not args.rsa_key:
+    if (not args.cert and not args.key and not args.rsa_key and not args.artifact
+            and not args.chain and not args.fullchain):
         raise Exception("Specify at least one part to retrieve")
 
     store = create_store(args)
-    store.load_context(context, load_cert=args.cert, load_key=args.key,
-                       load_rsa_key=args.rsa_key)
+    store.load_context(context, load_cert=args.cert, load_key=args.key)
     print_fenced_text(context.certificate)
     print_fenced_text(context.private_key)
-    print_fenced_text(context.rsa_private_key)
+
+    if not args.rsa_key and not args.artifact and not args.chain and not args.fullchain:
+        return
+
+    with create_openssl(args) as openssl:
+        attach_index(args, store, openssl, read_only=True)
+        artifacts = ArtifactCache(store, openssl)
+        if args.rsa_key:
+            print_fenced_text(artifacts.get_text(context, 'rsa'))
+        # chains are cached beside the certificate like any other artifact
+        if args.chain:
+            print_fenced_text(artifacts.get_text(context, 'chain'))
+        if args.fullchain:
+            print_fenced_text(artifacts.get_text(context, 'fullchain'))
+        if args.artifact:
+            content = artifacts.get(context, args.artifact)
+            sys.stdout.flush()
+            sys.stdout.buffer.write(content)
 
 
 def handle_get_ca(args):
@@ -206,75 +648,389 @@ def handle_get_cert(args):
     write_context(args, context)
 
 
-def handle_tree(args):
-    openssl = OpenSSL()
+def handle_artifacts(args):
+    if args.self_signed:
+        ca_context = Store.self_signed_context()
+    elif args.basename:
+        ca_context = Context(args.basename, is_ca=True)
+    else:
+        raise Exception("Specify a CA name or --self-signed")
+
     store = create_store(args)
-    root_cas = []
-    ca_map = {}
-    virtual_ca_map = {}
-
-    for ca_context in store.get_ca_certs():
-        cert_info = openssl.get_info(ca_context)
-        ca_map[cert_info.subject] = (cert_info, [], ca_context)
-
-    for record in ca_map.values():
-        issuer = record[0].issuer
-        if issuer == record[0].subject:
-            root_cas.append((issuer,) + record)
-            continue
+    if not args.self_signed:
+        store.verify_exists(ca_context, check_cert=True)
 
-        parent_record = ca_map.get(issuer, None)
-        if parent_record:
-            parent_record[1].append(record)
-            continue
+    built = skipped = failed = 0
+    with create_openssl(args) as openssl:
+        artifacts = ArtifactCache(store, openssl)
+        for context, name, error in artifacts.precompute(ca_context, names=args.type or ARTIFACTS,
+                                                         jobs=args.jobs,
+                                                         include_ca=not args.self_signed):
+            if isinstance(error, NotApplicable):
+                skipped += 1
+            elif error:
+                failed += 1
+                print('{} {}: {}'.format(context.basename, name, error), file=sys.stderr)
+            else:
+                built += 1
 
-        virtual_parent_record = virtual_ca_map.get(issuer, None)
-        if not virtual_parent_record:
-            virtual_parent_record = (None, [], None)
-            virtual_ca_map[issuer] = virtual_parent_record
-            root_cas.append((issuer,) + virtual_parent_record)
+    print('{} artifacts ready, {} not applicable, {} failed'.format(built, skipped, failed))
+    if failed:
+        raise Exception("{} artifacts could not be built".format(failed))
 
-        virtual_parent_record[1].append(record)
 
-    for subject, info, cas, certs in sorted(root_cas, key=(lambda r: r[0])):
-        cert_tree_level(openssl, store, subject, info, cas, certs)
+def read_serials(path):
+    if path == '-':
+        return [ line.strip() for line in sys.stdin if line.strip() ]
 
+    with open(path, 'rt') as fd:
+        return [ line.strip() for line in fd if line.strip() ]
+
+
+def handle_revoke(args):
+    store = create_store(args)
+    ca_context = Context(args.ca, is_ca=True)
+    store.verify_exists(ca_context, check_cert=True)
 
-def cert_tree_level(openssl, store, subject, info, cas, context, indent=''):
-    if info:
-        print('{}* {}:'.format(indent, subject))
+    serials = [ (serial, None) for serial in args.serial or [] ]
+    if args.serials_file:
+        serials.extend((serial, None) for serial in read_serials(args.serials_file))
+
+    if args.names:
+        with create_openssl(args) as openssl:
+            contexts = [ store.load_context(Context(name, ca_context=ca_context), load_cert=True)
+                         for name in args.names ]
+            serials.extend((info.serial, info.subject)
+                           for info in openssl.get_info_many(contexts))
+
+    if not serials:
+        raise Exception("Specify certificates or serial numbers to revoke")
+
+    revoked = RevocationList(store, ca_context).revoke_many(serials, reason=args.reason)
+    print('{} revoked, {} already revoked'.format(len(revoked), len(serials) - len(revoked)))
+
+
+def handle_crl(args):
+    store = create_store(args)
+    ca_context = Context(args.basename, is_ca=True)
+    store.verify_exists(ca_context, check_cert=True, check_key=True)
+
+    delta = True if args.delta else False if args.full else None
+    with create_openssl(args) as openssl:
+        crl, _ = RevocationList(store, ca_context).generate_crl(
+                openssl, delta=delta, days=args.days, max_delta=args.max_delta)
+
+    print_fenced_text(crl)
+
+
+def handle_serve(args):
+    store = create_store(args)
+    with create_openssl(args) as openssl:
+        attach_index(args, store, openssl, create=True)
+        service = CertificateService(store, openssl, key_pool=KeyPool(store),
+                                     workers=args.workers, queue_size=args.queue)
+        server = make_server(service, socket_path=args.socket,
+                             host=args.listen, port=args.port, verbose=args.verbose,
+                             allow_private_keys=args.allow_private_keys)
+        service.start()
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+            service.stop()
+
+
+def handle_ocsp_serve(args):
+    store = create_store(args)
+    with create_openssl(args) as openssl:
+        attach_index(args, store, openssl)
+        responder = OCSPResponder(store, openssl, ca_basenames=args.ca, minutes=args.minutes,
+                                  cache_size=args.cache_size, jobs=args.jobs,
+                                  check_interval=args.interval, verbose=args.verbose)
+        server = make_ocsp_server(responder, socket_path=args.socket,
+                                  host=args.listen, port=args.port, verbose=args.verbose)
+        responder.start()
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+            responder.stop()
+
+
+def handle_check_parser(args):
+    store = create_store(args)
+    checked = 0
+    mismatched = 0
+
+    def contexts():
+        for ca_context in store.get_ca_certs():
+            yield ca_context
+            yield from store.get_certs(ca_context)
+        yield from store.get_certs(store.self_signed_context())
+
+    with create_openssl(args) as openssl:
+        for context in contexts():
+            checked += 1
+            path = store.get_context_paths(context).cert
+            try:
+                native = parse_pem(context.require_certificate)
+            except DecodeError as e:
+                print('{}: not supported by the built-in decoder: {}'.format(path, e))
+                continue
+
+            differences = native.differences(openssl.get_info_openssl(context))
+            if differences:
+                mismatched += 1
+                print('{}: {} differ'.format(path, ', '.join(differences)))
+
+    print('{} certificates checked, {} mismatched'.format(checked, mismatched))
+    if mismatched:
+        raise Exception("The built-in decoder disagrees with openssl")
+
+
+def handle_reindex(args):
+    if args.no_index:
+        raise Exception("--no-index cannot be used with reindex")
+
+    store = create_store(args)
+    with create_openssl(args) as openssl:
+        index = attach_index(args, store, openssl, create=True)
+        count = index.reindex(full=args.full)
+
+    print('{} certificates indexed'.format(count))
+
+
+def handle_export(args):
+    store = create_store(args)
+    if args.self_signed:
+        ca_context = Store.self_signed_context()
     else:
-        print('{}* [{}]:'.format(indent, subject))
+        ca_context = Context(args.ca, is_ca=True)
+        store.verify_exists(ca_context, check_cert=True)
+
+    contexts = select_certs(store, ca_context, names=args.names, pattern=args.match)
 
-    for info, inner_cas, inner_certs in cas:
-        cert_tree_level(openssl, store, info.subject, info, inner_cas, inner_certs, indent=(indent + '  '))
+    def export(out):
+        with create_openssl(args) as openssl:
+            return export_certs(store, openssl, ca_context, contexts, out,
+                                export_format=args.format, with_ca=args.with_ca,
+                                with_keys=args.keys, gzip=args.gzip, der=args.der)
 
-    if not context:
+    if not args.output:
+        export(sys.stdout.buffer)
         return
 
-    for cert_ctx in store.get_certs(context):
-        info = openssl.get_info(cert_ctx)
-        print('{}  - {}'.format(indent, info.subject))
+    # written beside the target and renamed over it, readers never see half a bundle
+    fd, staging_path = tempfile.mkstemp(prefix='.export-', dir=os.path.dirname(os.path.abspath(args.output)))
+    try:
+        with open(fd, 'wb') as out:
+            count = export(out)
+        if not args.keys:
+            os.chmod(staging_path, 0o644 & ~current_umask())
+        os.rename(staging_path, args.output)
+    except BaseException:
+        os.unlink(staging_path)
+        raise
+
+    print('{} certificates exported'.format(count))
+
+
+def current_umask():
+    umask = os.umask(0)
+    os.umask(umask)
+    return umask
+
+
+def handle_import(args):
+    store = create_store(args)
+
+    def report(result):
+        path = '{}/{}'.format(result.ca_name, result.name) if result.ca_name else result.name
+        if result.status == FAILED:
+            print('{}: FAILED: {}'.format(path, result.error), file=sys.stderr)
+        elif args.verbose:
+            print('{}: {}'.format(path, result.status))
+
+    with create_openssl(args) as openssl:
+        attach_index(args, store, openssl)
+        with PEMImporter(store, openssl, jobs=args.jobs, callback=report) as importer:
+            results = importer.run(args.files, dry_run=args.dry_run)
+            skipped = importer.skipped
+
+    counts = dict((status, 0) for status in (IMPORTED, EXISTS, FAILED))
+    for result in results:
+        counts[result.status] += 1
+
+    print('{} {}, {} already in the store, {} failed, {} other objects skipped'.format(
+        counts[IMPORTED], 'to import' if args.dry_run else 'imported', counts[EXISTS],
+        counts[FAILED], skipped))
+    if counts[FAILED]:
+        raise Exception("{} certificates were not imported".format(counts[FAILED]))
+
+
+def handle_layout(args):
+    store = create_store(args)
+    if args.shard:
+        with create_openssl(args) as openssl:
+            attach_index(args, store, openssl)
+            moved = store.migrate(shard_levels=args.levels)
+        print('{} certificates moved'.format(moved))
+
+    store_format = store.format(fresh=True)
+    if not store_format.shard_levels:
+        print(store_format.layout)
+    else:
+        print('{}, {} levels{}'.format(store_format.layout, store_format.shard_levels,
+                                       ', migration in progress' if store_format.migrating else ''))
 
 
+def describe_expiring(cert):
+    context = cert.context
+    if context.is_ca:
+        ca_basename = None
+    elif context.ca_context.basename == Store.SELF_SIGNED_SUBDIR:
+        ca_basename = ''
+    else:
+        ca_basename = context.ca_context.basename
+
+    return {
+        'name': context.basename,
+        'ca': ca_basename,
+        'is_ca': context.is_ca,
+        'subject': cert.certinfo.subject,
+        'serial': cert.certinfo.serial,
+        'not_after': cert.not_after.strftime('%Y-%m-%dT%H:%M:%SZ'),
+    }
+
+
+def handle_expiring(args):
+    within = parse_duration(args.within)
+    store = create_store(args)
+    with create_openssl(args) as openssl:
+        index = attach_index(args, store, openssl, read_only=True)
+        expiring = find_expiring(store, index or openssl, within, ca_basenames=args.ca,
+                                 load_cert=not index, jobs=TREE_JOBS)
+
+    now = datetime.now(timezone.utc)
+    for cert in expiring:
+        record = describe_expiring(cert)
+        if args.format == 'json':
+            record['expired'] = cert.not_after <= now
+            print(json.dumps(record))
+            continue
+
+        if record['is_ca']:
+            path = '{} (CA)'.format(record['name'])
+        else:
+            path = '{}/{}'.format(record['ca'], record['name'])
+        status = 'expired' if cert.not_after <= now else '{}d left'.format((cert.not_after - now).days)
+        print('{}  {:>10}  {}  {}'.format(record['not_after'], status, path, record['subject']))
+
+
+def handle_tree(args):
+    store = create_store(args)
+    with create_openssl(args) as openssl:
+        # StoreIndex.get_info() is a drop-in for OpenSSL.get_info()
+        index = attach_index(args, store, openssl, read_only=True)
+        list_tree(index or openssl, store, load_cert=not index, ca_basename=args.basename,
+                  depth=args.depth, output_format=args.format)
+
+
+def describe_tree_node(store, node):
+    record = {
+        'type': node.kind,
+        'depth': node.depth,
+        'subject': node.subject,
+    }
+    if node.context is None:
+        return record
+
+    record['name'] = node.context.basename
+    if node.ca_context:
+        record['ca'] = node.ca_context.basename
+    record['path'] = os.path.relpath(store.get_context_paths(node.context).cert, store.root_dir)
+    record['issuer'] = node.certinfo.issuer
+    record['serial'] = node.certinfo.serial
+    record['fingerprint'] = node.certinfo.fingerprint_sha256
+    not_after = node.certinfo.not_after
+    record['not_after'] = not_after.strftime('%Y-%m-%dT%H:%M:%SZ') if not_after else None
+    return record
+
+
+def list_tree(openssl, store, load_cert=True, ca_basename=None, depth=None, output_format='text'):
+    for node in walk_tree(store, openssl, ca_basename=ca_basename, depth=depth,
+                          load_cert=load_cert, jobs=TREE_JOBS):
+        if output_format == 'jsonl':
+            print(json.dumps(describe_tree_node(store, node)))
+            continue
+
+        indent = '  ' * node.depth
+        if node.kind == NODE_CERT:
+            print('{}- {}'.format(indent, node.subject))
+        elif node.kind == NODE_CA:
+            print('{}* {}:'.format(indent, node.subject))
+        else:
+            print('{}* [{}]:'.format(indent, node.subject))
+
+
+def handle_command(parser, args):
+    if args.command == 'ca':
+        handle_ca(args)
+    elif args.command == 'cert':
+        handle_cert(args)
+    elif args.command == 'get-ca':
+        handle_get_ca(args)
+    elif args.command == 'get-cert':
+        handle_get_cert(args)
+    elif args.command == 'tree':
+        handle_tree(args)
+    elif args.command == 'expiring':
+        handle_expiring(args)
+    elif args.command == 'cert-batch':
+        handle_cert_batch(args)
+    elif args.command == 'renew':
+        handle_renew(args)
+    elif args.command == 'revoke':
+        handle_revoke(args)
+    elif args.command == 'crl':
+        handle_crl(args)
+    elif args.command == 'keypool':
+        handle_keypool(args)
+    elif args.command == 'reindex':
+        handle_reindex(args)
+    elif args.command == 'check-parser':
+        handle_check_parser(args)
+    elif args.command == 'serve':
+        handle_serve(args)
+    elif args.command == 'ocsp-serve':
+        handle_ocsp_serve(args)
+    elif args.command == 'export':
+        handle_export(args)
+    elif args.command == 'import':
+        handle_import(args)
+    elif args.command == 'layout':
+        handle_layout(args)
+    elif args.command == 'artifacts':
+        handle_artifacts(args)
+    else:
+        parser.print_usage()
+        sys.exit(127)
+
 def main():
     parser = command_line_parser()
     args = parser.parse_args()
+    trace = None
 
     try:
-        if args.command == 'ca':
-            handle_ca(args)
-        elif args.command == 'cert':
-            handle_cert(args)
-        elif args.command == 'get-ca':
-            handle_get_ca(args)
-        elif args.command == 'get-cert':
-            handle_get_cert(args)
-        elif args.command == 'tree':
-            handle_tree(args)
-        else:
-            parser.print_usage()
-            sys.exit(127)
+        if args.trace:
+            trace = open_trace(args.trace, args.trace_format)
+
+        with trace_span('command', args.command or 'none'):
+            handle_command(parser, args)
 
         clean_temp_files()
 
@@ -283,5 +1039,10 @@ def main():
         print(str(e), file=sys.stderr)
         sys.exit(1)
 
+    finally:
+        close_indexes()
+        if trace:
+            trace.close()
+
 if __name__ == '__main__':
     main()
@@ -0,0 +1,42 @@
+import os
+import sys
+import subprocess
+
+import pytest
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MAIN = os.path.join(ROOT_DIR, 'main.py')
+
+sys.path.insert(0, ROOT_DIR)
+
+from certman import Store, OpenSSL, Context
+
+# runs the command line tool on a store, returns its standard output
+def certman(store_dir, *args, check=True, input=None):
+    result = subprocess.run([ sys.executable, MAIN, '-s', str(store_dir), '--no-sync' ] + list(args),
+                            input=input, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                            universal_newlines=True)
+    if check and result.returncode:
+        raise AssertionError('certman {} failed: {}'.format(' '.join(args), result.stderr))
+    return result
+
+# a store with an EC root CA
+@pytest.fixture
+def store_dir(tmp_path):
+    certman(tmp_path, 'ca', '--key-type', 'ec', 'root')
+    return tmp_path
+
+@pytest.fixture
+def store(store_dir):
+    store = Store(str(store_dir), durable=False)
+    yield store
+    store.close()
+
+@pytest.fixture
+def openssl():
+    with OpenSSL() as openssl:
+        yield openssl
+
+@pytest.fixture
+def root_context():
+    return Context('root', is_ca=True)
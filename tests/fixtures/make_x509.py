@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+
+# Writes the certificates test_x509.py compares the built-in decoder with
+# openssl on. They are committed; run this again only to add cases:
+#   python3 tests/fixtures/make_x509.py
+
+import os
+import sys
+import subprocess
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+
+from certman.cfg import Config, quote_value
+
+OUTPUT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'x509')
+
+# name: (DN entries, string mask, extensions, serial, days)
+CASES = {
+    'dn-escaping': ([ ('O', 'Acme, Inc'), ('OU', 'R+D'), ('OU', 'say "hi"'), ('OU', 'back\\slash'),
+                      ('L', '#hash first'), ('ST', ' space first'), ('street', 'space last '),
+                      ('CN', 'semi;colon <angle> =equals') ],
+                    'utf8only', [], '1', 3650),
+    'multi-valued-rdn': ([ ('O', 'Acme'), ('OU', 'One'), ('+CN', 'multi.example'),
+                           ('+emailAddress', 'admin@example.com') ],
+                         'utf8only', [], '2', 3650),
+    'utf8-string': ([ ('O', 'Ünïcode Org'), ('L', 'Zürich'), ('CN', 'ユニコード.example') ],
+                    'utf8only', [], '3', 3650),
+    'bmp-string': ([ ('O', 'Ωmega Org'), ('CN', 'bmp.example') ], 'default', [], '4', 3650),
+    't61-string': ([ ('O', 'Café Org'), ('CN', 't61.example') ], 'default', [], '5', 3650),
+    'printable-string': ([ ('C', 'GB'), ('O', 'Plain Org'), ('CN', 'plain.example') ],
+                         'nombstr', [], '6', 3650),
+    'san-kinds': ([ ('CN', 'sans.example') ], 'utf8only',
+                  [ ('subjectAltName', 'DNS:sans.example, DNS:*.sans.example, IP:192.0.2.1, '
+                                       'IP:2001:db8::1, URI:https://sans.example/path?q=1, '
+                                       'email:admin@sans.example, dirName:dir_sect') ],
+                  '7', 3650),
+    'generalized-time': ([ ('CN', 'far.example') ], 'utf8only', [], '8', 365 * 40),
+    'critical-extensions': ([ ('CN', 'critical.example') ], 'utf8only',
+                            [ ('basicConstraints', 'critical, CA:TRUE, pathlen:0'),
+                              ('keyUsage', 'critical, keyCertSign, cRLSign, digitalSignature'),
+                              ('extendedKeyUsage', 'critical, serverAuth, clientAuth, codeSigning'),
+                              ('1.3.6.1.4.1.99999.1', 'critical, ASN1:UTF8String:unknown critical'),
+                              ('1.3.6.1.4.1.99999.2', 'ASN1:INTEGER:42') ],
+                            '9', 3650),
+    'negative-serial': ([ ('CN', 'negative.example') ], 'utf8only', [], '-0x1234', 3650),
+    'zero-serial': ([ ('CN', 'zero.example') ], 'utf8only', [], '0', 3650),
+    'padded-serial': ([ ('CN', 'padded.example') ], 'utf8only', [], '0x80FF00', 3650),
+    'long-serial': ([ ('CN', 'long.example') ], 'utf8only', [],
+                    '0x00F1E2D3C4B5A69788796A5B4C3D2E1F', 3650),
+}
+
+DIR_SECTION = [ ('C', 'GB'), ('O', 'Dir, Org'), ('CN', 'dir.example') ]
+
+def make_config(entries, string_mask, extensions):
+    config = Config()
+    req = config['req']
+    req['prompt'] = 'no'
+    req['utf8'] = 'yes'
+    req['string_mask'] = string_mask
+    req['distinguished_name'] = 'req_dn'
+    req['x509_extensions'] = 'v3_ext'
+
+    req_dn = config['req_dn']
+    for num, (key, value) in enumerate(entries):
+        req_dn['{}.{}'.format(num, key)] = quote_value(value)
+
+    v3_ext = config['v3_ext']
+    v3_ext['subjectKeyIdentifier'] = 'hash'
+    for key, value in extensions:
+        v3_ext[key] = value
+
+    dir_sect = config['dir_sect']
+    for key, value in DIR_SECTION:
+        dir_sect[key] = quote_value(value)
+
+    return config.generate
+
+def main():
+    os.makedirs(OUTPUT_DIR, exist_ok=True)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        key_path = os.path.join(tmp_dir, 'key.pem')
+        subprocess.run([ 'openssl', 'genpkey', '-algorithm', 'EC', '-pkeyopt',
+                         'ec_paramgen_curve:P-256', '-out', key_path ], check=True)
+
+        for name, (entries, string_mask, extensions, serial, days) in sorted(CASES.items()):
+            config_path = os.path.join(tmp_dir, name + '.cnf')
+            with open(config_path, 'wt', encoding='utf-8') as fd:
+                fd.write(make_config(entries, string_mask, extensions))
+
+            subprocess.run([ 'openssl', 'req', '-new', '-x509', '-config', config_path,
+                             '-key', key_path, '-set_serial', serial, '-days', str(days),
+                             '-out', os.path.join(OUTPUT_DIR, name + '.pem') ], check=True)
+            print(name)
+
+if __name__ == '__main__':
+    main()
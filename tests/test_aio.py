@@ -0,0 +1,81 @@
+import asyncio
+import inspect
+import threading
+
+from test_x509 import FIXTURES, load
+
+from certman import AsyncOpenSSL, OpenSSL, PARSER_OPENSSL
+from certman import aio
+
+class CountingAsyncOpenSSL(AsyncOpenSSL):
+    running = 0
+    most = 0
+
+    async def get_info_openssl(self, context):
+        self.running += 1
+        self.most = max(self.most, self.running)
+        try:
+            await asyncio.sleep(0.01)
+            return await super().get_info_openssl(context)
+        finally:
+            self.running -= 1
+
+def subjects(infos):
+    return [ certinfo.subject for certinfo in infos ]
+
+def test_get_info_many_honours_jobs(openssl, monkeypatch):
+    def certificate_names(der):
+        raise aio.DecodeError('not named by the decoder')
+
+    # certificates the decoder cannot name are run one by one
+    monkeypatch.setattr(aio, 'certificate_names', certificate_names)
+    contexts = [ load(name) for name in FIXTURES ]
+    async_openssl = CountingAsyncOpenSSL(parser=PARSER_OPENSSL)
+    infos = asyncio.run(async_openssl.get_info_many(contexts, jobs=3))
+
+    assert async_openssl.most == 3
+    assert subjects(infos) == subjects(openssl.get_info_openssl(context) for context in contexts)
+
+def test_get_info_many_parses_off_the_loop(openssl, monkeypatch):
+    contexts = [ load(name) for name in FIXTURES ] * 2
+    assert len(contexts) > aio.INLINE_PARSE_LIMIT
+    threads = []
+
+    def parse_native_many(contexts):
+        threads.append(threading.current_thread())
+        return aio_parse_native_many(contexts)
+
+    aio_parse_native_many = aio.parse_native_many
+    monkeypatch.setattr(aio, 'parse_native_many', parse_native_many)
+
+    async_openssl = CountingAsyncOpenSSL()
+    infos = asyncio.run(async_openssl.get_info_many(contexts, jobs=2))
+
+    assert threads and threads[0] is not threading.main_thread()
+    # only the certificates the decoder rejects go to openssl
+    assert async_openssl.most <= 2
+    assert subjects(infos) == subjects(openssl.get_info(context) for context in contexts)
+
+def test_methods_running_openssl_are_coroutines():
+    for name, member in vars(OpenSSL).items():
+        if callable(member) and 'self.run(' in inspect.getsource(member):
+            assert inspect.iscoroutinefunction(getattr(AsyncOpenSSL, name)), name
+
+def test_get_info_many_batches_the_fallback(openssl):
+    contexts = [ load(name) for name in FIXTURES ]
+    async_openssl = CountingAsyncOpenSSL(parser=PARSER_OPENSSL)
+    infos = asyncio.run(async_openssl.get_info_many(contexts))
+
+    assert async_openssl.most == 0
+    assert subjects(infos) == subjects(openssl.get_info_openssl(context) for context in contexts)
+
+def test_inherited_helpers_run_async(store, openssl, root_context):
+    store.load_context(root_context, load_cert=True, load_key=True)
+    ca_paths = store.get_context_paths(root_context)
+    async_openssl = AsyncOpenSSL()
+
+    public_key = asyncio.run(async_openssl.public_key(root_context.private_key))
+    assert public_key == openssl.public_key(root_context.private_key)
+
+    crl = asyncio.run(async_openssl.crl(ca_paths, '', 1, 30))
+    assert crl.startswith('-----BEGIN X509 CRL-----')
@@ -0,0 +1,49 @@
+import os
+import builtins
+
+from conftest import certman
+
+from certman import ArtifactCache, Context
+from certman import artifacts as artifacts_module
+
+def stat_key(path):
+    st = os.stat(path)
+    return st.st_ino, st.st_mtime_ns
+
+def test_current_artifact_is_served_as_is(store_dir):
+    certman(store_dir, 'cert', '--key-type', 'rsa', '-b', '2048', '-a', 'root', 'leaf')
+    rsa_path = store_dir / 'root.d' / 'private' / 'leaf.rsa'
+    key_path = store_dir / 'root.d' / 'private' / 'leaf.key'
+
+    first = certman(store_dir, 'get-cert', '-a', 'root', '-r', 'leaf').stdout
+    assert 'BEGIN RSA PRIVATE KEY' in first
+    before = stat_key(rsa_path)
+
+    # newer than its key, as left by earlier versions
+    os.utime(rsa_path, ns=(before[1] + 10**9, before[1] + 10**9))
+    before = stat_key(rsa_path)
+    assert certman(store_dir, 'get-cert', '-a', 'root', '-r', 'leaf').stdout == first
+    assert stat_key(rsa_path) == before
+
+    # older than its key, so rebuilt
+    key_mtime = os.stat(key_path).st_mtime_ns
+    os.utime(rsa_path, ns=(key_mtime - 10**9, key_mtime - 10**9))
+    assert certman(store_dir, 'get-cert', '-a', 'root', '-r', 'leaf').stdout == first
+    assert stat_key(rsa_path)[1] == key_mtime
+
+def test_artifacts_of_read_only_stores_are_not_kept(store_dir, store, openssl, monkeypatch):
+    certman(store_dir, 'cert', '--key-type', 'ec', '-a', 'root', 'leaf')
+
+    def read_only_open(path, mode='r', *args, **kwargs):
+        if 'w' in mode:
+            raise PermissionError(13, 'Permission denied', path)
+        return builtins.open(path, mode, *args, **kwargs)
+
+    monkeypatch.setattr(artifacts_module, 'open', read_only_open, raising=False)
+    artifacts = ArtifactCache(store, openssl)
+    context = Context('leaf', ca_context=Context('root', is_ca=True))
+
+    assert artifacts.get_text(context, 'fullchain').count('BEGIN CERTIFICATE') == 2
+    assert artifacts.get(context, 'p12')
+    assert sorted(path.name for path in (store_dir / 'root.d').iterdir()) == [ 'leaf.pem', 'private' ]
+    assert sorted(path.name for path in (store_dir / 'root.d' / 'private').iterdir()) == [ 'leaf.key' ]
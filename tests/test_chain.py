@@ -0,0 +1,84 @@
+import os
+import subprocess
+
+import pytest
+
+from conftest import certman
+
+from certman import ArtifactCache, Context, StoreIndex
+
+@pytest.fixture(params=[ False, True ], ids=[ 'no-index', 'index' ])
+def chain_store(store_dir, store, openssl, request):
+    certman(store_dir, 'ca', '--key-type', 'ec', '-a', 'root', 'inter')
+    certman(store_dir, 'ca', '--key-type', 'ec', '-a', 'inter', 'inter2')
+    for name in ('leaf1', 'leaf2'):
+        certman(store_dir, 'cert', '--key-type', 'ec', '-a', 'inter2', name)
+    certman(store_dir, 'cert', '--key-type', 'ec', '-a', 'root', 'direct')
+    if request.param:
+        certman(store_dir, 'reindex')
+        store.index = StoreIndex(store, openssl)
+    return store
+
+def leaf(name, ca_name):
+    return Context(name, ca_context=Context(ca_name, is_ca=True))
+
+def test_chain_is_walked_once_per_ca(store_dir, chain_store, openssl, monkeypatch):
+    artifacts = ArtifactCache(chain_store, openssl)
+    lookups = []
+    find_ca = artifacts.find_ca
+    monkeypatch.setattr(artifacts, 'find_ca', lambda subject: lookups.append(subject) or find_ca(subject))
+
+    first = leaf('leaf1', 'inter2')
+    assert [ context.basename for context in artifacts.chain(first) ] == [ 'inter2', 'inter', 'root' ]
+    assert first.ca_certificates == [ (store_dir / (name + '.pem')).read_text()
+                                      for name in ('inter2', 'inter', 'root') ]
+    assert len(lookups) == 2
+
+    # the second leaf of the CA, and the CA itself, reuse the walk
+    second = leaf('leaf2', 'inter2')
+    assert [ context.basename for context in artifacts.chain(second) ] == [ 'inter2', 'inter', 'root' ]
+    assert [ context.basename for context in artifacts.chain(Context('inter', is_ca=True)) ] == [ 'root' ]
+    assert artifacts.issuers('inter2') is artifacts.issuers('inter2')
+    assert len(lookups) == 2
+
+    assert [ context.basename for context in artifacts.chain(leaf('direct', 'root')) ] == [ 'root' ]
+    assert artifacts.chain(Context('root', is_ca=True)) == []
+    assert len(lookups) == 2
+
+def test_fullchain_verifies(store_dir, chain_store, openssl, tmp_path):
+    artifacts = ArtifactCache(chain_store, openssl)
+    context = chain_store.load_context(leaf('leaf1', 'inter2'), load_cert=True)
+    fullchain = artifacts.get_text(context, 'fullchain')
+    chain = artifacts.get_text(context, 'chain')
+
+    assert fullchain == context.certificate + chain
+    untrusted = tmp_path / 'untrusted.pem'
+    untrusted.write_text(chain)
+    subprocess.run([ 'openssl', 'verify', '-CAfile', str(store_dir / 'root.pem'),
+                     '-untrusted', str(untrusted) ], input=context.certificate,
+                   universal_newlines=True, stdout=subprocess.PIPE, check=True)
+
+def test_chain_is_kept_beside_the_ca(store_dir, chain_store, openssl, monkeypatch):
+    ArtifactCache(chain_store, openssl).chain(leaf('leaf1', 'inter2'))
+    assert (store_dir / 'inter2.issuers').read_text().count('BEGIN CERTIFICATE') == 2
+
+    # a new cache, as in the next command, reads the walk back
+    artifacts = ArtifactCache(chain_store, openssl)
+    lookups = []
+    find_ca = artifacts.find_ca
+    monkeypatch.setattr(artifacts, 'find_ca', lambda subject: lookups.append(subject) or find_ca(subject))
+    context = leaf('leaf2', 'inter2')
+    assert [ ca_context.basename for ca_context in artifacts.chain(context) ] == [ 'inter2', 'inter', 'root' ]
+    assert context.ca_certificates == [ (store_dir / (name + '.pem')).read_text()
+                                        for name in ('inter2', 'inter', 'root') ]
+    assert lookups == []
+
+    # rewriting a certificate on the chain walks it again
+    inter = store_dir / 'inter.pem'
+    mtime = inter.stat().st_mtime_ns + 10**9
+    os.utime(inter, ns=(mtime, mtime))
+    artifacts = ArtifactCache(chain_store, openssl)
+    monkeypatch.setattr(artifacts, 'find_ca', lambda subject: lookups.append(subject) or find_ca(subject))
+    assert [ ca_context.basename for ca_context in artifacts.chain(leaf('leaf1', 'inter2')) ] == [
+        'inter2', 'inter', 'root' ]
+    assert len(lookups) == 2
@@ -0,0 +1,69 @@
+import re
+import subprocess
+
+import pytest
+
+from certman import RevocationList
+
+def crl_text(crl, store_dir):
+    return subprocess.run([ 'openssl', 'crl', '-noout', '-text', '-CAfile', str(store_dir / 'root.pem') ],
+                          input=crl, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                          universal_newlines=True, check=True)
+
+def describe(crl, store_dir):
+    result = crl_text(crl, store_dir)
+    assert 'verify OK' in result.stderr
+    text = result.stdout
+    number = int(re.search(r'X509v3 CRL Number: *\n *([0-9]+)', text).group(1))
+    base = re.search(r'X509v3 Delta CRL Indicator: critical *\n *([0-9]+)', text)
+    serials = re.findall(r'Serial Number: *([0-9A-F]+)', text)
+    return number, int(base.group(1)) if base else None, sorted(int(serial, 16) for serial in serials)
+
+def test_delta_crl_numbering(store_dir, store, openssl, root_context):
+    revocations = RevocationList(store, root_context)
+
+    with pytest.raises(Exception, match='No full CRL'):
+        revocations.generate_crl(openssl, delta=True)
+
+    revocations.revoke_many([ '01', '02' ])
+    crl, is_delta = revocations.generate_crl(openssl)
+    assert not is_delta
+    assert describe(crl, store_dir) == (1, None, [ 1, 2 ])
+
+    # deltas list what was revoked since the base, and point at its number
+    revocations.revoke('03')
+    crl, is_delta = revocations.generate_crl(openssl)
+    assert is_delta
+    assert describe(crl, store_dir) == (2, 1, [ 3 ])
+
+    revocations.revoke('04')
+    crl, is_delta = revocations.generate_crl(openssl, delta=True)
+    assert describe(crl, store_dir) == (3, 1, [ 3, 4 ])
+    assert (store_dir / 'root.delta.crl').read_text() == crl
+
+    # a full CRL becomes the new base, and shares the number sequence
+    crl, is_delta = revocations.generate_crl(openssl, delta=False)
+    assert not is_delta
+    assert describe(crl, store_dir) == (4, None, [ 1, 2, 3, 4 ])
+    assert (store_dir / 'root.crl').read_text() == crl
+
+    revocations.revoke('05')
+    crl, _ = revocations.generate_crl(openssl)
+    assert describe(crl, store_dir) == (5, 4, [ 5 ])
+
+    # too many revocations for a delta
+    revocations.revoke('06')
+    crl, is_delta = revocations.generate_crl(openssl, max_delta=1)
+    assert not is_delta
+    assert describe(crl, store_dir) == (6, None, [ 1, 2, 3, 4, 5, 6 ])
+
+def test_numbering_survives_a_new_process(store_dir, store, openssl, root_context):
+    revocations = RevocationList(store, root_context)
+    revocations.revoke('0A')
+    revocations.generate_crl(openssl)
+
+    revocations = RevocationList(store, root_context)
+    revocations.revoke('0B')
+    crl, is_delta = revocations.generate_crl(openssl)
+    assert is_delta
+    assert describe(crl, store_dir) == (2, 1, [ 11 ])
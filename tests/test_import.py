@@ -0,0 +1,105 @@
+import random
+import subprocess
+
+import pytest
+
+from certman import (Context, PEMImporter, SerialAllocator, Store, IMPORTED, EXISTS, FAILED,
+                     parse_pem)
+
+def openssl(*args, input=None):
+    return subprocess.run([ 'openssl' ] + list(args), input=input, stdout=subprocess.PIPE,
+                          stderr=subprocess.PIPE, universal_newlines=True, check=True).stdout
+
+def generate_key(tmp_path, name, *genpkey_args):
+    path = tmp_path / (name + '.key')
+    path.write_text(openssl('genpkey', *genpkey_args))
+    return path
+
+def sign(tmp_path, name, key_path, ca_name, serial):
+    request = openssl('req', '-new', '-key', str(key_path), '-subj', '/CN={}.example'.format(name))
+    return openssl('x509', '-req', '-CA', str(tmp_path / (ca_name + '.pem')),
+                   '-CAkey', str(tmp_path / (ca_name + '.key')), '-set_serial', str(serial),
+                   '-days', '30', input=request)
+
+def cert_public_key(pem):
+    return openssl('x509', '-noout', '-pubkey', input=pem)
+
+def key_public_key(pem):
+    return openssl('pkey', '-pubout', input=pem)
+
+EC = ('-algorithm', 'EC', '-pkeyopt', 'ec_paramgen_curve:P-256')
+RSA = ('-algorithm', 'RSA', '-pkeyopt', 'rsa_keygen_bits:1024')
+
+# external CA with leaves whose keys come in every supported format
+@pytest.fixture
+def bundle(store_dir, tmp_path_factory):
+    tmp_path = tmp_path_factory.mktemp('bundle')
+    ca_key = generate_key(tmp_path, 'extca', *EC)
+    (tmp_path / 'extca.pem').write_text(openssl(
+        'req', '-x509', '-new', '-key', str(ca_key), '-subj', '/CN=External CA', '-days', '30',
+        '-addext', 'basicConstraints=critical,CA:TRUE', '-addext', 'keyUsage=keyCertSign,cRLSign'))
+
+    blocks = [ (tmp_path / 'extca.pem').read_text(), ca_key.read_text() ]
+    keys = {
+        'pkcs8-rsa': generate_key(tmp_path, 'pkcs8-rsa', *RSA).read_text(),
+        'pkcs8-ec': generate_key(tmp_path, 'pkcs8-ec', *EC).read_text(),
+        'ed25519': generate_key(tmp_path, 'ed25519', '-algorithm', 'ED25519').read_text(),
+    }
+    keys['traditional-rsa'] = openssl('rsa', '-traditional',
+                                      input=generate_key(tmp_path, 'trsa', *RSA).read_text())
+    keys['traditional-ec'] = openssl('ec', input=generate_key(tmp_path, 'tec', *EC).read_text())
+
+    certs = {}
+    for serial, (name, key) in enumerate(sorted(keys.items()), 100):
+        key_path = tmp_path / (name + '.in.key')
+        key_path.write_text(key)
+        certs[name] = sign(tmp_path, name, key_path, 'extca', serial)
+        blocks += [ certs[name], key ]
+
+    # no key for this one, and a key for no certificate
+    orphan_key = generate_key(tmp_path, 'orphan', *EC)
+    certs['keyless'] = sign(tmp_path, 'keyless', orphan_key, 'extca', 200)
+    blocks += [ certs['keyless'], generate_key(tmp_path, 'stray', *EC).read_text() ]
+
+    random.Random(1).shuffle(blocks)
+    path = tmp_path / 'bundle.pem'
+    path.write_text('some text before\n' + ''.join(blocks) + 'and after\n')
+    return path, certs, keys
+
+def run_import(store, openssl_engine, path):
+    with PEMImporter(store, openssl_engine) as importer:
+        results = importer.run([ str(path) ])
+    return { (result.ca_name, result.name): result for result in results }
+
+def test_import_matches_keys_to_certificates(store, openssl, bundle):
+    path, certs, keys = bundle
+    results = run_import(store, openssl, path)
+
+    assert results[(None, 'External_CA')].status == IMPORTED
+    ca_context = Context('External_CA', is_ca=True)
+
+    for name, key in keys.items():
+        assert results[('External_CA', name + '.example')].status == IMPORTED
+        context = store.load_context(Context(name + '.example', ca_context=ca_context),
+                                     load_cert=True, load_key=True)
+        assert context.certificate == certs[name]
+        assert 'BEGIN PRIVATE KEY' in context.private_key
+        assert key_public_key(context.private_key) == cert_public_key(context.certificate)
+        assert key_public_key(context.private_key) == key_public_key(key)
+
+    keyless = results[('External_CA', 'keyless.example')]
+    assert keyless.status == FAILED and 'No matching private key' in keyless.error
+
+    # sequential serials of the CA continue past the imported ones
+    assert SerialAllocator(store).allocate(ca_context) > 200 > max(
+        int(parse_pem(cert).serial, 16) for name, cert in certs.items() if name != 'keyless')
+
+def test_import_is_idempotent(store_dir, store, openssl, bundle):
+    path, certs, keys = bundle
+    run_import(store, openssl, path)
+    before = sorted(p.relative_to(store_dir) for p in store_dir.rglob('*') if p.is_file())
+
+    results = run_import(Store(str(store_dir), durable=False), openssl, path)
+    assert [ key for key, result in results.items() if result.status == IMPORTED ] == []
+    assert all(results[('External_CA', name + '.example')].status == EXISTS for name in keys)
+    assert sorted(p.relative_to(store_dir) for p in store_dir.rglob('*') if p.is_file()) == before
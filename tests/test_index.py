@@ -0,0 +1,42 @@
+import sqlite3
+
+import pytest
+
+from conftest import certman
+
+from certman import StoreIndex
+
+def index_files(store_dir):
+    return sorted(path.name for path in store_dir.iterdir() if path.name.startswith(StoreIndex.INDEX_FILENAME))
+
+def test_reading_commands_do_not_create_the_index(store_dir):
+    certman(store_dir, 'cert', '--key-type', 'ec', '-a', 'root', 'leaf')
+
+    assert 'CN=leaf' in certman(store_dir, 'tree').stdout
+    assert 'root/leaf' in certman(store_dir, 'expiring', '--within', '100000d').stdout
+    assert index_files(store_dir) == []
+
+def test_reading_commands_leave_the_index_untouched(store_dir):
+    certman(store_dir, 'cert', '--key-type', 'ec', '-a', 'root', 'leaf')
+    certman(store_dir, 'cert', '--key-type', 'ec', '-a', 'root', 'gone')
+    certman(store_dir, 'reindex')
+    index_path = store_dir / StoreIndex.INDEX_FILENAME
+    assert index_files(store_dir) == [ StoreIndex.INDEX_FILENAME ]
+    before = index_path.read_bytes()
+
+    (store_dir / 'root.d' / 'gone.pem').unlink()
+    output = certman(store_dir, 'tree').stdout
+    assert 'CN=leaf' in output and 'CN=gone' not in output
+    assert 'root/leaf' in certman(store_dir, 'expiring', '--within', '100000d').stdout
+
+    assert index_files(store_dir) == [ StoreIndex.INDEX_FILENAME ]
+    assert index_path.read_bytes() == before
+    with sqlite3.connect(str(index_path)) as db:
+        assert db.execute('SELECT count(*) FROM certs').fetchone()[0] == 3
+
+def test_read_only_index_does_not_write(store_dir, store, openssl):
+    certman(store_dir, 'cert', '--key-type', 'ec', '-a', 'root', 'leaf')
+    index = StoreIndex(store, openssl, read_only=True)
+    with pytest.raises(sqlite3.Error):
+        index.db
+    assert index_files(store_dir) == []
@@ -0,0 +1,85 @@
+import os
+import stat
+
+import pytest
+
+from certman import Context, Store
+from certman import store as store_module
+
+from test_group_commit import leaf, CERT, KEY
+
+NAMES = [ 'leaf{:02}'.format(num) for num in range(30) ]
+
+class Interrupted(BaseException):
+    pass
+
+def listed(store, ca_context):
+    return sorted(context.basename for context in store.get_certs(ca_context, load_cert=False))
+
+def check_leaves(store, root_context, names):
+    assert listed(store, root_context) == sorted(names)
+    for name in names:
+        context = store.load_context(Context(name, ca_context=root_context),
+                                     load_cert=True, load_key=True)
+        assert context.certificate == CERT.format(name)
+        assert context.private_key == KEY.format(name)
+
+@pytest.fixture
+def flat_store(store_dir, monkeypatch):
+    monkeypatch.setattr(store_module, 'FORMAT_CHECK_INTERVAL', 0)
+    monkeypatch.setattr(store_module, 'MIGRATE_CHUNK', 7)
+    store = Store(str(store_dir), durable=False)
+    with store.group_commit():
+        for name in NAMES:
+            store.store(leaf(name))
+    yield store
+    store.close()
+
+def test_interrupted_migration_resumes(store_dir, flat_store, root_context, monkeypatch):
+    unlinks = []
+    real_unlink = os.unlink
+
+    # dies halfway through the second chunk, after some of its links were made
+    def unlink(path, *args, **kwargs):
+        unlinks.append(path)
+        if len(unlinks) == 10:
+            raise Interrupted()
+        real_unlink(path, *args, **kwargs)
+
+    monkeypatch.setattr(os, 'unlink', unlink)
+    with pytest.raises(Interrupted):
+        flat_store.migrate(2)
+    monkeypatch.setattr(os, 'unlink', real_unlink)
+
+    # another process finds the store half moved, and sees every leaf once
+    store = Store(str(store_dir), durable=False)
+    store_format = store.format(fresh=True)
+    assert store_format.migrating and store_format.shard_levels == 2
+    flat_left = [ f for f in os.listdir(str(store_dir / 'root.d')) if f.endswith('.pem') ]
+    assert 0 < len(flat_left) < len(NAMES)
+    check_leaves(store, root_context, NAMES)
+
+    # writes during the migration go to the new layout
+    store.store(leaf('late'))
+    assert 'late.pem' not in os.listdir(str(store_dir / 'root.d'))
+
+    assert store.migrate(2) > 0
+    store_format = store.format(fresh=True)
+    assert not store_format.migrating
+
+    assert not [ f for f in os.listdir(str(store_dir / 'root.d')) if f.endswith('.pem') ]
+    assert not os.listdir(str(store_dir / 'root.d' / 'private'))
+    check_leaves(Store(str(store_dir), durable=False), root_context, NAMES + [ 'late' ])
+
+    for name in NAMES:
+        paths = store.get_context_paths(Context(name, ca_context=root_context))
+        assert os.path.relpath(paths.cert, str(store_dir / 'root.d')).count(os.sep) == 2
+        assert stat.S_IMODE(os.stat(os.path.dirname(paths.key)).st_mode) == 0o700
+
+    # nothing left to do
+    assert store.migrate(2) == 0
+
+def test_migration_to_other_depth_is_refused(flat_store):
+    flat_store.migrate(1)
+    with pytest.raises(Exception, match='already sharded'):
+        flat_store.migrate(2)
@@ -0,0 +1,46 @@
+import subprocess
+
+from conftest import certman
+
+from certman import OCSPResponder
+from certman.ocsp import RESPONSE_TRY_LATER
+
+def ocsp_request(store_dir, name, tmp_path):
+    path = tmp_path / (name + '.req')
+    subprocess.run([ 'openssl', 'ocsp', '-no_nonce', '-issuer', str(store_dir / 'root.pem'),
+                     '-cert', str(store_dir / 'root.d' / (name + '.pem')), '-reqout', str(path) ],
+                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+    return path.read_bytes()
+
+def test_new_certificates_are_signed_ahead(store_dir, store, openssl, tmp_path):
+    certman(store_dir, 'cert', '--key-type', 'ec', '-a', 'root', 'first')
+    responder = OCSPResponder(store, openssl, minutes=60)
+    responder.load_issuers()
+    responder.refresh(initial=True)
+    assert len(responder.cache) == 1
+
+    certman(store_dir, 'cert', '--key-type', 'ec', '-a', 'root', 'second')
+    responder.refresh()
+    assert len(responder.cache) == 2
+
+    for name in ('first', 'second'):
+        der, next_update = responder.lookup(ocsp_request(store_dir, name, tmp_path))
+        assert der != RESPONSE_TRY_LATER
+        assert next_update
+
+    # nothing new, nothing signed again
+    cached = dict((key, responder.cache.peek(key)) for key in responder.cache.keys())
+    responder.refresh()
+    assert all(responder.cache.peek(key) is response for key, response in cached.items())
+
+def test_refresh_failures_are_logged_when_verbose(store, openssl, capsys):
+    for verbose in (False, True):
+        responder = OCSPResponder(store, openssl, check_interval=0.01, verbose=verbose)
+
+        def refresh(initial=False):
+            responder.stopping.set()
+            raise OSError('disk gone')
+
+        responder.refresh = refresh
+        responder.run()
+        assert ('OCSP refresh failed: disk gone' in capsys.readouterr().err) is verbose
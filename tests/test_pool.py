@@ -0,0 +1,67 @@
+import sys
+import time
+import threading
+
+from certman import OpenSSLPool
+
+# an interactive openssl stand-in: echoes commands, "crash" makes it exit
+FAKE_OPENSSL = '''#!{}
+import sys, time
+sys.stdout.write('OpenSSL> ')
+sys.stdout.flush()
+for line in sys.stdin:
+    args = line.split()
+    if not args or args[0] == 'quit':
+        break
+    if args[0] == 'crash':
+        time.sleep(0.3)
+        sys.exit(1)
+    sys.stdout.write(' '.join(args) + '\\nOpenSSL> ')
+    sys.stdout.flush()
+'''
+
+def fake_openssl(tmp_path):
+    path = tmp_path / 'openssl'
+    path.write_text(FAKE_OPENSSL.format(sys.executable))
+    path.chmod(0o755)
+    return str(path)
+
+def test_waiter_takes_over_slot_of_crashed_worker(tmp_path):
+    pool = OpenSSLPool(binary=fake_openssl(tmp_path), workers=1)
+    assert pool.engine == 'persistent'
+    errors = []
+    outputs = []
+
+    def crash():
+        try:
+            pool.run([ 'crash' ])
+        except Exception as e:
+            errors.append(e)
+
+    crasher = threading.Thread(target=crash)
+    crasher.start()
+    # the only worker is busy until it crashes
+    deadline = time.monotonic() + 5
+    while pool._idle and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+    waiter = threading.Thread(target=lambda: outputs.append(pool.run([ 'version' ])))
+    waiter.start()
+    crasher.join(10)
+    waiter.join(10)
+    try:
+        assert not waiter.is_alive()
+        assert len(errors) == 1
+        assert outputs == [ 'version\n' ]
+        assert pool._started == 1
+    finally:
+        pool.close()
+
+def test_binary_without_interactive_mode_spawns(tmp_path):
+    pool = OpenSSLPool()
+    try:
+        if pool.engine == 'spawn':
+            assert pool._started == 0
+        assert pool.run([ 'version' ]).startswith('OpenSSL')
+    finally:
+        pool.close()
@@ -0,0 +1,44 @@
+import subprocess
+
+from conftest import certman
+
+from certman.x509 import pem_to_der, subject_name, parse_der
+
+def read_subject(path):
+    der = pem_to_der(path.read_text())
+    return subject_name(der)[1], parse_der(der)
+
+def test_renewal_keeps_subject_byte_for_byte(store_dir):
+    certman(store_dir, 'cert', '--key-type', 'ec', '-a', 'root', '-O', 'Acme, Inc', 'commaorg')
+    certman(store_dir, 'cert', '--key-type', 'ec', '-a', 'root', '-O', 'Ünïcode Org',
+            '-U', 'a"b\\c', '-U', '#x $HOME', 'unicode')
+
+    for name in ('commaorg', 'unicode'):
+        path = store_dir / 'root.d' / (name + '.pem')
+        subject, certinfo = read_subject(path)
+        for _ in range(2):
+            certman(store_dir, 'renew', '-a', 'root', name)
+            renewed_subject, renewed = read_subject(path)
+            assert renewed_subject == subject
+            assert renewed.subject == certinfo.subject
+            assert renewed.serial != certinfo.serial
+
+    assert read_subject(store_dir / 'root.d' / 'unicode.pem')[1].subject == \
+        'O=Ünïcode Org, OU=a\\"b\\\\c, OU=\\#x $HOME, CN=unicode'
+
+def test_renewal_refused_when_subject_would_change(store_dir, tmp_path):
+    config = tmp_path / 'bmp.cnf'
+    config.write_text('[req]\ndistinguished_name = dn\nprompt = no\nstring_mask = default\n'
+                      'utf8 = yes\n[dn]\nO = Ωmega Org\nCN = bmp.example\n')
+    bundle = subprocess.run([ 'openssl', 'req', '-x509', '-newkey', 'ec', '-pkeyopt',
+                              'ec_paramgen_curve:P-256', '-nodes', '-config', str(config),
+                              '-keyout', '-', '-days', '30' ],
+                            stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, check=True).stdout
+    certman(store_dir, 'import', '-', input=bundle.decode())
+
+    path = store_dir / '+SELF_SIGNED.d' / 'bmp.example.pem'
+    before = path.read_text()
+    result = certman(store_dir, 'renew', '-s', 'bmp.example', check=False)
+    assert result.returncode
+    assert 'subject of the renewed certificate differs' in result.stdout + result.stderr
+    assert path.read_text() == before
@@ -0,0 +1,52 @@
+import sys
+import subprocess
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor
+
+from conftest import MAIN
+
+from certman import Context, SerialAllocator, Store, parse_pem
+
+ROOT = Context('root', is_ca=True)
+
+def allocate_many(store_dir, count):
+    serials = SerialAllocator(Store(store_dir, durable=False))
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        return list(executor.map(lambda _: serials.allocate(ROOT), range(count)))
+
+def test_concurrent_allocation_never_repeats(tmp_path):
+    store_dir = str(tmp_path)
+    first = SerialAllocator(Store(store_dir)).allocate(ROOT)
+
+    context = multiprocessing.get_context('fork')
+    with context.Pool(4) as pool:
+        results = pool.starmap(allocate_many, [ (store_dir, 50) ] * 4)
+
+    serials = [ serial for result in results for serial in result ]
+    assert len(set(serials)) == 200
+    assert sorted(serials) == list(range(first + 1, first + 201))
+    assert (tmp_path / 'root.serial').read_text() == '{:X}\n'.format(first + 201)
+
+def test_reserve_and_advance_past(tmp_path):
+    serials = SerialAllocator(Store(str(tmp_path), durable=False))
+    reserved = serials.reserve(ROOT, 10)
+    assert len(reserved) == 10
+
+    serials.advance_past(ROOT, reserved[-1] + 100)
+    assert serials.allocate(ROOT) == reserved[-1] + 101
+    # never moves backwards
+    serials.advance_past(ROOT, reserved[0])
+    assert serials.allocate(ROOT) == reserved[-1] + 102
+
+def test_concurrent_issuance_gets_distinct_serials(store_dir):
+    procs = [ subprocess.Popen([ sys.executable, MAIN, '-s', str(store_dir), '--no-sync', 'cert',
+                                 '--key-type', 'ec', '-a', 'root', 'leaf{}'.format(num) ],
+                               stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+              for num in range(8) ]
+    for proc in procs:
+        assert proc.wait() == 0, proc.stderr.read()
+
+    serials = [ int(parse_pem((store_dir / 'root.d' / 'leaf{}.pem'.format(num)).read_text()).serial, 16)
+                for num in range(8) ]
+    assert len(set(serials)) == 8
+    assert max(serials) - min(serials) == 7
@@ -0,0 +1,81 @@
+import json
+import threading
+import urllib.error
+import urllib.request
+
+import pytest
+
+from conftest import certman
+
+from certman import CertificateService, make_server
+
+@pytest.fixture
+def serve(store_dir, store, openssl):
+    servers = []
+
+    def start(**kwargs):
+        service = CertificateService(store, openssl, workers=1)
+        server = make_server(service, port=0, **kwargs)
+        service.start()
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        servers.append((server, service))
+        return 'http://127.0.0.1:{}'.format(server.server_address[1])
+
+    yield start
+    for server, service in servers:
+        server.shutdown()
+        server.server_close()
+        service.stop()
+
+def call(url, body=None):
+    data = json.dumps(body).encode() if body is not None else None
+    try:
+        with urllib.request.urlopen(url, data=data) as response:
+            return response.status, json.load(response)
+    except urllib.error.HTTPError as e:
+        return e.code, json.load(e)
+
+def test_private_keys_are_not_served_by_default(store_dir, serve):
+    certman(store_dir, 'cert', '--key-type', 'ec', '-a', 'root', 'leaf')
+    url = serve()
+
+    status, result = call(url + '/get-cert?ca=root&name=leaf')
+    assert status == 200 and 'private_key' not in result
+    assert call(url + '/get-cert?ca=root&name=leaf&key=1')[0] == 403
+    assert call(url + '/get-ca?name=root&key=1')[0] == 403
+
+    status, result = call(url + '/issue', { 'name': 'issued', 'ca': 'root', 'key_type': 'ec' })
+    assert status == 200 and 'private_key' not in result
+    assert (store_dir / 'root.d' / 'private' / 'issued.key').exists()
+
+def test_private_keys_on_loopback_with_flag(store_dir, serve):
+    certman(store_dir, 'cert', '--key-type', 'ec', '-a', 'root', 'leaf')
+    url = serve(allow_private_keys=True)
+
+    status, result = call(url + '/get-cert?ca=root&name=leaf&key=1')
+    assert status == 200
+    assert result['private_key'] == (store_dir / 'root.d' / 'private' / 'leaf.key').read_text()
+
+    status, result = call(url + '/issue', { 'name': 'issued', 'ca': 'root', 'key_type': 'ec' })
+    assert status == 200 and 'PRIVATE KEY' in result['private_key']
+
+def test_private_keys_refused_on_other_addresses(store, openssl):
+    service = CertificateService(store, openssl, workers=1)
+    with pytest.raises(ValueError):
+        make_server(service, host='0.0.0.0', port=0, allow_private_keys=True)
+
+def test_path_like_names_are_rejected(store_dir, serve):
+    certman(store_dir, 'cert', '--key-type', 'ec', '-a', 'root', 'leaf')
+    url = serve()
+    before = sorted(store_dir.parent.rglob('*'))
+
+    for name in [ '../../escaped', 'a/b', '.hidden', '+SELF_SIGNED', '..' ]:
+        status, _ = call(url + '/issue', { 'name': name, 'ca': 'root', 'key_type': 'ec' })
+        assert status == 400, name
+    assert call(url + '/issue', { 'name': 'ok', 'ca': '../root', 'key_type': 'ec' })[0] == 400
+    assert call(url + '/get-cert?ca=..&name=..')[0] == 400
+    assert call(url + '/get-cert?ca=root&name=../root')[0] == 400
+    assert call(url + '/get-ca?name=../root.d/leaf')[0] == 400
+
+    assert sorted(store_dir.parent.rglob('*')) == before
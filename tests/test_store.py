@@ -0,0 +1,47 @@
+import os
+
+from certman import store as store_module
+
+def open_fds():
+    return len(os.listdir('/proc/self/fd'))
+
+def test_dir_fd_cache_is_bounded(store, tmp_path):
+    dirs = []
+    for num in range(3 * store_module.DIR_FD_CACHE_SIZE):
+        path = tmp_path / 'dirs' / '{:03}'.format(num)
+        path.mkdir(parents=True)
+        (path / 'file.pem').write_text('')
+        dirs.append(str(path))
+
+    before = open_fds()
+    for path in dirs:
+        assert store.list_cert_files(path) == [ 'file.pem' ]
+        assert store.exists(os.path.join(path, 'file.pem'))
+
+    assert len(store._dir_fds) == store_module.DIR_FD_CACHE_SIZE
+    assert open_fds() - before <= store_module.DIR_FD_CACHE_SIZE
+
+    store.close()
+    assert open_fds() <= before
+
+def test_evicted_dir_fd_stays_open_while_in_use(store, tmp_path):
+    with store.dir_fd(str(tmp_path)) as dir_fd:
+        for num in range(store_module.DIR_FD_CACHE_SIZE + 1):
+            path = tmp_path / 'd{}'.format(num)
+            path.mkdir()
+            store.exists(str(path / 'x'))
+        assert str(tmp_path) not in store._dir_fds
+        os.fstat(dir_fd)
+
+def test_recreated_directory_is_reopened(store, tmp_path):
+    path = tmp_path / 'leaves'
+    path.mkdir()
+    (path / 'a.pem').write_text('')
+    assert store.list_cert_files(str(path)) == [ 'a.pem' ]
+
+    (path / 'a.pem').unlink()
+    path.rmdir()
+    path.mkdir()
+    (path / 'b.pem').write_text('')
+    assert store.list_cert_files(str(path)) == [ 'b.pem' ]
+    assert store.exists(str(path / 'b.pem'))
@@ -0,0 +1,22 @@
+from certman import OpenSSL, add_trace_hook, remove_trace_hook
+from certman import openssl as openssl_module
+
+def test_argv_is_summarized_only_when_tracing(monkeypatch):
+    summaries = []
+    argv_summary = openssl_module.argv_summary
+    monkeypatch.setattr(openssl_module, 'argv_summary',
+                        lambda args: summaries.append(args) or argv_summary(args))
+    openssl = OpenSSL()
+
+    openssl.run([ 'version' ])
+    assert summaries == []
+
+    events = []
+    hook = events.append
+    add_trace_hook(hook)
+    try:
+        openssl.run([ 'version' ])
+    finally:
+        remove_trace_hook(hook)
+    assert summaries == [ [ 'version' ] ]
+    assert events[0]['args']['argv'] == 'version'
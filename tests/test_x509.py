@@ -0,0 +1,69 @@
+import os
+import glob
+
+import pytest
+
+from certman import Context, DecodeError, parse_pem
+from certman.certinfo import CertInfo
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures', 'x509')
+FIXTURES = sorted(os.path.basename(path)[:-4] for path in glob.glob(os.path.join(FIXTURES_DIR, '*.pem')))
+
+# decoded by openssl only, see decode_serial()
+OPENSSL_ONLY = { 'negative-serial' }
+
+def load(name):
+    context = Context(name)
+    context.add_from_file(os.path.join(FIXTURES_DIR, name + '.pem'))
+    return context
+
+def fields(certinfo):
+    return { field: getattr(certinfo, field) for field in CertInfo.FIELDS }
+
+@pytest.mark.parametrize('name', [ name for name in FIXTURES if name not in OPENSSL_ONLY ])
+def test_native_decoder_matches_openssl(openssl, name):
+    context = load(name)
+    assert fields(parse_pem(context.certificate)) == fields(openssl.get_info_openssl(context))
+
+@pytest.mark.parametrize('name', sorted(OPENSSL_ONLY))
+def test_unsupported_certificates_fall_back_to_openssl(openssl, name):
+    context = load(name)
+    with pytest.raises(DecodeError):
+        parse_pem(context.certificate)
+    assert fields(openssl.get_info(context)) == fields(openssl.get_info_openssl(context))
+
+def test_fixture_values():
+    def decode(name):
+        return parse_pem(load(name).certificate)
+
+    assert decode('dn-escaping').subject == (
+        'O=Acme\\, Inc, OU=R\\+D, OU=say \\"hi\\", OU=back\\\\slash, L=\\#hash first, '
+        'ST=\\ space first, street=space last\\ , CN=semi\\;colon \\<angle\\> =equals')
+    assert decode('multi-valued-rdn').subject == (
+        'O=Acme, OU=One + CN=multi.example + emailAddress=admin@example.com')
+    assert decode('utf8-string').subject == 'O=Ünïcode Org, L=Zürich, CN=ユニコード.example'
+    assert decode('bmp-string').subject == 'O=Ωmega Org, CN=bmp.example'
+    assert decode('t61-string').subject == 'O=Café Org, CN=t61.example'
+    assert decode('generalized-time').not_after.year > 2049
+    assert decode('zero-serial').serial == '00'
+    assert decode('padded-serial').serial == '80FF00'
+    assert decode('long-serial').serial == 'F1E2D3C4B5A69788796A5B4C3D2E1F'
+    assert 'DirName:/C=GB/O=Dir, Org/CN=dir.example' in decode('san-kinds').subject_alt_name
+    assert decode('critical-extensions').basic_constraints == [ 'CA:TRUE', 'pathlen:0' ]
+
+def test_openssl_fallback_runs_once_per_batch(openssl):
+    contexts = [ load(name) for name in reversed(FIXTURES) ]
+    commands = []
+    run = openssl.run
+
+    def counting_run(args, *rest, **kwargs):
+        commands.append(args[0])
+        return run(args, *rest, **kwargs)
+
+    openssl.run = counting_run
+    infos = openssl.get_info_openssl_many(contexts)
+    assert commands == [ 'crl2pkcs7', 'pkcs7' ]
+
+    openssl.run = run
+    for context, certinfo in zip(contexts, infos):
+        assert fields(certinfo) == fields(openssl.get_info_openssl(context)), context.basename